@@ -14,26 +14,38 @@ There are two approaches to "resolving" labels:
 import re
 import sys
 import json
+import itertools
+import collections
 from pathlib import Path
 import argparse
 import configparser
-from typing import Dict, List,  Optional, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List,  Optional, TextIO, Tuple
+
+import objfile
+import tracing
 
 import logging
 logging.basicConfig()
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
+trace = tracing.tracer("assemble")
+
+
+# Where asm.conf, opdefs.txt, and OBJ are if not in the working directory
+HERE = Path(__file__).resolve().parent
 
 
 class Configuration:
     def __init__(self):
-        config = configparser.ConfigParser()
-        try:
-            config.read("asm.conf")
-            self.tvmlib = Path(config["DEFAULT"]["TVMLIB"])
-        except FileExistsError:
-            # If no configuration file is present, we will look in ./OBJ
-            self.tvmlib = Path("./OBJ")
+        # asm.conf in the working directory, else beside this file;
+        # a relative TVMLIB is relative to the directory it is in
+        for base in [Path("."), HERE]:
+            config = configparser.ConfigParser()
+            config.read(base / "asm.conf")
+            if "TVMLIB" in config["DEFAULT"]:
+                self.tvmlib = base / config["DEFAULT"]["TVMLIB"]
+                return
+        # If no configuration file is present, we will look in ./OBJ
+        self.tvmlib = Path("./OBJ") if Path("./OBJ").is_dir() else HERE / "OBJ"
 
 
 CONFIG = Configuration()  # Visible from any code
@@ -47,9 +59,62 @@ def cli() -> object:
     parser.add_argument("source", type=argparse.FileType("r"))
     parser.add_argument("target", type=argparse.FileType("w"),
                         nargs="?", default=sys.stdout)
+    parser.add_argument("--stream", action="store_true",
+                        help="Write each method's code as soon as it is done, "
+                             "rather than holding the whole class in memory")
+    parser.add_argument("--compact", action="store_true",
+                        help="Write JSON without indentation (much smaller "
+                             "for large classes)")
+    parser.add_argument("--binary", action="store_true",
+                        help=f"Write a binary ({objfile.SUFFIX}) module, which the "
+                             "VM loads faster, rather than JSON")
+    parser.add_argument("--no-peephole", dest="peephole", action="store_false",
+                        help="Leave the code just as written (no peephole optimization)")
+    parser.add_argument("--no-fuse", dest="fuse", action="store_false",
+                        help="Don't emit superinstructions for pairs of instructions")
+    parser.add_argument("--report", action="store_true",
+                        help="Report peak memory use, output size, and "
+                             "peephole optimizations on stderr")
+    tracing.add_trace_option(parser)
     return parser.parse_args()
 
 
+# ----------------
+#  Symbol tables:  Names of methods (the vtable), fields,
+#  local variables, and arguments, each at a position that
+#  becomes a slot or offset in the object code.  Generated
+#  classes may have hundreds of each, so we find positions
+#  by dict rather than by searching the list.
+#
+class SymbolTable(list):
+    """A list of names that finds the position of a name in
+    constant time.  Add names only with append (positions are not
+    maintained by other list operations).  Otherwise it is the
+    list, e.g., for json.dumps.
+    """
+    def __init__(self, names: Iterable[str] = ()):
+        super().__init__()
+        self.positions: Dict[str, int] = {}
+        for name in names:
+            self.append(name)
+
+    def append(self, name: str):
+        # Like list.index, a repeated name is found at its first position
+        self.positions.setdefault(name, len(self))
+        super().append(name)
+
+    def __contains__(self, name) -> bool:
+        return name in self.positions
+
+    def index(self, name: str, *bounds) -> int:
+        if bounds:
+            return super().index(name, *bounds)
+        try:
+            return self.positions[name]
+        except KeyError:
+            raise ValueError(f"{name!r} is not in list") from None
+
+
 # ----------------
 #  Imported modules:  What we need to know is
 #    - Slot numbers for methods, e.g., "print" is
@@ -58,20 +123,21 @@ def cli() -> object:
 #
 class ImportedModule:
     """Imported module uses information from
-    json file
+    json file, read through interfaces (a cache by path)
     """
-    def __init__(self, path: Path):
-        with open(path, "r") as source:
-            self.json = json.load(source)
-        # Dict from name to position would be faster, but
-        # number of lookups is very small
-        self.methods: List[str] = self.json["methods"]
-        self.fields:  List[str] = self.json["fields"]
+    def __init__(self, path: Path, interfaces: Dict[Path, dict]):
+        if path not in interfaces:
+            with open(path, "r") as source:
+                interfaces[path] = json.load(source)
+        self.json = interfaces[path]
+        self.methods = SymbolTable(self.json["methods"])
+        self.fields = SymbolTable(self.json["fields"])
 
     def method_slot(self, name: str) -> int:
-        if name in self.methods:
-            return self.methods.index(name)
-        log.error(f"Method {name} not defined")
+        slot = self.methods.positions.get(name)
+        if slot is not None:
+            return slot
+        log.error("Method %s not defined", name)
         return 0
 
     def n_methods(self) -> int:
@@ -81,15 +147,34 @@ class ImportedModule:
         return self.fields.index(name)
 
 
-IMPORTS: Dict[str, Optional[ImportedModule]] = { "$": None }
-# $ will be replaced by current class name in output .json file
+# Object files already read, by path, for translate (see
+# Assembler).  They outlive any one class, so a process that
+# assembles many classes (see batch_assemble.py) reads Int.json
+# and the like only once.  Treat them as read-only.
+INTERFACES: Dict[Path, dict] = {}
+
 
+class Imports:
+    """The modules one class imports, by name.  Positions are
+    class numbers in the object code; $ (the class itself, in the
+    object file's imports) is 0.
+    """
+    def __init__(self, tvmlib: Path, interfaces: Dict[Path, dict]):
+        self.tvmlib = tvmlib
+        self.interfaces = interfaces
+        self.modules: Dict[str, Optional[ImportedModule]] = {"$": None}
+        self.positions: Dict[str, int] = {"$": 0}
 
-def import_module(module: str) -> ImportedModule:
-    if module not in IMPORTS:
-        path = CONFIG.tvmlib.joinpath(module).with_suffix(".json")
-        IMPORTS[module] = ImportedModule(path)
-    return IMPORTS[module]
+    def module(self, name: str) -> ImportedModule:
+        if name not in self.modules:
+            path = self.tvmlib.joinpath(name).with_suffix(".json")
+            self.modules[name] = ImportedModule(path, self.interfaces)
+            self.positions[name] = len(self.positions)
+        return self.modules[name]
+
+    def names(self) -> List[str]:
+        """Imported modules, in class number order, without $"""
+        return list(self.modules)[1:]
 
 
 # The named literals MUST match the definitions
@@ -118,10 +203,13 @@ NAMED_LITERALS = {
 #
 
 class InstructionDef:
-    def __init__(self, name: str, code: int, ops: int):
+    def __init__(self, name: str, code: int, ops: int,
+                 parts: Tuple["InstructionDef", ...] = ()):
         self.name = name
         self.code = code
         self.ops = ops
+        # The operations a superinstruction does, in order
+        self.parts = parts
 
     def size(self) -> int:
         """An instruction without an operand
@@ -139,10 +227,17 @@ class InstructionDef:
 
 class InstructionSet:
     """A dict-like structure
-    mapping instruction names to InstructionCode objects
+    mapping instruction names to InstructionCode objects.
+    Superinstructions (a+b in the table) are not written in
+    assembly code, so they are not among the names; we emit them
+    for pairs of instructions (see Peephole).
     """
     def __init__(self, path: str):
         self.ops: Dict[str, InstructionDef] = {}
+        # (opcode, opcode) -> superinstruction
+        self.fused: Dict[Tuple[int, int], InstructionDef] = {}
+        # All of them, by opcode
+        self.codes: List[InstructionDef] = []
         """Instruction set initialized from text table"""
         opcode = 0
         with open(path, "r") as f:
@@ -154,8 +249,14 @@ class InstructionSet:
                 # What remains should be an instruction definition
                 parts = line.split(",")
                 name, code, ops = parts
-                instr = InstructionDef(name, opcode, ops)
-                self.ops[name] = instr
+                if "+" in name:
+                    first, second = (self.ops[part] for part in name.split("+"))
+                    instr = InstructionDef(name, opcode, ops, (first, second))
+                    self.fused[(first.code, second.code)] = instr
+                else:
+                    instr = InstructionDef(name, opcode, ops)
+                    self.ops[name] = instr
+                self.codes.append(instr)
                 opcode += 1
 
     def __getitem__(self, name: str):
@@ -174,8 +275,14 @@ class InstructionSet:
 # after all).  Create stub symbol files for built-ins.
 # So assembler does a lot of the symbolic -> numeric resolution. 
 
-# Instruction set is a global
-INSTRS = InstructionSet("opdefs.txt")
+# The instruction set for translate: opdefs.txt in the working
+# directory, as for the VM build, or else the one beside this file
+# (so the assembler can be imported from anywhere, as a library).
+# An Assembler may have another.
+OPDEFS = "opdefs.txt"
+if not Path(OPDEFS).exists():
+    OPDEFS = str(HERE / OPDEFS)
+INSTRS = InstructionSet(OPDEFS)
 
 
 class Instruction:
@@ -203,31 +310,267 @@ class Instruction:
         return f"{label} {self.operation.name} {operand}"
 
 
+# ----------------
+#  Peephole optimization.  Compiled and hand-written code has
+#  redundant sequences: a value stored and then loaded right back,
+#  a constant pushed only to be popped, jumps to jumps, jumps to
+#  the very next instruction, a conditional jump over a jump, and
+#  code after a return that nothing jumps to.  We clean up each method's code
+#  just before its jumps are resolved, while jump operands are
+#  still labels (label_patch), so that deleting instructions only
+#  means moving labels; resolve_jumps then computes the offsets.
+#  Last, pairs of instructions that the op table has a
+#  superinstruction for become that superinstruction (one
+#  dispatch in the VM rather than two), which also moves labels.
+#
+
+class Peephole:
+    """Rewrites the code of the method an ObjectCode is working
+    on, counting hits of each pattern in hits.
+    """
+    PATTERNS = ["store_load", "push_pop", "jump_to_jump", "jump_to_next",
+                "branch_over_jump", "unreachable"]
+
+    def __init__(self, hits: collections.Counter, fuse: bool = True,
+                 instrs: Optional[InstructionSet] = None):
+        self.hits = hits
+        instrs = instrs or INSTRS
+        ops = instrs.ops
+        # By opcode
+        self.n_operands = [int(instr.ops) for instr in instrs.codes]
+        self.fused = instrs.fused if fuse else {}
+        self.jump = ops["jump"].code
+        self.jumps = {ops[name].code for name in ["jump", "jump_if", "jump_ifnot"]}
+        self.inverse = {ops["jump_if"].code: ops["jump_ifnot"].code,
+                        ops["jump_ifnot"].code: ops["jump_if"].code}
+        # Nothing after these runs unless it's jumped to
+        self.ends = {self.jump, ops["return"].code, ops["halt"].code}
+        self.load = ops["load"].code
+        self.store = ops["store"].code
+        self.pushes = {ops["const"].code, self.load}
+        self.pop = ops["pop"].code
+
+    def optimize(self, code: "ObjectCode"):
+        # Instructions as [opcode, operand, line]; a jump's operand
+        # is its label, and line is the jump's, for errors
+        words = code.code
+        patch = code.label_patch
+        n_operands = self.n_operands
+        instrs: List[list] = []
+        index = {}   # Word address -> instruction number
+        addr = 0
+        while addr < len(words):
+            opcode = words[addr]
+            index[addr] = len(instrs)
+            if not n_operands[opcode]:
+                instrs.append([opcode, None, None])
+            elif addr + 1 in patch:
+                addr += 1
+                instrs.append([opcode, patch[addr], code.patch_lines.get(addr)])
+            else:
+                addr += 1
+                instrs.append([opcode, words[addr], None])
+            addr += 1
+        index[addr] = len(instrs)
+        labels = {label: index[addr] for label, addr in code.labels.items()}
+
+        changed = False
+        while self._thread_jumps(instrs, labels) | self._delete(instrs, labels):
+            changed = True
+        if self.fused and self._fuse(instrs, labels):
+            changed = True
+        if not changed:
+            return
+
+        # Back to words, with the labels where the instructions went
+        words = []
+        code.label_patch = {}
+        code.patch_lines = {}
+        addresses = []
+        for opcode, operand, line in instrs:
+            addresses.append(len(words))
+            words.append(opcode)
+            if operand is None:
+                continue
+            if isinstance(operand, list):
+                # A superinstruction: its parts' operands, and lines
+                operands = zip(operand, line)
+            else:
+                operands = ((operand, line),)
+            for operand, line in operands:
+                if isinstance(operand, str):
+                    code.label_patch[len(words)] = operand
+                    code.patch_lines[len(words)] = line
+                    words.append(UNRESOLVED_ADDRESS)
+                else:
+                    words.append(operand)
+        addresses.append(len(words))
+        code.labels = {label: addresses[i] for label, i in labels.items()}
+        code.code[:] = words   # In place: method_code refers to it
+
+    def _thread_jumps(self, instrs: List[list], labels: Dict[str, int]) -> bool:
+        """Jumps to an unconditional jump go where it goes"""
+        changed = False
+        for instr in instrs:
+            if instr[0] not in self.jumps or instr[1] not in labels:
+                continue
+            target = instr[1]
+            seen = {target}
+            while True:
+                at = labels[target]
+                if at == len(instrs) or instrs[at][0] != self.jump:
+                    break
+                onward = instrs[at][1]
+                if onward not in labels or onward in seen:
+                    break   # Unresolved (an error later) or a loop
+                seen.add(onward)
+                target = onward
+            if target != instr[1]:
+                instr[1] = target
+                self.hits["jump_to_jump"] += 1
+                changed = True
+        return changed
+
+    def _delete(self, instrs: List[list], labels: Dict[str, int]) -> bool:
+        """Delete redundant instructions; labels on them move to the
+        instruction after.  Only the first instruction of a deleted
+        pair may be a jump target, since a jump to the second would
+        expect the stack as the first left it.
+        """
+        # Where jumps go (a label nothing jumps to is no entry point)
+        targets = {labels[operand] for opcode, operand, _ in instrs
+                   if opcode in self.jumps and operand in labels}
+        loads = None   # Local -> how many times it is loaded, if needed
+        deleted = set()
+        last = len(instrs) - 1
+        i = 0
+        while i <= last:
+            opcode, operand, _ = instrs[i]
+            following = instrs[i + 1] if i < last else [None, None, None]
+            pair = i + 1 not in targets
+            if opcode == self.jump and labels.get(operand) == i + 1:
+                self.hits["jump_to_next"] += 1
+                deleted.add(i)
+            elif (pair and opcode in self.inverse and following[0] == self.jump
+                  and labels.get(operand) == i + 2):
+                # jump_if A; jump B; A:  is  jump_ifnot B; A:
+                self.hits["branch_over_jump"] += 1
+                instrs[i] = [self.inverse[opcode], following[1], following[2]]
+                deleted.add(i + 1)
+                i += 1
+            elif pair and opcode in self.pushes and following[0] == self.pop:
+                # Neither const nor load has any other effect
+                self.hits["push_pop"] += 1
+                deleted.update([i, i + 1])
+                i += 1
+            elif (pair and opcode == self.store and following[0] == self.load
+                  and following[1] == operand and operand >= 3):
+                if loads is None:
+                    loads = collections.Counter(operand for opcode, operand, _ in instrs
+                                                if opcode == self.load)
+                if loads[operand] == 1:
+                    # A local loaded nowhere else: the value may as well
+                    # stay on the stack.  (Arguments and $ we leave alone.)
+                    self.hits["store_load"] += 1
+                    deleted.update([i, i + 1])
+                    i += 1
+            elif opcode in self.ends:
+                while i < last and i + 1 not in targets:
+                    self.hits["unreachable"] += 1
+                    deleted.add(i + 1)
+                    i += 1
+            i += 1
+        if not deleted:
+            return False
+        # Instruction number before -> after
+        moved = []
+        n_deleted = 0
+        for i in range(len(instrs) + 1):
+            moved.append(i - n_deleted)
+            n_deleted += i in deleted
+        instrs[:] = [instr for i, instr in enumerate(instrs) if i not in deleted]
+        for label, at in labels.items():
+            labels[label] = moved[at]
+        return True
+
+    def _fuse(self, instrs: List[list], labels: Dict[str, int]) -> bool:
+        """Pairs with a superinstruction become it, unless something
+        jumps to the second of the pair.  The superinstruction's
+        operand is the list of its parts' operands (and line, their
+        lines).  Runs last: the other patterns don't know these.
+        """
+        targets = {labels[operand] for opcode, operand, _ in instrs
+                   if opcode in self.jumps and operand in labels}
+        superinstrs = self.fused
+        fused = []
+        moved = []   # Instruction number before -> after
+        last = len(instrs) - 1
+        i = 0
+        while i < last:
+            superinstr = superinstrs.get((instrs[i][0], instrs[i + 1][0]))
+            if superinstr is None or i + 1 in targets:
+                moved.append(len(fused))
+                fused.append(instrs[i])
+                i += 1
+                continue
+            moved.extend([len(fused), len(fused)])
+            parts = [(operand, line) for _, operand, line in instrs[i:i + 2]
+                     if operand is not None]
+            fused.append([superinstr.code, [operand for operand, _ in parts],
+                          [line for _, line in parts]])
+            self.hits[superinstr.name] += 1
+            i += 2
+        if i == last:
+            moved.append(len(fused))
+            fused.append(instrs[i])
+        moved.append(len(fused))
+        if len(fused) == len(instrs):
+            return False
+        instrs[:] = fused
+        for label, at in labels.items():
+            labels[label] = moved[at]
+        return True
+
+
 # ----------------
 # Our object file will be a JSON structure with
 # constants, code, and other information.  We'll build
-# it up in an object and then dump it all at once.
+# it up in an object and then dump it all at once,
+# or (ObjectWriter) write each method as it is done.
 #
 UNRESOLVED_ADDRESS = -42  # Just an easily recognized value
 
 
 class ObjectCode:
-    def __init__(self):
+    def __init__(self, sink: Optional[Callable[[dict], None]] = None,
+                 peephole: bool = True, fuse: bool = True,
+                 instrs: Optional[InstructionSet] = None,
+                 imports: Optional[Imports] = None):
+        # If given, sink takes each method's code as soon as its
+        # jumps are resolved, and we keep none of it (see ObjectWriter)
+        self.sink = sink
+        self.instrs = instrs or INSTRS
+        self.imports = imports or Imports(CONFIG.tvmlib, INTERFACES)
+        # Hits of each peephole pattern and superinstruction, over all methods
+        self.peephole_hits = collections.Counter()
+        self.peephole = Peephole(self.peephole_hits, fuse, self.instrs) if peephole else None
         # The following are initialized in declare_class
         self.class_name: str = ""
         self.super_name: str = ""
-        self.method_list: List[str] = []
-        self.field_list: List[str] = []
+        self.method_list = SymbolTable()
+        self.field_list = SymbolTable()
         # Constant pool
-        self.constants: List[Tuple[str, int]] = []
+        # Constant pool, as (kind, value); a dict each in the
+        # object file, but a tuple is a quarter the size
+        self.constants: List[Tuple[str, str]] = []
         # Method code (instructions)
         self.code = []  # Will expand to code per method
         # For each method defined here, we want its
         # name, its slot# (position in vtable), its
         # local variable names, and its code.
         self.method_code: List[dict] = []
-        self.method_locals: List[str] = []
-        self.method_args: List[str] = []
+        self.method_locals = SymbolTable()
+        self.method_args = SymbolTable()
         # Things to be resolved
         # Labels resolve to addresses within the code
         # of a method.
@@ -235,17 +578,36 @@ class ObjectCode:
         self.labels: Dict[str, int] = {}
         # address -> unresolved label
         self.label_patch: Dict[int, str] = {}
+        # Where we are in the source, for error messages
+        self.source_name = ""
+        self.line_no: Optional[int] = None
+        # address -> line of the jump, for unresolved labels
+        self.patch_lines: Dict[int, Optional[int]] = {}
+        self.errors = 0
+
+    def error(self, msg: str, *args, line_no: Optional[int] = None):
+        """Log an error at the current (or given) source line"""
+        self.errors += 1
+        line_no = line_no or self.line_no
+        if line_no is None:
+            where = self.source_name or "<asm>"
+        elif self.source_name:
+            where = f"{self.source_name}:{line_no}"
+        else:
+            where = f"line {line_no}"
+        log.error(f"%s: {msg}", where, *args)
 
     def declare_class(self, name: str, super_name: str):
         self.class_name = name
         self.super_name = super_name
-        super_module = import_module(super_name)
+        super_module = self.imports.module(super_name)
         # Methods and field list are initially those
         # we inherit, but may be extended elsewhere
-        # in the assembly code
-        self.method_list = super_module.methods
+        # in the assembly code.  Copies, because the
+        # superclass's interface may be shared.
+        self.method_list = SymbolTable(super_module.methods)
         self.n_inherited = len(super_module.methods)
-        self.field_list = super_module.fields
+        self.field_list = SymbolTable(super_module.fields)
         # AND we need to be able to refer to this class in NEW
 
     def declare_field(self, name: str):
@@ -275,23 +637,24 @@ class ObjectCode:
         self.labels: Dict[str, int] = {}
         # address -> unresolved label
         self.label_patch: Dict[int, str] = {}
+        self.patch_lines: Dict[int, Optional[int]] = {}
         ###
         if method_name not in self.method_list:
             self.method_list.append(method_name)
         method_slot = self.method_list.index(method_name)
         # Initialize code block
-        self.method_locals = []
+        self.method_locals = SymbolTable()
         self.code = []  # We will append instructions to this list
         self.method_code.append({"name": method_name, "slot": method_slot,
                                  "code": self.code})
 
     def declare_locals(self, method_locals: List[str]):
         """Map local variable names to position in activation record"""
-        self.method_locals = method_locals
+        self.method_locals = SymbolTable(method_locals)
 
     def declare_args(self, args: List[str]):
         """Map argument names to offsets *before* the frame pointer"""
-        self.method_args = args
+        self.method_args = SymbolTable(args)
 
     def resolve_local(self, var: str) -> int:
         """Map local variable to position in activation record.
@@ -310,7 +673,7 @@ class ObjectCode:
         if var in self.method_locals:
             local_num = self.method_locals.index(var)
             return 3 + local_num
-        log.error(f"Local variable {var} not declared in this method")
+        self.error("Local variable %s not declared in this method", var)
         return 88   # Just a placeholder; this code should not be used!
 
     def resolve_call(self, full_name: str) -> int:
@@ -322,10 +685,13 @@ class ObjectCode:
                 method_slot = self.method_list.index(method_name)
             else:
                 # Imported class
-                module_record = import_module(class_name)
+                module_record = self.imports.module(class_name)
+                if method_name not in module_record.methods:
+                    self.error("Method %s not defined in %s", method_name, class_name)
+                    return 0
                 method_slot = module_record.method_slot(method_name)
         except LookupError:
-            log.error(f"No such method '{full_name}'")
+            self.error("No such method '%s'", full_name)
             method_slot = 0xBAD  # 2989 decimal
         return method_slot
 
@@ -338,20 +704,21 @@ class ObjectCode:
                 field_slot = self.field_list.index(field_name)
             else:
                 # Imported class (is that legal in Quack?)
-                module_record = import_module(class_name)
+                module_record = self.imports.module(class_name)
                 field_slot = module_record.field_slot(field_name)
         except LookupError:
-            log.error(f"No such field '{full_name}'")
+            self.error("No such field '%s'", full_name)
             field_slot = 0xBAD  # 2989 decimal
         return field_slot
 
     def resolve_class(self, class_name: str) -> int:
-        import_module(class_name)  # In case we need to
-        index = list(IMPORTS).index(class_name)
-        return index
+        self.imports.module(class_name)  # In case we need to
+        return self.imports.positions[class_name]
 
     def resolve_jumps(self):
         """Patch up references to code labels"""
+        if self.peephole and self.code:
+            self.peephole.optimize(self)
         for (patch_loc, patch_label) in self.label_patch.items():
             assert self.code[patch_loc] == UNRESOLVED_ADDRESS
             try:
@@ -359,10 +726,15 @@ class ObjectCode:
                 # PC will be patch loc + 1
                 jump_span = label_loc - (patch_loc + 1)
                 self.code[patch_loc] = jump_span
-                log.debug(f"Jump from loc {patch_loc} to {patch_label} "
-                          f"({label_loc}) is {jump_span} words")
-            except IndexError:
-                log.error(f"Unresolved label '{patch_label}'")
+                if trace.on:
+                    trace("Jump from loc %s to %s (%s) is %s words",
+                          patch_loc, patch_label, label_loc, jump_span)
+            except KeyError:
+                self.error("Unresolved label '%s'", patch_label,
+                           line_no=self.patch_lines.get(patch_loc))
+        self.label_patch = {}
+        if self.sink is not None and self.method_code:
+            self.sink(self.method_code.pop())
 
     def add_int_constant(self, literal: str) -> int:
         literal_index = len(self.int_constants)
@@ -403,16 +775,16 @@ class ObjectCode:
             # in the loader.
             if operand in NAMED_LITERALS:
                 return NAMED_LITERALS[operand]
-            if re.match("[0-9]+", operand):
+            if re.match("-?[0-9]+", operand):
                 kind = "i"
             elif re.match('["][^"]*["]', operand):
                 kind = "s"
                 operand = operand.strip("\"").\
                     encode("utf-8").decode("unicode_escape")
             else:
-                log.error(f"Could not type operand '{operand}'")
+                self.error("Could not type operand '%s'", operand)
                 kind = "BOGUS CONSTANT"
-            self.constants.append({"kind": kind, "value": operand})
+            self.constants.append((kind, operand))
             return len(self.constants) - 1
         if op == "call":
             slot = self.resolve_call(operand)
@@ -435,15 +807,23 @@ class ObjectCode:
             # Operand is a label, which we may not have seen yet.
             # Leave it to be patched in the final label resolution step
             self.label_patch[len(self.code)] = operand
+            self.patch_lines[len(self.code)] = self.line_no
             return UNRESOLVED_ADDRESS
         # Match should be exhaustive
-        log.error(f"Unhandled operand type for {instr}")
+        self.error("Unhandled operand type for %s", instr)
+
+    def constant_pool(self) -> Iterator[dict]:
+        """Constants as the object file has them"""
+        return ({"kind": kind, "value": value} for kind, value in self.constants)
 
-    def json(self) -> str:
-        struct = {
+    def header(self) -> dict:
+        """Everything but the code.  The constant pool is an
+        iterator, so that a writer can write it a piece at a time.
+        """
+        return {
             "class_name": self.class_name,
             "super": self.super_name,
-            "imports": [self.class_name] + list(IMPORTS)[1:],
+            "imports": [self.class_name] + self.imports.names(),
             "methods": self.method_list,
             "fields": self.field_list,
             # It's just simpler to count fields and methods
@@ -452,15 +832,107 @@ class ObjectCode:
             "n_fields": len(self.field_list),
             "n_methods": len(self.method_list),
             "n_inherited": self.n_inherited,
-            "constants": self.constants,
-            "code": self.method_code
+            "constants": self.constant_pool(),
         }
-        return json.dumps(struct, indent=4)
+
+    def json(self, compact: bool = False) -> str:
+        struct = self.header()
+        struct["constants"] = list(struct["constants"])
+        struct["code"] = self.method_code
+        return json.dumps(struct, **json_format(compact))
+
+    def binary(self) -> bytes:
+        """The same object code as a binary module (see objfile.py)"""
+        struct = self.header()
+        struct["code"] = self.method_code
+        return objfile.encode(struct)
 
     def __str__(self) -> str:
         return self.json()
 
 
+def json_format(compact: bool) -> dict:
+    """json.dumps options: indented for people to read (every
+    code word on its own line), or compact for huge classes
+    """
+    if compact:
+        return {"separators": (",", ":")}
+    return {"indent": 4}
+
+
+class ObjectWriter:
+    """Writes object code to out as it is produced, as the sink of
+    an ObjectCode: each method's code when it is finished, then
+    (in finish) the rest, which is not known until the end.  The
+    loader looks keys up by name, so "code" may come first.  The
+    text is what json.dumps would make of the same structure with
+    "code" first, so no more than one method is held in memory.
+    """
+    CHUNK = 1024   # Items of a long list to encode at once
+
+    def __init__(self, out: TextIO, compact: bool = False):
+        self.out = out
+        # One encoder, rather than one per json.dumps call
+        self.encoder = json.JSONEncoder(**json_format(compact))
+        self.compact = compact
+        self.size = 0   # Characters (json.dumps writes ASCII) written
+        self.n_methods = 0
+        self._write('{"code":[' if compact else '{\n    "code": [')
+
+    def _write(self, text: str):
+        self.out.write(text)
+        self.size += len(text)
+
+    def _value(self, value, depth: int) -> str:
+        text = self.encoder.encode(value)
+        if self.compact:
+            return text
+        return text.replace("\n", "\n" + "    " * depth)
+
+    def _write_value(self, value, depth: int):
+        """Write value; an iterator (the constant pool, which can
+        be as large as the code) a chunk of items at a time
+        """
+        if not isinstance(value, Iterator):
+            self._write(self._value(value, depth))
+            return
+        n_chunks = 0
+        while True:
+            chunk = list(itertools.islice(value, self.CHUNK))
+            if not chunk:
+                break
+            text = self._value(chunk, depth)
+            # Just the items: without [ and ] (and the newline before ])
+            items = text[1:-1] if self.compact else text[1:text.rindex("\n")]
+            self._write(("," if n_chunks else "[") + items)
+            n_chunks += 1
+        if not n_chunks:
+            self._write("[]")
+        else:
+            self._write("]" if self.compact else "\n" + "    " * depth + "]")
+
+    def method(self, entry: dict):
+        if self.compact:
+            prefix = "," if self.n_methods else ""
+        else:
+            prefix = (",\n" if self.n_methods else "\n") + "        "
+        self._write(prefix + self._value(entry, 2))
+        self.n_methods += 1
+
+    def finish(self, code: ObjectCode):
+        if self.compact:
+            self._write("]")
+        else:
+            self._write("\n    ]" if self.n_methods else "]")
+        for key, value in code.header().items():
+            if self.compact:
+                self._write(f",{self.encoder.encode(key)}:")
+            else:
+                self._write(f",\n    {self.encoder.encode(key)}: ")
+            self._write_value(value, 1)
+        self._write("}\n" if self.compact else "\n}\n")
+
+
 # ----------------
 #  Assembly code is line-oriented and can be parsed
 #  with regular expressions.  We strip away comments
@@ -479,7 +951,7 @@ INSTR_PAT = re.compile(r"""
     \s*
     (?P<opname> [a-zA-Z_]+)      # Operation name is required
     (\s+ (?P<operand>     # Operands are integers, quoted strings, or names
-             [0-9]+           # Integers are strings of digits
+             -?[0-9]+         # Integers are strings of digits
            |
              ["](             # String begins and ends with quote 
                ([\\].)  |           # Anything escaped
@@ -550,103 +1022,278 @@ ARGS_DECL_PAT = re.compile(r"""
 """, re.VERBOSE)
 
 
-def translate(lines: List[str]) -> ObjectCode:
-    code = ObjectCode()
+def class_name_of(lines: List[str]) -> Optional[str]:
+    """Class declared in assembly code (.class Name:Super)"""
     for line in lines:
-        line = strip_comments(line)
-        if not line:
-            continue
-
-        # Kinds of assembly language line:
-        # Class declaration (.class)
-        match = CLASS_DECL_PAT.match(line)
+        match = CLASS_DECL_PAT.match(strip_comments(line))
         if match:
-            class_name = match.groupdict()["class_name"]
-            superclass_name = match.groupdict()["super_name"]
-            code.declare_class(class_name, superclass_name)
-            continue
+            return match.group("class_name")
+    return None
 
-        # Method (.method f forward) to be filled in later
-        match = METHOD_DECL_PAT.match(line)
-        if match:
-            method_name = match.groupdict()["method_name"]
-            code.declare_method(method_name)
-            continue
 
-        # Method (.method) followed immediately by body
-        match = METHOD_DEF_PAT.match(line)
+def references(lines: List[str]) -> List[str]:
+    """Classes the assembly code may import, superclass first"""
+    found = []
+    for line in lines:
+        line = strip_comments(line)
+        match = CLASS_DECL_PAT.match(line)
         if match:
-            method_name = match.groupdict()["method_name"]
-            code.begin_method(method_name)
+            found.append(match.group("super_name"))
             continue
-
-        # Field declaration, ".field name"
-        match = FIELD_DECL_PAT.match(line)
-        if match:
-            field_name = match.groupdict()["field_name"]
-            code.declare_field(field_name)
+        match = INSTR_PAT.fullmatch(line)
+        if not match or not match.group("operand"):
             continue
-
-        # Local variable declaration, ".local name,name,name"
-        match = LOCALS_DECL_PAT.match(line)
-        if match:
-            locals_name_list = match.groupdict()["local_var_name"]
-            method_locals = locals_name_list.split(",")
-            n_locals = len(method_locals)
-            # Allocate space on stack for local variables
-            code.add_instruction(Instruction(
-                label=None,
-                operation=INSTRS["alloc"],
-                operand=n_locals))
-            # Now set up locals symbol table information
-            code.declare_locals(method_locals)
+        if match.group("opname") in ("new", "is_instance"):
+            name = match.group("operand")
+        elif match.group("opname") in ("call", "load_field", "store_field"):
+            name = match.group("operand").split(":")[0]
+        else:
             continue
+        if name != "$" and name not in found:
+            found.append(name)
+    return found
 
-        # Local variable declaration, ".local name,name,name"
-        match = ARGS_DECL_PAT.match(line)
-        if match:
-            locals_name_list = match.groupdict()["arg_var_name"]
-            args = locals_name_list.split(",")
-            # No space allocation needed, unlike local variables,
-            # because these are *before* (at negative offsets from)
-            # the frame pointer.
-            # Set up locals symbol table information
-            code.declare_args(args)
-            continue
 
-        # An operation (label: operation operand)
-        match = INSTR_PAT.fullmatch(line)
-        if match:
-            parts = match.groupdict()
-            label = parts["label"]
-            opname = parts["opname"]
-            operand = parts["operand"]
-            instruction = Instruction(label, INSTRS[opname], operand)
-            code.add_instruction(instruction)
-            continue
+# ----------------
+#  Each line is classified by its first token and handed to the
+#  one parser for that kind of line, rather than tried against
+#  each pattern in turn:
+#    .class, .method, ...   directives, each with its own pattern
+#    load, const, ...       an instruction without a label, the
+#                           common case, which needs only its
+#                           operand checked
+#    anything else          a label, perhaps with an instruction
+#
 
-        # A label with no instruction
-        # An operation (label: operation operand)
-        match = LABEL_PAT.match(line)
-        if not match:
-            log.error(f"NO MATCH on '{line}'")
-            continue
-        parts = match.groupdict()
-        label = parts["label"]
-        code.add_label(label)
+# Operand of an instruction, as in INSTR_PAT
+OPERAND_PAT = re.compile(r"""
+             -?[0-9]+
+           |
+             ["](
+               ([\\].)  |
+               [^"\\]
+             )*["]
+           |
+             (\w|[:$])+
+    """, re.VERBOSE)
 
 
+def _class_directive(code: ObjectCode, line: str) -> bool:
+    match = CLASS_DECL_PAT.match(line)
+    if match:
+        code.declare_class(match.group("class_name"), match.group("super_name"))
+    return bool(match)
+
+
+def _method_directive(code: ObjectCode, line: str) -> bool:
+    # Method (.method f forward) to be filled in later
+    match = METHOD_DECL_PAT.match(line)
+    if match:
+        code.declare_method(match.group("method_name"))
+        return True
+    # Method (.method) followed immediately by body
+    match = METHOD_DEF_PAT.match(line)
+    if match:
+        code.begin_method(match.group("method_name"))
+    return bool(match)
+
+
+def _field_directive(code: ObjectCode, line: str) -> bool:
+    match = FIELD_DECL_PAT.match(line)
+    if match:
+        code.declare_field(match.group("field_name"))
+    return bool(match)
+
+
+def _local_directive(code: ObjectCode, line: str) -> bool:
+    match = LOCALS_DECL_PAT.match(line)
+    if match:
+        method_locals = match.group("local_var_name").split(",")
+        # Allocate space on stack for local variables
+        code.add_instruction(Instruction(
+            label=None,
+            operation=code.instrs["alloc"],
+            operand=len(method_locals)))
+        # Now set up locals symbol table information
+        code.declare_locals(method_locals)
+    return bool(match)
+
+
+def _args_directive(code: ObjectCode, line: str) -> bool:
+    match = ARGS_DECL_PAT.match(line)
+    if match:
+        # No space allocation needed, unlike local variables,
+        # because these are *before* (at negative offsets from)
+        # the frame pointer.
+        code.declare_args(match.group("arg_var_name").split(","))
+    return bool(match)
+
+
+DIRECTIVES = {
+    ".class": _class_directive,
+    ".method": _method_directive,
+    ".field": _field_directive,
+    ".local": _local_directive,
+    ".args": _args_directive,
+}
 
-    code.resolve_jumps()  # Of the last method entered
-    return code
+
+def _instruction(code: ObjectCode, label: Optional[str],
+                 opname: str, operand: Optional[str]):
+    operation = code.instrs.ops.get(opname)
+    if operation is None:
+        code.error("Unknown operation '%s'", opname)
+    elif (operand is None) != (operation.ops == '0'):
+        code.error("'%s' %s", opname,
+                   "takes no operand" if operand is not None else "needs an operand")
+    else:
+        code.add_instruction(Instruction(label, operation, operand))
+
+
+def _labeled_line(code: ObjectCode, line: str):
+    """A label, alone or with an instruction, or a malformed line"""
+    # An operation (label: operation operand)
+    match = INSTR_PAT.fullmatch(line)
+    if match:
+        _instruction(code, match.group("label"), match.group("opname"),
+                     match.group("operand"))
+        return
+    # A label with no instruction
+    match = LABEL_PAT.match(line)
+    if match:
+        code.add_label(match.group("label"))
+    else:
+        code.error("NO MATCH on '%s'", line)
+
+
+class Assembler:
+    """What assembly needs besides the source: an instruction set,
+    the directory of object modules that imports are read from
+    (tvmlib), and a cache of the interfaces read (by path).  Each
+    translate starts its own imports, so one Assembler can assemble
+    any number of classes, in any order, and sharing it shares the
+    instruction set and the cache.  Nothing global is read or
+    changed, the working directory included.
+    """
+    def __init__(self, tvmlib: Path, instrs: Optional[InstructionSet] = None,
+                 interfaces: Optional[Dict[Path, dict]] = None):
+        self.tvmlib = Path(tvmlib)
+        self.instrs = instrs or INSTRS
+        self.interfaces = {} if interfaces is None else interfaces
+
+    def translate(self, lines: Iterable[str], source_name: str = "",
+                  sink: Optional[Callable[[dict], None]] = None,
+                  peephole: bool = True, fuse: bool = True) -> ObjectCode:
+        """Object code for assembly source lines, which may be an open
+        file (we read each line once, in order).  Errors are logged with
+        source_name and line number.  With a sink, the code of each
+        method goes there rather than into the ObjectCode.  peephole
+        False leaves the code just as written; fuse False, without
+        superinstructions.
+        """
+        instrs = self.instrs
+        code = ObjectCode(sink, peephole, fuse, instrs, Imports(self.tvmlib, self.interfaces))
+        code.source_name = source_name
+        for line_no, line in enumerate(lines, start=1):
+            line = strip_comments(line)
+            if not line:
+                continue
+            code.line_no = line_no
+            parts = line.split(None, 1)
+            first = parts[0]
+            if first in instrs.ops:
+                operand = parts[1] if len(parts) > 1 else None
+                if operand is None or OPERAND_PAT.fullmatch(operand):
+                    _instruction(code, None, first, operand)
+                else:
+                    code.error("Bad operand '%s'", operand)
+            elif first[0] == ".":
+                directive = DIRECTIVES.get(first)
+                if directive is None or not directive(code, line):
+                    code.error("NO MATCH on '%s'", line)
+            else:
+                _labeled_line(code, line)
+        code.line_no = None
+        code.resolve_jumps()  # Of the last method entered
+        return code
+
+    def assemble_file(self, source: Path, target: Optional[Path] = None,
+                      compact: bool = False, peephole: bool = True,
+                      fuse: bool = True) -> ObjectCode:
+        """Translate source and, if there were no errors, write the
+        JSON object module to target (by default, Class.json in
+        tvmlib).  Classes assembled later import what we wrote, not
+        an interface cached before.
+        """
+        with open(source) as lines:
+            code = self.translate(lines, str(source), peephole=peephole, fuse=fuse)
+        if code.errors:
+            return code
+        target = target or self.tvmlib.joinpath(code.class_name).with_suffix(".json")
+        target.write_text(code.json(compact) + "\n")
+        self.interfaces.pop(self.tvmlib.joinpath(code.class_name).with_suffix(".json"), None)
+        return code
+
+
+def translate(lines: Iterable[str], source_name: str = "",
+              sink: Optional[Callable[[dict], None]] = None,
+              peephole: bool = True, fuse: bool = True) -> ObjectCode:
+    """Assembler.translate with INSTRS, CONFIG.tvmlib, and INTERFACES
+    as they are now
+    """
+    return Assembler(CONFIG.tvmlib, INSTRS, INTERFACES).translate(
+        lines, source_name, sink, peephole, fuse)
 
 
 def main():
     """Assemble one file into object code in json format"""
     args = cli()
-    source = [line for line in args.source]
-    objcode = translate(source)
-    print(objcode.json(), file=args.target)
+    tracing.enable(args.trace)
+    if args.binary:
+        if args.stream:
+            log.error("--stream writes JSON only; the binary module "
+                      "is written whole")
+            sys.exit(1)
+        objcode = translate(args.source, args.source.name,
+                            peephole=args.peephole, fuse=args.fuse)
+        data = objcode.binary()
+        args.target.flush()
+        args.target.buffer.write(data)
+        size = len(data)
+    elif args.stream:
+        writer = ObjectWriter(args.target, args.compact)
+        objcode = translate(args.source, args.source.name, sink=writer.method,
+                            peephole=args.peephole, fuse=args.fuse)
+        writer.finish(objcode)
+        size = writer.size
+    else:
+        objcode = translate(args.source, args.source.name,
+                            peephole=args.peephole, fuse=args.fuse)
+        text = objcode.json(args.compact)
+        print(text, file=args.target)
+        size = len(text) + 1
+    if args.report:
+        report_resources(size)
+        report_peephole(objcode.peephole_hits)
+
+
+def report_resources(output_size: int, out=sys.stderr):
+    """Peak resident set size of this process, and characters written"""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak *= 1024   # Linux reports KiB; macOS, bytes
+    print(f"peak RSS {peak / 2 ** 20:.1f} MiB, "
+          f"wrote {output_size / 2 ** 20:.2f} MiB", file=out)
+
+
+def report_peephole(hits: collections.Counter, out=sys.stderr):
+    """Hits of each peephole pattern, and superinstructions emitted"""
+    print("peephole: " + ", ".join(f"{pattern} {hits[pattern]}"
+                                   for pattern in Peephole.PATTERNS), file=out)
+    fused = [instr.name for instr in INSTRS.fused.values()]
+    if fused:
+        print("fused: " + ", ".join(f"{name} {hits[name]}" for name in fused), file=out)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,238 @@
+"""Assemble many classes at once, in parallel.
+
+assemble.py translates one .asm file per process, so each class
+pays for interpreter startup, for reading opdefs.txt, and for
+reading and parsing the same Obj.json, Int.json, and String.json.
+Here each worker process starts once, and object files are read
+once per process (assemble.INTERFACES).
+
+A class can be assembled only after the classes it imports: its
+superclass above all, since declare_class copies the superclass's
+methods and fields, but also classes whose methods it calls or
+fields it uses.  We assemble in waves: each wave holds the classes
+whose imports (among the classes being assembled) are all in
+earlier waves, so a wave can be assembled in parallel.  When a
+wave is done, the interfaces it produced are passed to the
+workers for the next wave along with its sources, rather than
+read back from disk by every worker.
+
+The object code is byte for byte what assemble.py would write,
+assembling the classes one at a time in the same order.
+
+    python3 batch_assemble.py [-j JOBS] [-o OBJ_DIR] file.asm dir/ ...
+
+Directories are searched recursively for .asm files.  As for
+assemble.py, run from the directory with asm.conf and opdefs.txt.
+Object files go to the TVMLIB directory unless -o says otherwise.
+"""
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import assemble
+import tracing
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+trace = tracing.tracer("batch_assemble")
+
+ASM_SUFFIX = ".asm"
+
+
+class ClassResult:
+    """Object code (or the error) for one .asm source"""
+    def __init__(self, source: Path, name: str):
+        self.source = source
+        self.name = name
+        self.json: Optional[str] = None
+        self.interface: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.seconds = 0.0
+
+
+def assembly_waves(refs: Dict[str, List[str]]) -> List[List[str]]:
+    """Classes (keys of refs, which maps each class to the classes
+    it refers to, superclass first) in waves, each class in a wave
+    after those it refers to.  A reference that would close a cycle
+    is ignored, so a class in a cycle may come before a class it
+    imports.
+    """
+    level: Dict[str, int] = {}
+    visiting = set()
+    for root in refs:
+        if root in level:
+            continue
+        # Depth first with an explicit stack: (class, refs still to visit)
+        stack = [(root, iter(refs[root]))]
+        visiting.add(root)
+        while stack:
+            name, pending = stack[-1]
+            for ref in pending:
+                if ref in refs and ref not in level and ref not in visiting:
+                    visiting.add(ref)
+                    stack.append((ref, iter(refs[ref])))
+                    break
+            else:
+                stack.pop()
+                visiting.discard(name)
+                level[name] = 1 + max((level[ref] for ref in refs[name]
+                                       if ref in level), default=-1)
+    waves: List[List[str]] = [[] for _ in range(max(level.values(), default=-1) + 1)]
+    for name in refs:
+        waves[level[name]].append(name)
+    return waves
+
+
+def assemble_one(source: Path, text: str, interfaces: Dict[str, dict],
+                 compact: bool = False, peephole: bool = True,
+                 fuse: bool = True) -> ClassResult:
+    """Translate one class.  interfaces are object files already
+    produced in this batch, by class name, which take precedence
+    over what may be on disk.
+    """
+    lines = text.splitlines(keepends=True)
+    result = ClassResult(source, assemble.class_name_of(lines) or source.stem)
+    start = time.perf_counter()
+    for name, interface in interfaces.items():
+        assemble.INTERFACES[assemble.CONFIG.tvmlib.joinpath(name).with_suffix(".json")] = interface
+    try:
+        objcode = assemble.translate(lines, str(source), peephole=peephole, fuse=fuse)
+        result.json = objcode.json(compact)
+        result.interface = {"methods": list(objcode.method_list),
+                            "fields": list(objcode.field_list)}
+    except Exception as e:
+        result.error = f"{e.__class__.__name__}: {e}"
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def _init_worker(tvmlib: Path, traced: List[str]):
+    assemble.CONFIG.tvmlib = tvmlib
+    tracing.enable(traced)
+
+
+class Batch:
+    """Sources to assemble, and the results as they come in"""
+    def __init__(self, sources: List[Path]):
+        self.texts: Dict[str, str] = {}
+        self.sources: Dict[str, Path] = {}
+        self.refs: Dict[str, List[str]] = {}
+        self.results: List[ClassResult] = []
+        for source in sources:
+            text = source.read_text()
+            lines = text.splitlines()
+            name = assemble.class_name_of(lines) or source.stem
+            if name in self.sources:
+                duplicate = ClassResult(source, name)
+                duplicate.error = f"Class {name} is also defined in {self.sources[name]}"
+                self.results.append(duplicate)
+                continue
+            self.texts[name] = text
+            self.sources[name] = source
+            self.refs[name] = assemble.references(lines)
+        # Interfaces produced so far, by class name
+        self.produced: Dict[str, dict] = {}
+
+    def tasks(self, wave: List[str], compact: bool, peephole: bool,
+              fuse: bool) -> List[tuple]:
+        """Arguments of assemble_one for each class in wave"""
+        return [(self.sources[name], self.texts[name],
+                 {ref: self.produced[ref] for ref in self.refs[name]
+                  if ref in self.produced}, compact, peephole, fuse)
+                for name in wave]
+
+    def finish(self, result: ClassResult, out_dir: Path):
+        self.results.append(result)
+        if result.error:
+            return
+        out_dir.joinpath(result.name).with_suffix(".json").write_text(result.json + "\n")
+        self.produced[result.name] = result.interface
+
+
+def assemble_all(sources: List[Path], out_dir: Path, jobs: int = 1,
+                 compact: bool = False, peephole: bool = True,
+                 fuse: bool = True) -> List[ClassResult]:
+    batch = Batch(sources)
+    waves = assembly_waves(batch.refs)
+    trace("%d classes in %d waves", len(batch.refs), len(waves))
+    if jobs <= 1:
+        for wave in waves:
+            for task in batch.tasks(wave, compact, peephole, fuse):
+                batch.finish(assemble_one(*task), out_dir)
+        return batch.results
+    traced = [name for name in tracing.subsystems() if tracing.tracer(name).on]
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker,
+            initargs=(assemble.CONFIG.tvmlib, traced)) as pool:
+        for wave in waves:
+            tasks = batch.tasks(wave, compact, peephole, fuse)
+            for result in pool.map(assemble_one, *zip(*tasks)):
+                batch.finish(result, out_dir)
+    return batch.results
+
+
+def collect_sources(paths: List[str]) -> List[Path]:
+    """Files as given; directories expanded to the .asm files within"""
+    sources = []
+    for name in paths:
+        path = Path(name)
+        if path.is_dir():
+            sources.extend(sorted(path.rglob(f"*{ASM_SUFFIX}")))
+        else:
+            sources.append(path)
+    return sources
+
+
+def report(results: List[ClassResult], wall: float, out=sys.stdout):
+    for r in results:
+        if r.error:
+            print(f"*** {r.source}: {r.error}", file=out)
+    failed = sum(1 for r in results if r.error)
+    busy = sum(r.seconds for r in results)
+    print(f"{len(results)} classes, {failed} failed, {busy * 1000:.1f} ms "
+          f"assembling, {wall:.3f} s in all", file=out)
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(
+        description="Assemble many tiny virtual machine modules")
+    parser.add_argument("sources", nargs="+",
+                        help=f"Assembly files, or directories of {ASM_SUFFIX} files")
+    parser.add_argument("-o", "--out-dir", type=Path, default=None,
+                        help="Directory for .json object files, and for "
+                             f"imported ones (default: TVMLIB, {assemble.CONFIG.tvmlib})")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Worker processes (1: assemble in this process)")
+    parser.add_argument("--compact", action="store_true",
+                        help="Write JSON without indentation")
+    parser.add_argument("--no-peephole", dest="peephole", action="store_false",
+                        help="Leave the code just as written (no peephole optimization)")
+    parser.add_argument("--no-fuse", dest="fuse", action="store_false",
+                        help="Don't emit superinstructions for pairs of instructions")
+    tracing.add_trace_option(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    tracing.enable(args.trace)
+    if args.out_dir is not None:
+        assemble.CONFIG.tvmlib = args.out_dir
+    out_dir = assemble.CONFIG.tvmlib
+    out_dir.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    results = assemble_all(collect_sources(args.sources), out_dir, args.jobs,
+                           args.compact, args.peephole, args.fuse)
+    report(results, time.perf_counter() - start)
+    if any(r.error for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Compile many Quack source files in one process.
+
+main.py handles a single source file per run, so a project with
+hundreds of classes pays for interpreter startup, parser construction,
+and module imports hundreds of times.  Here we build the parser once
+(per worker process, with --jobs), then parse, transform, and generate
+code for each file, writing one .asm file per class.
+
+By default the transformer runs inline in the parser, so the "parse"
+timing includes transformation; --tree builds the concrete tree first
+and times the two phases separately.
+
+    python3 batch_compile.py [-o OUT_DIR] [-j JOBS] [--tree] file.qk dir/ ...
+
+Directories are searched recursively for *.qk files.
+"""
+
+import argparse
+import concurrent.futures
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import grammar_ast
+import grammar_optimize
+import grammar_reshape
+import grammar_types
+import quack_parser
+import tracing
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+
+SOURCE_SUFFIX = ".qk"
+# The class of a source's main block (grammar_ast.ProgramNode)
+MAIN_CLASS = "$Main"
+
+
+class FileResult:
+    """Outcome and phase timings (seconds) for one source file"""
+    def __init__(self, source: Path):
+        self.source = source
+        self.parse = 0.0
+        self.transform = 0.0
+        self.codegen = 0.0
+        self.code: Dict[str, str] = {}   # Class -> assembly code, until written
+        self.written: List[Path] = []
+        self.error: Optional[str] = None
+
+    def total(self) -> float:
+        return self.parse + self.transform + self.codegen
+
+
+def collect_sources(paths: List[str]) -> List[Path]:
+    """Files as given; directories expanded to the .qk files within"""
+    sources = []
+    for name in paths:
+        path = Path(name)
+        if path.is_dir():
+            sources.extend(sorted(path.rglob(f"*{SOURCE_SUFFIX}")))
+        else:
+            sources.append(path)
+    return sources
+
+
+def generate(parser, source: Path,
+             inline: Optional[grammar_reshape.QuackTransformer] = None,
+             optimize: bool = True) -> FileResult:
+    """Parse, transform, and generate code for one source file,
+    leaving the code of each class in the result.  If the parser
+    was built with a transformer, pass that transformer as inline.
+    Type inference and constant folding count as code generation.
+    A source with no main block (only classes) has no $Main.
+    Errors are recorded in the result rather than raised, so that
+    one bad file does not stop the batch.
+    """
+    result = FileResult(source)
+    try:
+        if inline is not None:
+            inline.reset(source.stem)
+            start = time.perf_counter()
+            ast = parser.parse(source.read_text())
+            result.parse = time.perf_counter() - start
+        else:
+            start = time.perf_counter()
+            concrete = parser.parse(source.read_text())
+            result.parse = time.perf_counter() - start
+
+            start = time.perf_counter()
+            transformer = grammar_reshape.QuackTransformer(True, source.stem)
+            ast = transformer.transform(concrete)
+            result.transform = time.perf_counter() - start
+
+        start = time.perf_counter()
+        grammar_types.infer(ast).check()
+        if optimize:
+            ast = grammar_optimize.optimize(ast)
+        for clazz in ast.classes:
+            if not isinstance(clazz, grammar_ast.ClassNode):
+                result.error = f"Class not reshaped into a ClassNode: {clazz!r:.60}"
+                result.code = {}
+                return result
+            if clazz.name == MAIN_CLASS and not clazz.constructor.block.stmts:
+                continue
+            buffer = []
+            clazz.gen_code(buffer)
+            result.code[clazz.name] = "\n".join(buffer) + "\n"
+        result.codegen = time.perf_counter() - start
+    except Exception as e:
+        # Lark wraps errors in multi-line messages; the first line will do
+        result.error = f"{e.__class__.__name__}: {str(e).strip().splitlines()[0]}"
+        result.code = {}
+    return result
+
+
+def write(result: FileResult, out_dir: Path, claimed: Dict[str, Path]) -> FileResult:
+    """Write the code generated for result's source, one .asm file
+    per class, unless another source in the batch (in claimed, class
+    -> source) already wrote one of its classes; then the file fails
+    and nothing of it is written.  Claims the classes written.
+    """
+    for name in result.code:
+        if name in claimed and claimed[name] != result.source:
+            result.error = (f"Class {name} is defined by both {claimed[name]} "
+                            f"and {result.source}")
+    if not result.error:
+        for name, text in result.code.items():
+            target = out_dir.joinpath(name).with_suffix(".asm")
+            target.write_text(text)
+            result.written.append(target)
+            claimed[name] = result.source
+    result.code = {}
+    return result
+
+
+def compile_file(parser, source: Path, out_dir: Path,
+                 inline: Optional[grammar_reshape.QuackTransformer] = None,
+                 optimize: bool = True,
+                 claimed: Optional[Dict[str, Path]] = None) -> FileResult:
+    """generate, then write, with the classes claimed by the
+    sources compiled before (none, by default)
+    """
+    result = generate(parser, source, inline, optimize)
+    return write(result, out_dir, {} if claimed is None else claimed)
+
+
+def make_parser(tree: bool) -> Tuple[object, Optional[grammar_reshape.QuackTransformer]]:
+    """Parser, and the transformer built into it (if not tree)"""
+    if tree:
+        return quack_parser.build_parser(), None
+    transformer = grammar_reshape.QuackTransformer(True, "")
+    return quack_parser.build_parser(transformer=transformer), transformer
+
+
+# With a process pool, each worker builds its own parser once
+_WORKER_PARSER = None
+_WORKER_INLINE = None
+
+
+def _init_worker(tree: bool):
+    global _WORKER_PARSER, _WORKER_INLINE
+    _WORKER_PARSER, _WORKER_INLINE = make_parser(tree)
+
+
+def _generate_in_worker(source: Path, optimize: bool) -> FileResult:
+    return generate(_WORKER_PARSER, source, _WORKER_INLINE, optimize)
+
+
+def compile_all(sources: List[Path], out_dir: Path,
+                jobs: int = 1, tree: bool = False,
+                optimize: bool = True) -> List[FileResult]:
+    """Compile sources; workers only generate code, and we write it
+    here, in the order of sources, so that when two sources define
+    the same class the first wins, whichever finished first
+    """
+    claimed: Dict[str, Path] = {}
+    if jobs <= 1:
+        parser, inline = make_parser(tree)
+        return [compile_file(parser, source, out_dir, inline, optimize, claimed)
+                for source in sources]
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker, initargs=(tree,)) as pool:
+        results = list(pool.map(_generate_in_worker, sources,
+                                [optimize] * len(sources)))
+    return [write(result, out_dir, claimed) for result in results]
+
+
+def report(results: List[FileResult], wall: float, out=sys.stdout):
+    print(f"{'parse':>9} {'xform':>9} {'codegen':>9} {'total':>9}  source (ms)", file=out)
+    for r in sorted(results, key=FileResult.total, reverse=True):
+        status = f"  *** {r.error}" if r.error else ""
+        print(f"{r.parse * 1000:9.2f} {r.transform * 1000:9.2f} "
+              f"{r.codegen * 1000:9.2f} {r.total() * 1000:9.2f}  "
+              f"{r.source}{status}", file=out)
+    failed = sum(1 for r in results if r.error)
+    written = sum(len(r.written) for r in results)
+    print(f"{len(results)} files, {failed} failed, {written} .asm files written "
+          f"in {wall:.3f} s", file=out)
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(
+        description="Compile many Quack source files in one process")
+    parser.add_argument("sources", nargs="+",
+                        help=f"Source files, or directories of {SOURCE_SUFFIX} files")
+    parser.add_argument("-o", "--out-dir", type=Path, default=Path("."),
+                        help="Directory for generated .asm files")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Worker processes (default 1: compile in this process)")
+    parser.add_argument("--tree", action="store_true",
+                        help="Build the parse tree, then transform it "
+                             "(slower, but times the phases separately)")
+    parser.add_argument("--no-optimize", action="store_true",
+                        help="Skip constant folding and simplification")
+    tracing.add_trace_option(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    tracing.enable(args.trace)
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    sources = collect_sources(args.sources)
+    start = time.perf_counter()
+    results = compile_all(sources, args.out_dir, args.jobs, args.tree,
+                          optimize=not args.no_optimize)
+    report(results, time.perf_counter() - start)
+    if any(r.error for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Assembling many classes: one assemble.py process per class,
+as tests/tester.py does, against batch_assemble.py in one process
+and with a pool of workers.
+
+We generate a tree of classes (each class but the first extends an
+earlier one, so there are several waves), assemble them all three
+ways into separate directories, and check that the object files
+are byte for byte the same.
+
+    python3 bench/asm_driver.py [--classes N] [--methods N] [--loops N] [--jobs N]
+"""
+
+import argparse
+import filecmp
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import batch_assemble
+import synth
+
+
+def fresh_lib(work: Path, name: str) -> Path:
+    lib = work / name
+    lib.mkdir()
+    for builtin in ["Obj", "Int", "String", "Bool", "Nothing"]:
+        shutil.copy(ROOT / "OBJ" / f"{builtin}.json", lib)
+    return lib
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--classes", type=int, default=64)
+    parser.add_argument("--methods", type=int, default=10)
+    parser.add_argument("--loops", type=int, default=5)
+    parser.add_argument("--jobs", type=int, default=max(2, os.cpu_count()))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        src = work / "src"
+        src.mkdir()
+        sources = []
+        for c in range(args.classes):
+            super_name = f"K{(c - 1) // 2}" if c else "Obj"
+            path = src / f"K{c}.asm"
+            path.write_text(synth.tvm_class(f"K{c}", args.methods, args.loops, super_name))
+            sources.append(path)
+        waves = batch_assemble.assembly_waves(
+            {p.stem: assemble.references(p.read_text().splitlines()) for p in sources})
+        print(f"{args.classes} classes in {len(waves)} waves, "
+              f"{args.methods} methods of {args.loops} loops each")
+
+        one_by_one = fresh_lib(work, "one_by_one")
+        shutil.copy(ROOT / "opdefs.txt", work)
+        work.joinpath("asm.conf").write_text("[DEFAULT]\nTVMLIB = one_by_one\n")
+        start = time.perf_counter()
+        for path in sources:   # Already superclass first
+            subprocess.run([sys.executable, str(ROOT / "assemble.py"), str(path),
+                            str(one_by_one / f"{path.stem}.json")], check=True, cwd=work)
+        separate = time.perf_counter() - start
+        print(f"assemble.py per class   {separate * 1000:9.1f} ms")
+
+        for jobs in sorted({1, args.jobs}):
+            lib = fresh_lib(work, f"jobs{jobs}")
+            assemble.INTERFACES.clear()
+            assemble.CONFIG.tvmlib = lib
+            start = time.perf_counter()
+            results = batch_assemble.assemble_all(sources, lib, jobs)
+            elapsed = time.perf_counter() - start
+            assert not any(r.error for r in results)
+            names = [f"{p.stem}.json" for p in sources]
+            match, mismatch, errors = filecmp.cmpfiles(one_by_one, lib, names, shallow=False)
+            assert not mismatch and not errors, (mismatch, errors)
+            print(f"batch_assemble -j {jobs:<4} {elapsed * 1000:9.1f} ms  "
+                  f"({separate / elapsed:.1f}x, identical output)")
+
+
+if __name__ == "__main__":
+    main()
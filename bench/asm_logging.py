@@ -0,0 +1,67 @@
+"""How much of assembly time goes to debug logging.
+
+Before tracing.py, assemble.py forced its logger to DEBUG, so every
+back-patched jump was formatted and written to stderr.  We assemble a
+generated class with many jumps (a) with the assemble trace on, which
+is that old behavior, and (b) with it off, the new default.  Traces
+are written to /dev/null, so (a) is a lower bound on the cost when
+stderr is a terminal.
+
+    python3 bench/asm_logging.py [--methods N] [--loops N] [--repeat N]
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import synth
+import tracing
+
+
+def time_translate(lines: list[str], repeat: int) -> float:
+    """Median seconds to translate lines"""
+    times = []
+    for _ in range(repeat):
+        # Start from no imports, as a fresh assembler process would
+        assemble.INTERFACES.clear()
+        start = time.perf_counter()
+        assemble.translate(lines)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--methods", type=int, default=50)
+    parser.add_argument("--loops", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    lines = synth.tvm_class("Big", args.methods, args.loops).splitlines(keepends=True)
+    jumps = 2 * args.methods * args.loops
+    print(f"{len(lines)} lines, {jumps} jumps")
+
+    devnull = open(os.devnull, "w")
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler):
+            handler.setStream(devnull)
+
+    tracing.enable(["assemble"], on=True)
+    traced = time_translate(lines, args.repeat)
+    tracing.enable(["assemble"], on=False)
+    quiet = time_translate(lines, args.repeat)
+    print(f"trace on  (old default) {traced * 1000:8.2f} ms")
+    print(f"trace off (new default) {quiet * 1000:8.2f} ms")
+    print(f"logging was {(traced - quiet) / traced:.0%} of assembly time")
+
+
+if __name__ == "__main__":
+    main()
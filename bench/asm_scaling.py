@@ -0,0 +1,78 @@
+"""How assembly time grows with the number of symbols.
+
+Every call, local variable reference, and field reference is
+resolved by looking its name up in a table: the method list of this
+class or of an imported class, the locals and arguments of the
+method, the field list.  We assemble generated classes with more and
+more methods per class (each calling another method of the class,
+and of an imported class with as many methods), and with more and
+more locals per method.  If lookups are constant time, time per
+line stays flat; if they are linear scans, it grows with the size.
+
+    python3 bench/asm_scaling.py [--sizes 100,200,400,800] [--repeat N]
+"""
+
+import argparse
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import synth
+
+
+def time_translate(lines: list[str], repeat: int) -> float:
+    """Median seconds to translate lines"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        assemble.translate(lines)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,200,400,800,1600",
+                        type=lambda s: [int(n) for n in s.split(",")])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        lib = Path(tmp)
+        for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+            shutil.copy(builtin, lib)
+        assemble.CONFIG.tvmlib = lib
+
+        print("Methods per class (1 local each)")
+        print(f"{'methods':>8} {'lines':>8} {'own ms':>9} {'us/line':>8} "
+              f"{'import ms':>10} {'us/line':>8}")
+        for n in args.sizes:
+            own = synth.tvm_symbols("Wide", n, 1).splitlines(keepends=True)
+            seconds = time_translate(own, args.repeat)
+            lib.joinpath("Wide.json").write_text(assemble.translate(own).json())
+            assemble.INTERFACES.clear()
+            # Calls on Wide, resolved in its imported method list
+            other = synth.tvm_symbols("Caller", n, 1, callee="Wide").splitlines(keepends=True)
+            imported = time_translate(other, args.repeat)
+            print(f"{n:8} {len(own):8} {seconds * 1000:9.2f} "
+                  f"{seconds / len(own) * 1e6:8.2f} {imported * 1000:10.2f} "
+                  f"{imported / len(other) * 1e6:8.2f}")
+
+        print("Locals per method (10 methods)")
+        print(f"{'locals':>8} {'lines':>8} {'ms':>9} {'us/line':>8}")
+        for n in args.sizes:
+            lines = synth.tvm_symbols("Deep", 10, n).splitlines(keepends=True)
+            seconds = time_translate(lines, args.repeat)
+            print(f"{n:8} {len(lines):8} {seconds * 1000:9.2f} "
+                  f"{seconds / len(lines) * 1e6:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Memory and output size of assembling one huge class.
+
+We generate one class of the given size and assemble it with
+assemble.py four ways: whole or --stream, indented or --compact.
+Each run is a separate process, so its peak RSS (--report) is its
+own.  The four object files must load as the same structure.
+
+    python3 bench/asm_streaming.py [--megabytes N]
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import synth
+
+LOOPS = 10
+METHOD_BYTES = len(synth.tvm_class("M", 1, LOOPS))
+
+MODES = [
+    ("whole, indented", []),
+    ("whole, compact", ["--compact"]),
+    ("stream, indented", ["--stream"]),
+    ("stream, compact", ["--stream", "--compact"]),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", type=float, default=16)
+    parser.add_argument("--generate", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    n_methods = int(args.megabytes * 2 ** 20 / METHOD_BYTES)
+    if args.generate:
+        args.generate.write_text(synth.tvm_class("Huge", n_methods, LOOPS))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        source = work / "Huge.asm"
+        # Linux carries a process's peak RSS across fork and exec, so
+        # this process must stay small while the assemblers run: we
+        # generate the source in another process, and compare the
+        # output only at the end.
+        subprocess.run([sys.executable, __file__, "--megabytes", str(args.megabytes),
+                        "--generate", str(source)], check=True)
+        print(f"{source.stat().st_size / 2 ** 20:.1f} MiB of assembly, "
+              f"{n_methods} methods")
+        print(f"{'':18} {'seconds':>8} {'peak RSS MiB':>13} {'output MiB':>11}")
+        targets = []
+        for name, options in MODES:
+            target = work / f"Huge-{'-'.join(options) or 'default'}.json"
+            start = time.perf_counter()
+            proc = subprocess.run(
+                [sys.executable, str(ROOT / "assemble.py"), str(source), str(target),
+                 "--report", *options],
+                cwd=ROOT, capture_output=True, text=True, check=True)
+            elapsed = time.perf_counter() - start
+            report = re.search(r"peak RSS ([\d.]+) MiB", proc.stderr)
+            print(f"{name:18} {elapsed:8.2f} {float(report.group(1)):13.1f} "
+                  f"{target.stat().st_size / 2 ** 20:11.2f}")
+            targets.append(target)
+        first = json.loads(targets[0].read_text())
+        for target in targets[1:]:
+            assert json.loads(target.read_text()) == first, target
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Assembler throughput, in lines and megabytes per second.
+
+Most assembly lines are plain instructions.  We generate .asm
+files of a few megabytes (many methods of counting loops, so
+mostly instructions, with labels and directives in the mix) and
+time assemble.translate on each.
+
+    python3 bench/asm_throughput.py [--megabytes 1,2,4] [--repeat N]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import synth
+
+# Each method of tvm_class with LOOPS loops is about 2 KB
+LOOPS = 10
+METHOD_BYTES = len(synth.tvm_class("M", 1, LOOPS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", default="1,2,4",
+                        type=lambda s: [float(n) for n in s.split(",")])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'MB':>6} {'lines':>9} {'ms':>9} {'lines/s':>11} {'MB/s':>7}")
+    for megabytes in args.megabytes:
+        n_methods = int(megabytes * 2 ** 20 / METHOD_BYTES)
+        text = synth.tvm_class("Big", n_methods, LOOPS)
+        lines = text.splitlines(keepends=True)
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            assemble.translate(lines)
+            times.append(time.perf_counter() - start)
+        seconds = statistics.median(times)
+        size = len(text.encode("utf-8")) / 2 ** 20
+        print(f"{size:6.2f} {len(lines):9} {seconds * 1000:9.1f} "
+              f"{len(lines) / seconds:11,.0f} {size / seconds:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
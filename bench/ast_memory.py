@@ -0,0 +1,49 @@
+"""AST memory footprint per 1000 lines of (generated) Quack source,
+measured with tracemalloc as the memory still held once the AST is
+built.  With --intern, identical leaves (identifiers, literals)
+are shared through a grammar_ast.NodePool.
+
+    python3 bench/ast_memory.py [--lines N] [--intern]
+"""
+
+import argparse
+import sys
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import grammar_reshape
+import quack_parser
+import synth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=20_000)
+    parser.add_argument("--intern", action="store_true")
+    args = parser.parse_args()
+
+    src = synth.quack_expressions(args.lines)
+    if args.intern:
+        import grammar_ast
+        transformer = grammar_reshape.QuackTransformer(
+            False, "Bench", pool=grammar_ast.NodePool())
+    else:
+        transformer = grammar_reshape.QuackTransformer(False, "Bench")
+    parser = quack_parser.build_parser(transformer=transformer)
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    ast = parser.parse(src)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_kloc = (after - before) / (args.lines / 1000)
+    print(f"{args.lines} lines: {(after - before) / 2**20:.1f} MiB, "
+          f"{per_kloc / 1024:.1f} KiB per 1k lines"
+          f"{' (interned leaves)' if args.intern else ''}")
+    return ast
+
+
+if __name__ == "__main__":
+    main()
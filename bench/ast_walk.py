@@ -0,0 +1,81 @@
+"""AST traversal on synthetic trees that are very deep (nested
+method calls, as in a long chain of '+') and very wide (a block of
+many statements).  Compares ASTNode.walk with the recursive walk it
+replaced, reproduced here as recursive_walk.
+
+    python3 bench/ast_walk.py [--depth N] [--width N] [--reps N]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import grammar_ast
+from grammar_ast import BlockNode, MethodCallNode, VariableReferenceNode, flatten, log
+
+
+def recursive_walk(node, visit_state, pre_visit, post_visit):
+    """The former ASTNode.walk"""
+    pre_visit(node, visit_state)
+    for child in flatten(node.children):
+        log.debug(f"Visiting ASTNode of class {child.__class__.__name__}")
+        try:
+            recursive_walk(child, visit_state, pre_visit, post_visit)
+        except Exception as e:
+            log.error(f"Failed walking {node.__class__.__name__} to  {child.__class__.__name__}")
+    post_visit(node, visit_state)
+
+
+def deep_tree(depth: int) -> grammar_ast.ASTNode:
+    """x + x + x ... nested depth times"""
+    tree = VariableReferenceNode("x")
+    for _ in range(depth):
+        tree = MethodCallNode("PLUS", tree, [VariableReferenceNode("x")])
+    return tree
+
+
+def wide_tree(width: int) -> grammar_ast.ASTNode:
+    """A block of width statements, each a small expression"""
+    return BlockNode([MethodCallNode("PLUS", VariableReferenceNode("x"),
+                                     [VariableReferenceNode("y")])
+                      for _ in range(width)])
+
+
+def count(node, state):
+    state[0] += 1
+
+
+def measure(walk, tree, reps: int) -> str:
+    samples = []
+    for _ in range(reps):
+        state = [0]
+        start = time.perf_counter()
+        try:
+            walk(tree, state, count, grammar_ast.ignore)
+        except RecursionError:
+            return "RecursionError"
+        samples.append(time.perf_counter() - start)
+    return f"{statistics.median(samples) * 1000:8.2f} ms ({state[0]} nodes)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--depth", type=int, default=50_000)
+    parser.add_argument("--width", type=int, default=50_000)
+    parser.add_argument("--reps", type=int, default=5)
+    args = parser.parse_args()
+    grammar_ast.log.setLevel("INFO")
+    for label, tree in [(f"deep ({args.depth})", deep_tree(args.depth)),
+                        ("deep (500)", deep_tree(500)),
+                        (f"wide ({args.width})", wide_tree(args.width))]:
+        print(f"{label:14s} recursive {measure(recursive_walk, tree, args.reps)}")
+        print(f"{'':14s} iterative {measure(grammar_ast.ASTNode.walk, tree, args.reps)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Memory and latency of building the AST for a large generated
+Quack program, three ways:
+
+    pretty   parse tree, print it, then transform (what main.py did)
+    tree     parse tree, then transform (main.py --tree without printing)
+    inline   transformer applied by the LALR parser (main.py default)
+
+    python3 bench/inline_parse.py [--classes N] [--reps N]
+"""
+
+import argparse
+import io
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import grammar_reshape
+import quack_parser
+import synth
+
+
+def build(mode: str, parsers: dict, src: str):
+    if mode == "inline":
+        transformer = parsers["inline_transformer"]
+        transformer.reset("Bench")
+        return parsers["inline"].parse(src)
+    concrete = parsers["tree"].parse(src)
+    if mode == "pretty":
+        print(concrete.pretty(), file=io.StringIO())
+    return grammar_reshape.QuackTransformer(False, "Bench").transform(concrete)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--classes", type=int, default=40)
+    parser.add_argument("--reps", type=int, default=5)
+    args = parser.parse_args()
+
+    src = synth.quack_program(args.classes, n_methods=10, n_stmts=10)
+    inline_transformer = grammar_reshape.QuackTransformer(False, "Bench")
+    parsers = {
+        "tree": quack_parser.build_parser(),
+        "inline": quack_parser.build_parser(transformer=inline_transformer),
+        "inline_transformer": inline_transformer,
+    }
+    print(f"{len(src.splitlines())} lines, {len(src) // 1024} KiB of Quack")
+    for mode in ["pretty", "tree", "inline"]:
+        samples = []
+        for _ in range(args.reps):
+            start = time.perf_counter()
+            build(mode, parsers, src)
+            samples.append(time.perf_counter() - start)
+        tracemalloc.start()
+        ast = build(mode, parsers, src)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del ast
+        print(f"{mode:8s} median {statistics.median(samples) * 1000:8.1f} ms"
+              f"   peak {peak / 2**20:7.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
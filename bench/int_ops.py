@@ -0,0 +1,107 @@
+"""Int arithmetic with and without the int_ operations.
+
+The compiler emits int_plus, int_less, ... for operators on Int,
+which the VM does without a call when both operands are Int.  We
+compile a loop-heavy Quack program (nested counting loops doing
+arithmetic), then make a copy of its assembly with each int_
+operation turned back into the call it stands for (int_plus is
+call Int:plus), assemble both, and report what the VM dispatched
+and the median time it took to run (tiny_vm -c -T).
+
+    python3 bench/int_ops.py [--iterations 1000,5000] [--repeat 5] [--vm bin/tiny_vm]
+"""
+
+import argparse
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import batch_assemble
+import batch_compile
+
+
+def loop_program(iterations: int) -> str:
+    return "\n".join([
+        "i = 0;",
+        "total = 0;",
+        f"while i < {iterations} {{",
+        "    j = 0;",
+        "    while j < 10 {",
+        "        total = total + i * j - j / 3;",
+        "        j = j + 1;",
+        "    }",
+        "    i = i + 1;",
+        "}",
+        "total.print();",
+    ]) + "\n"
+
+
+def as_calls(asm: str) -> str:
+    """The assembly with int_m as call Int:m"""
+    return re.sub(r"\bint_(\w+)", r"call Int:\1", asm)
+
+
+def build(asm: str, lib: Path) -> Path:
+    lib.mkdir()
+    for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+        shutil.copy(builtin, lib)
+    source = lib / "$Main.asm"
+    source.write_text(asm)
+    assemble.INTERFACES.clear()
+    assemble.CONFIG.tvmlib = lib
+    results = batch_assemble.assemble_all([source], lib)
+    assert not any(r.error for r in results), [r.error for r in results]
+    return lib
+
+
+def run_vm(vm: Path, lib: Path, repeat: int) -> tuple:
+    """Output, dispatches, and median run seconds"""
+    times = []
+    for _ in range(repeat):
+        proc = subprocess.run([str(vm), "-c", "-T", "-L", str(lib), "$Main"],
+                              capture_output=True, text=True, check=True)
+        report = dict(line.split() for line in proc.stderr.splitlines()
+                      if line.startswith(("dispatches ", "run_seconds ")))
+        times.append(float(report["run_seconds"]))
+    return proc.stdout, int(report["dispatches"]), statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", default="1000,5000",
+                        type=lambda s: [int(n) for n in s.split(",")])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--vm", type=Path, default=ROOT / "bin" / "tiny_vm")
+    args = parser.parse_args()
+
+    compiler, inline = batch_compile.make_parser(tree=False)
+    print(f"{'outer':>7} {'calls':>10} {'int_ ops':>10} {'calls ms':>9} {'int_ ms':>9} "
+          f"{'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        for iterations in args.iterations:
+            source = work / f"Loop{iterations}.qk"
+            source.write_text(loop_program(iterations))
+            result = batch_compile.compile_file(compiler, source, work, inline)
+            assert not result.error, result.error
+            asm = result.written[-1].read_text()
+            fast = build(asm, work / f"fast-{iterations}")
+            slow = build(as_calls(asm), work / f"calls-{iterations}")
+            out, fast_dispatches, fast_seconds = run_vm(args.vm, fast, args.repeat)
+            slow_out, slow_dispatches, slow_seconds = run_vm(args.vm, slow, args.repeat)
+            assert out == slow_out, "the two programs printed different results"
+            print(f"{iterations:7} {slow_dispatches:10} {fast_dispatches:10} "
+                  f"{slow_seconds * 1000:9.1f} {fast_seconds * 1000:9.1f} "
+                  f"{slow_seconds / fast_seconds:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Startup benchmark: how long does it take to have a Quack
+parser in hand?  Compares building the LALR tables from scratch
+(cold) with loading them from the persistent cache (cached) and
+with importing a pre-generated standalone module (standalone).
+
+Each measurement is a fresh interpreter, so interpreter startup
+and module imports are included, as they are in the build farm.
+
+    python3 bench/parser_startup.py [--reps N]
+"""
+
+import argparse
+import py_compile
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SNIPPET = """
+import sys
+sys.path.insert(0, {root!r})
+sys.path.insert(0, {extra!r})
+from pathlib import Path
+import quack_parser
+quack_parser.build_parser(cache_dir={cache_dir}, standalone={standalone})
+"""
+
+
+def time_startup(reps: int, extra: str, cache_dir: str, standalone: bool) -> list[float]:
+    code = SNIPPET.format(root=str(ROOT), extra=extra,
+                          cache_dir=cache_dir, standalone=standalone)
+    samples = []
+    for _ in range(reps):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label: str, samples: list[float]):
+    print(f"{label:12s} median {statistics.median(samples) * 1000:8.1f} ms"
+          f"   min {min(samples) * 1000:8.1f} ms   (n={len(samples)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reps", type=int, default=10)
+    args = parser.parse_args()
+    sys.path.insert(0, str(ROOT))
+    import quack_parser
+    with tempfile.TemporaryDirectory() as scratch:
+        cache_dir = f"Path({scratch!r})"
+        baseline = time_startup(args.reps, scratch, "None", False)
+        # First run populates the cache; not counted
+        time_startup(1, scratch, cache_dir, False)
+        cached = time_startup(args.reps, scratch, cache_dir, False)
+        module = quack_parser.write_standalone(
+            target=Path(scratch, quack_parser.STANDALONE_MODULE + ".py"))
+        py_compile.compile(str(module))   # As it would be when installed
+        standalone = time_startup(args.reps, scratch, "None", True)
+    report("cold", baseline)
+    report("cached", cached)
+    report("standalone", standalone)
+
+
+if __name__ == "__main__":
+    main()
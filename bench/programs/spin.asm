@@ -0,0 +1,22 @@
+# A counting loop in assembly, as bench/vm_threaded.py has it:
+# nearly all the time is dispatch.
+.class Spin:Obj
+.method $constructor
+.local i
+    enter
+    const 0
+    store i
+again:
+    const 1
+    load i
+    call Int:plus
+    store i
+    const 20000
+    load i
+    call Int:less
+    jump_if again
+    load i
+    call Int:print
+    pop
+    load $
+    return 0
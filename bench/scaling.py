@@ -0,0 +1,198 @@
+"""How compiling and assembling scale with the shape of the program.
+
+Generates programs (synth.Shape) of growing size along one
+dimension (--vary: classes, depth, methods, locals, expr-depth, or
+strings; the others stay as the options set them) and measures,
+for each size:
+
+    main.py      parse (with the inline transformer), type
+                 inference, constant folding, code generation,
+                 on generated Quack
+    assemble.py  translate and JSON serialization, on generated
+                 assembly, superclasses first
+
+Times are medians of --repeat runs; memory is the peak traced by
+tracemalloc over each pipeline, in a separate run so that tracing
+doesn't inflate the times.  Time per line should stay flat as the
+size grows; where it climbs, something is worse than linear.
+A text plot of time per line follows the table; --csv writes the
+table for plotting elsewhere.
+
+    python3 bench/scaling.py [--vary classes] [--sizes 10,20,40,80] [--repeat 3]
+    python3 bench/scaling.py --vary locals --sizes 10,50,250 --classes 4 --csv locals.csv
+"""
+
+import argparse
+import csv
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import batch_compile
+import grammar_optimize
+import grammar_types
+import synth
+
+DIMENSIONS = {"classes": "n_classes", "depth": "depth", "methods": "n_methods",
+              "locals": "n_locals", "expr-depth": "expr_depth", "strings": "n_strings"}
+COMPILE_PHASES = ["parse", "types", "optimize", "codegen"]
+ASM_PHASES = ["translate", "json"]
+
+
+def compile_phases(parser, inline, source: str) -> Dict[str, float]:
+    """Seconds in each phase of main.py"""
+    times = {}
+    inline.reset("Synth")
+    start = time.perf_counter()
+    ast = parser.parse(source)
+    times["parse"] = time.perf_counter() - start
+    start = time.perf_counter()
+    inference = grammar_types.infer(ast)
+    times["types"] = time.perf_counter() - start
+    if inference.errors:
+        raise RuntimeError(f"{len(inference.errors)} type errors in generated Quack")
+    start = time.perf_counter()
+    ast = grammar_optimize.optimize(ast)
+    times["optimize"] = time.perf_counter() - start
+    start = time.perf_counter()
+    for clazz in ast.classes:
+        clazz.gen_code([])
+    times["codegen"] = time.perf_counter() - start
+    return times
+
+
+def asm_phases(classes: Dict[str, str], lib: Path) -> Dict[str, float]:
+    """Seconds in each phase of assemble.py, for every class; each
+    class's object module is written for its subclasses to import
+    """
+    times = {"translate": 0.0, "json": 0.0}
+    assembler = assemble.Assembler(lib)
+    for name, source in classes.items():
+        start = time.perf_counter()
+        code = assembler.translate(source.splitlines(keepends=True), f"{name}.asm")
+        times["translate"] += time.perf_counter() - start
+        if code.errors:
+            raise RuntimeError(f"{code.errors} errors assembling generated {name}")
+        start = time.perf_counter()
+        text = code.json()
+        times["json"] += time.perf_counter() - start
+        lib.joinpath(f"{name}.json").write_text(text + "\n")
+    return times
+
+
+def median_phases(run: Callable[[], Dict[str, float]], repeat: int) -> Dict[str, float]:
+    run()   # Warm up
+    runs = [run() for _ in range(repeat)]
+    return {phase: statistics.median(r[phase] for r in runs) for phase in runs[0]}
+
+
+def peak_memory(run: Callable[[], object]) -> int:
+    """Peak bytes allocated while run runs"""
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def measure(shape: synth.Shape, parser, inline, lib: Path, repeat: int) -> dict:
+    quack = synth.quack_shaped(shape)
+    classes = synth.tvm_shaped(shape)
+    row = {"quack_lines": quack.count("\n"),
+           "asm_lines": sum(source.count("\n") for source in classes.values())}
+    row.update(median_phases(lambda: compile_phases(parser, inline, quack), repeat))
+    row.update(median_phases(lambda: asm_phases(classes, lib), repeat))
+    row["compile_mib"] = peak_memory(lambda: compile_phases(parser, inline, quack)) / 2**20
+    row["asm_mib"] = peak_memory(lambda: asm_phases(classes, lib)) / 2**20
+    row["compile_us_line"] = sum(row[p] for p in COMPILE_PHASES) / row["quack_lines"] * 1e6
+    row["asm_us_line"] = sum(row[p] for p in ASM_PHASES) / row["asm_lines"] * 1e6
+    return row
+
+
+def table(rows: List[dict], dimension: str) -> List[str]:
+    lines = [f"{dimension:>10} {'qk lines':>9} "
+             + " ".join(f"{p + ' ms':>11}" for p in COMPILE_PHASES)
+             + f" {'MiB':>7} {'us/line':>8} {'asm lines':>10} "
+             + " ".join(f"{p + ' ms':>13}" for p in ASM_PHASES)
+             + f" {'MiB':>7} {'us/line':>8}"]
+    for row in rows:
+        lines.append(f"{row['size']:10} {row['quack_lines']:9} "
+                     + " ".join(f"{row[p] * 1000:11.2f}" for p in COMPILE_PHASES)
+                     + f" {row['compile_mib']:7.2f} {row['compile_us_line']:8.1f}"
+                     + f" {row['asm_lines']:10} "
+                     + " ".join(f"{row[p] * 1000:13.2f}" for p in ASM_PHASES)
+                     + f" {row['asm_mib']:7.2f} {row['asm_us_line']:8.1f}")
+    return lines
+
+
+def plot(rows: List[dict], column: str, title: str, width: int = 50) -> List[str]:
+    """One bar per size, scaled to the largest value"""
+    top = max(row[column] for row in rows) or 1.0
+    lines = [title]
+    for row in rows:
+        bar = "#" * max(1, round(row[column] / top * width))
+        lines.append(f"{row['size']:10} {bar} {row[column]:.1f}")
+    return lines
+
+
+def cli() -> object:
+    defaults = synth.Shape()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vary", choices=sorted(DIMENSIONS), default="classes",
+                        help="Dimension of the shape that grows")
+    parser.add_argument("--sizes", default="10,20,40,80",
+                        type=lambda s: [int(n) for n in s.split(",")])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--classes", type=int, default=defaults.n_classes)
+    parser.add_argument("--depth", type=int, default=defaults.depth,
+                        help="Length of inheritance chains")
+    parser.add_argument("--methods", type=int, default=defaults.n_methods)
+    parser.add_argument("--locals", type=int, default=defaults.n_locals)
+    parser.add_argument("--expr-depth", type=int, default=defaults.expr_depth)
+    parser.add_argument("--strings", type=int, default=defaults.n_strings)
+    parser.add_argument("--csv", type=Path, default=None,
+                        help="Also write the table here")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    parser, inline = batch_compile.make_parser(tree=False)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        lib = Path(tmp)
+        for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+            shutil.copy(builtin, lib)
+        for size in args.sizes:
+            dimensions = {"n_classes": args.classes, "depth": args.depth,
+                          "n_methods": args.methods, "n_locals": args.locals,
+                          "expr_depth": args.expr_depth, "n_strings": args.strings}
+            dimensions[DIMENSIONS[args.vary]] = size
+            shape = synth.Shape(**dimensions)
+            row = {"size": size}
+            row.update(measure(shape, parser, inline, lib, args.repeat))
+            rows.append(row)
+
+    print("\n".join(table(rows, args.vary)))
+    print()
+    print("\n".join(plot(rows, "compile_us_line", "main.py: us per line of Quack")))
+    print()
+    print("\n".join(plot(rows, "asm_us_line", "assemble.py: us per line of assembly")))
+    if args.csv:
+        with open(args.csv, "w", newline="") as out:
+            writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Benchmark suite: Quack and assembly programs, timed phase by phase.
+
+The programs in bench/programs each stress one thing: a counting
+loop, deep recursion, allocating objects with fields, converting
+and comparing strings, string concatenation, and a call site whose
+receiver's class changes (DuckCheck-style dispatch), plus a loop in
+assembly.  For each we time, separately and --repeat times over:
+
+    compile   parse, type check, and generate code (.qk only)
+    assemble  assemble every class, superclasses first
+    load      the VM loading the classes      (tiny_vm -T)
+    run       the VM running the main class   (tiny_vm -T)
+
+and report the median, mean, standard deviation, and minimum.
+The VM's String class has no plus method, so concat is compiled
+and assembled but not run.
+
+Results can be saved as a JSON baseline, and later runs compared
+with it: a phase whose median is more than --threshold (a fraction)
+over the baseline's, and more than --slack-ms over in absolute
+terms, is a regression, and we exit with status 1.  Baselines are
+only comparable on the machine (and VM build) they were made on.
+
+    python3 bench/suite.py [--repeat 5] [--save] [--baseline bench/baseline.json]
+    python3 bench/suite.py --threshold 0.10 loop dispatch
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import batch_assemble
+import batch_compile
+
+PROGRAMS = ROOT / "bench" / "programs"
+BASELINE = ROOT / "bench" / "baseline.json"
+VM = ROOT / "bin" / "tiny_vm"
+PHASES = ["compile", "assemble", "load", "run"]
+
+
+class Program:
+    """A program of the suite, and what it should print
+    (expect None: don't run it)
+    """
+    def __init__(self, name: str, source: str, expect: Optional[str]):
+        self.name = name
+        self.source = PROGRAMS / source
+        self.expect = expect
+
+    def quack(self) -> bool:
+        return self.source.suffix == batch_compile.SOURCE_SUFFIX
+
+
+SUITE = [
+    Program("loop", "loop.qk", "49995000"),
+    Program("recursion", "recursion.qk", "6000987"),
+    Program("alloc", "alloc.qk", "12502500"),
+    Program("strings", "strings.qk", "1"),
+    Program("concat", "concat.qk", None),
+    Program("dispatch", "dispatch.qk", "6000"),
+    Program("spin", "spin.asm", "20000"),
+]
+
+
+def summarize(times: List[float]) -> Dict[str, float]:
+    return {"median": statistics.median(times),
+            "mean": statistics.mean(times),
+            "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+            "min": min(times)}
+
+
+def time_compile(program: Program, parser, inline, asm_dir: Path, repeat: int) -> List[float]:
+    times = []
+    for _ in range(repeat):
+        result = batch_compile.compile_file(parser, program.source, asm_dir, inline)
+        if result.error:
+            raise RuntimeError(f"{program.source}: {result.error}")
+        times.append(result.total())
+    return times
+
+
+def assembly_order(sources: List[Path]) -> List[Path]:
+    """Sources (named Class.asm, as the compiler writes them) ordered
+    so that each class's superclass comes first
+    """
+    by_class = {source.stem: source for source in sources}
+    refs = {name: assemble.references(source.read_text().splitlines())
+            for name, source in by_class.items()}
+    return [by_class[name] for wave in batch_assemble.assembly_waves(refs) for name in wave]
+
+
+def time_assemble(sources: List[Path], lib: Path, repeat: int) -> tuple:
+    """Seconds to assemble them all, each time with a fresh
+    Assembler; and the class assembled last (the main class)
+    """
+    times = []
+    for _ in range(repeat):
+        assembler = assemble.Assembler(lib)
+        start = time.perf_counter()
+        for source in sources:
+            code = assembler.assemble_file(source)
+            if code.errors:
+                raise RuntimeError(f"{code.errors} errors assembling {source}")
+        times.append(time.perf_counter() - start)
+    return times, code.class_name
+
+
+def time_vm(program: Program, vm: Path, lib: Path, main_class: str, repeat: int) -> tuple:
+    """Load and run seconds, as the VM reports them"""
+    load, run = [], []
+    for _ in range(repeat):
+        proc = subprocess.run([str(vm), "-T", "-L", str(lib), main_class],
+                              capture_output=True, text=True)
+        if proc.returncode != 0 or proc.stdout != program.expect:
+            raise RuntimeError(f"{program.name}: the VM printed {proc.stdout!r} "
+                               f"(exit status {proc.returncode}), not {program.expect!r}")
+        times = dict(line.split() for line in proc.stderr.splitlines()
+                     if line.startswith(("load_seconds ", "run_seconds ")))
+        load.append(float(times["load_seconds"]))
+        run.append(float(times["run_seconds"]))
+    return load, run
+
+
+def measure(program: Program, parser, inline, vm: Path, repeat: int, work: Path) -> dict:
+    """Statistics for each phase of one program"""
+    lib = work / program.name / "OBJ"
+    asm_dir = work / program.name / "asm"
+    lib.mkdir(parents=True)
+    asm_dir.mkdir()
+    for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+        shutil.copy(builtin, lib)
+    phases = {}
+    if program.quack():
+        phases["compile"] = summarize(time_compile(program, parser, inline, asm_dir, repeat))
+        sources = assembly_order(sorted(asm_dir.glob(f"*{batch_assemble.ASM_SUFFIX}")))
+    else:
+        sources = [program.source]
+    times, main_class = time_assemble(sources, lib, repeat)
+    phases["assemble"] = summarize(times)
+    if program.expect is not None:
+        load, run = time_vm(program, vm, lib, main_class, repeat)
+        phases["load"] = summarize(load)
+        phases["run"] = summarize(run)
+    return phases
+
+
+def regressions(results: dict, baseline: dict, threshold: float, slack: float) -> List[tuple]:
+    """(program, phase, baseline median, median) for each phase
+    slower than threshold (fraction) and slack (seconds) allow
+    """
+    slower = []
+    for name, phases in results["programs"].items():
+        for phase, stats in phases.items():
+            base = baseline["programs"].get(name, {}).get(phase)
+            if base is None:
+                continue
+            limit = max(base["median"] * (1 + threshold), base["median"] + slack)
+            if stats["median"] > limit:
+                slower.append((name, phase, base["median"], stats["median"]))
+    return slower
+
+
+def report(results: dict, baseline: Optional[dict]):
+    print(f"{'program':<10} {'phase':<9} {'median ms':>10} {'mean ms':>9} "
+          f"{'stdev ms':>9} {'min ms':>9} {'baseline':>9} {'change':>8}")
+    for name, phases in results["programs"].items():
+        for phase in PHASES:
+            if phase not in phases:
+                continue
+            stats = phases[phase]
+            line = (f"{name:<10} {phase:<9} {stats['median'] * 1000:10.3f} "
+                    f"{stats['mean'] * 1000:9.3f} {stats['stdev'] * 1000:9.3f} "
+                    f"{stats['min'] * 1000:9.3f}")
+            base = baseline and baseline["programs"].get(name, {}).get(phase)
+            if base:
+                line += (f" {base['median'] * 1000:9.3f} "
+                         f"{stats['median'] / base['median'] - 1:+8.1%}")
+            print(line)
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("programs", nargs="*", help="Run only these (default: all)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--vm", type=Path, default=VM)
+    parser.add_argument("--baseline", type=Path, default=BASELINE,
+                        help="JSON baseline to compare with, or to --save")
+    parser.add_argument("--save", action="store_true",
+                        help="Save the results as the baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Fraction by which a phase may be slower than the baseline")
+    parser.add_argument("--slack-ms", type=float, default=1.0,
+                        help="Milliseconds by which a phase may always be slower")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    unknown = set(args.programs) - {program.name for program in SUITE}
+    if unknown:
+        sys.exit(f"No such programs: {', '.join(sorted(unknown))}")
+    programs = [p for p in SUITE if not args.programs or p.name in args.programs]
+    parser, inline = batch_compile.make_parser(tree=False)
+    results = {"machine": platform.platform(), "repeat": args.repeat, "programs": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for program in programs:
+            results["programs"][program.name] = measure(
+                program, parser, inline, args.vm, args.repeat, Path(tmp))
+
+    if args.save:
+        report(results, None)
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Baseline saved to {args.baseline}")
+        return
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else None
+    report(results, baseline)
+    if baseline is None:
+        print(f"No baseline in {args.baseline}; make one with --save")
+        return
+    if baseline.get("machine") != results["machine"]:
+        print(f"Baseline was made on {baseline.get('machine')}; timings may not compare")
+    slower = regressions(results, baseline, args.threshold, args.slack_ms / 1000)
+    for name, phase, base, now in slower:
+        print(f"*** {name} {phase}: {now * 1000:.3f} ms, baseline {base * 1000:.3f} ms "
+              f"(limit {args.threshold:.0%})")
+    if slower:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
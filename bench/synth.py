@@ -0,0 +1,191 @@
+"""Synthetic inputs for benchmarks: valid Quack source of
+configurable size, so that costs which grow with input size
+show up before production inputs find them.
+"""
+
+
+def quack_class(name: str, n_methods: int, n_stmts: int, super_name: str = "Obj") -> str:
+    lines = [f"class {name}(a: Int, b: Int) extends {super_name} {{",
+             "    this.a = a;",
+             "    this.b = b;"]
+    for m in range(n_methods):
+        lines.append(f"    def m{m}(x: Int, y: Int) : Int {{")
+        for s in range(n_stmts):
+            lines.append(f"        v{s} = x + y;")
+            lines.append(f"        w{s} = {s} * 2 + 3 - 1;")
+            lines.append(f"        x = this.b.plus(v{s}).minus(w{s});")
+        lines.append("        while x > 0 { x = x - 1; }")
+        lines.append("        return this.a.plus(x);")
+        lines.append("    }")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def quack_program(n_classes: int, n_methods: int = 5, n_stmts: int = 5) -> str:
+    """n_classes classes of n_methods methods each, then a
+    main block that constructs one of each class.
+    """
+    parts = [quack_class(f"C{c}", n_methods, n_stmts) for c in range(n_classes)]
+    parts.extend(f"c{c} = C{c}({c}, {c + 1});" for c in range(n_classes))
+    return "\n".join(parts) + "\n"
+
+
+EXPRESSION_LINES = [
+    "a{i} + b - 7 + 2 * 3;",
+    "a{i}.plus(b).minus(c) + 3;",
+    '"left" + "right{i}";',
+    "x{i} - 2 + 1;",
+]
+
+
+def quack_expressions(n_lines: int) -> str:
+    """A main block of n_lines expression statements; unlike
+    quack_program, nearly all of it is reshaped into AST nodes.
+    """
+    return "\n".join(EXPRESSION_LINES[i % len(EXPRESSION_LINES)].format(i=i % 50)
+                     for i in range(n_lines)) + "\n"
+
+
+def tvm_class(name: str, n_methods: int, n_loops: int, super_name: str = "Obj") -> str:
+    """Assembly source for the tiny VM: n_methods methods, each
+    with n_loops counting loops (so two jumps per loop), calling
+    only built-in classes.  Runnable; each loop counts to 3.
+    """
+    lines = [f".class {name}:{super_name}"]
+    for m in range(n_methods):
+        lines.extend([f".method m{m}", ".local n", "    enter"])
+        for j in range(n_loops):
+            lines.extend([
+                "    const 0",
+                "    store n",
+                f"loop{j}:",
+                "    const 3",
+                "    load n",
+                "    call Int:less",
+                f"    jump_ifnot done{j}",
+                "    const 1",
+                "    load n",
+                "    call Int:plus",
+                "    store n",
+                f"    jump loop{j}",
+                f"done{j}:",
+            ])
+        lines.extend(["    const nothing", "    return 0"])
+    lines.extend([".method $constructor", "    enter", "    load $", "    return 0"])
+    return "\n".join(lines) + "\n"
+
+
+def tvm_symbols(name: str, n_methods: int, n_locals: int,
+                super_name: str = "Obj", callee: str = "$") -> str:
+    """Assembly source with many symbols: n_methods methods, each
+    with n_locals locals that it stores and loads, and each calling
+    the method before it on callee (this class, or another class
+    with at least as many methods) so that calls must be resolved
+    in a long method list.
+    """
+    local_names = [f"v{j}" for j in range(n_locals)]
+    lines = [f".class {name}:{super_name}"]
+    for m in range(n_methods):
+        lines.extend([f".method m{m}", f".local {','.join(local_names)}", "    enter"])
+        for j, var in enumerate(local_names):
+            lines.extend([f"    const {j}", f"    store {var}"])
+        for var in local_names:
+            lines.extend([f"    load {var}", "    pop"])
+        if m:
+            lines.extend(["    load $", f"    call {callee}:m{m - 1}", "    pop"])
+        lines.extend(["    const nothing", "    return 0"])
+    lines.extend([".method $constructor", "    enter", "    load $", "    return 0"])
+    return "\n".join(lines) + "\n"
+
+
+class Shape:
+    """The shape of a generated program.  Classes come in chains of
+    depth, each class extending the one before it (the first of a
+    chain extends Obj).  Each method has n_locals Int locals and
+    n_strings String constants, and returns an expression nested
+    expr_depth operators deep; a method of a subclass also calls
+    a method it inherits.
+    """
+    def __init__(self, n_classes: int = 10, depth: int = 1, n_methods: int = 5,
+                 n_locals: int = 5, expr_depth: int = 5, n_strings: int = 2):
+        self.n_classes = n_classes
+        self.depth = max(depth, 1)
+        self.n_methods = max(n_methods, 1)
+        self.n_locals = n_locals
+        self.expr_depth = expr_depth
+        self.n_strings = n_strings
+
+    def parent(self, c: int) -> str:
+        return "Obj" if c % self.depth == 0 else f"C{c - 1}"
+
+
+# Operators of generated expressions, Quack and Int method names
+OPERATORS = [("+", "plus"), ("-", "minus"), ("*", "multiply")]
+
+
+def _operand(k: int, n_locals: int) -> str:
+    return f"v{k % n_locals}" if n_locals else str(k + 1)
+
+
+def quack_shaped(shape: Shape) -> str:
+    """Quack source of the given shape, then a main block that
+    constructs an object of each class and calls its first method.
+    """
+    lines = []
+    for c in range(shape.n_classes):
+        parent = shape.parent(c)
+        lines.extend([f"class C{c}(a: Int) extends {parent} {{", "    this.a = a;"])
+        for m in range(shape.n_methods):
+            lines.append(f"    def m{c}_{m}(x: Int) : Int {{")
+            lines.extend(f"        v{j} = x + {j};" for j in range(shape.n_locals))
+            lines.extend(f'        s{k} = "C{c}.m{m} string {k}";' for k in range(shape.n_strings))
+            expr = "x"
+            for k in range(shape.expr_depth):
+                expr = f"({expr} {OPERATORS[k % 3][0]} {_operand(k, shape.n_locals)})"
+            lines.append(f"        r = {expr};")
+            if parent != "Obj":
+                lines.append(f"        r = r + this.m{c - 1}_{m}(x);")
+            lines.extend(["        return r;", "    }"])
+        lines.append("}")
+    for c in range(shape.n_classes):
+        lines.append(f"c{c} = C{c}({c});")
+        lines.append(f"c{c}.m{c}_0({c}).print();")
+    return "\n".join(lines) + "\n"
+
+
+def tvm_shaped(shape: Shape) -> dict:
+    """Assembly source of the given shape, {class name: source},
+    superclasses first
+    """
+    classes = {}
+    for c in range(shape.n_classes):
+        parent = shape.parent(c)
+        local_names = [f"v{j}" for j in range(shape.n_locals)]
+        local_names += [f"s{k}" for k in range(shape.n_strings)] + ["r"]
+        lines = [f".class C{c}:{parent}"]
+        if parent == "Obj":
+            lines.append(".field a")
+        lines.extend([".method $constructor", ".args a", "    enter",
+                      "    load a", "    load $", "    store_field $:a",
+                      "    load $", "    return 1"])
+        for m in range(shape.n_methods):
+            lines.extend([f".method m{c}_{m}", ".args x", f".local {','.join(local_names)}",
+                          "    enter"])
+            for j in range(shape.n_locals):
+                lines.extend([f"    const {j}", "    load x", "    call Int:plus",
+                              f"    store v{j}"])
+            for k in range(shape.n_strings):
+                lines.extend([f'    const "C{c}.m{m} string {k}"', f"    store s{k}"])
+            # (x op0 a0) op1 a1 ...: each right operand is pushed
+            # before the left operand it waits for
+            for k in reversed(range(shape.expr_depth)):
+                operand = _operand(k, shape.n_locals)
+                lines.append(f"    load {operand}" if shape.n_locals else f"    const {operand}")
+            lines.append("    load x")
+            lines.extend(f"    call Int:{OPERATORS[k % 3][1]}" for k in range(shape.expr_depth))
+            if parent != "Obj":
+                lines.extend(["    load x", "    load $", f"    call {parent}:m{c - 1}_{m}",
+                              "    call Int:plus"])
+            lines.extend(["    store r", "    load r", "    return 1"])
+        classes[f"C{c}"] = "\n".join(lines) + "\n"
+    return classes
@@ -0,0 +1,50 @@
+"""Type inference time as programs grow, which should be linear:
+the time per class should stay flat as the number of classes grows.
+
+    python3 bench/type_inference.py [--max-classes N] [--repeat N]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import grammar_reshape
+import grammar_types
+import quack_parser
+import synth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-classes", type=int, default=320)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    transformer = grammar_reshape.QuackTransformer(False, "Bench")
+    quack = quack_parser.build_parser(transformer=transformer)
+    print(f"{'classes':>8} {'lines':>8} {'infer ms':>10} {'us/line':>8}")
+    n_classes = 10
+    while n_classes <= args.max_classes:
+        src = synth.quack_program(n_classes)
+        times = []
+        for _ in range(args.repeat):
+            # Inference records types in the tree, so start fresh
+            ast = quack.parse(src)
+            start = time.perf_counter()
+            inference = grammar_types.infer(ast)
+            times.append(time.perf_counter() - start)
+            inference.check()
+        lines = src.count("\n")
+        elapsed = statistics.median(times)
+        print(f"{n_classes:8} {lines:8} {elapsed * 1000:10.2f} "
+              f"{elapsed * 1e6 / lines:8.2f}")
+        n_classes *= 2
+
+
+if __name__ == "__main__":
+    main()
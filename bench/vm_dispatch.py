@@ -0,0 +1,94 @@
+"""Instructions dispatched by the VM with and without
+superinstructions, on the tests/src programs.
+
+We assemble tests/src twice (batch_assemble.py, with and without
+--no-fuse), run each program TESTS.csv marks to run with the VM's
+dispatch count (-c) from each, check the two print the same, and
+report the counts and the median run time.  The superinstructions
+are those opdefs.txt declares (tools/mine_superinstructions.py);
+rebuild the VM after changing them.
+
+    python3 bench/vm_dispatch.py [--repeat N] [--vm bin/tiny_vm]
+"""
+
+import argparse
+import csv
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import batch_assemble
+
+SRC = ROOT / "tests" / "src"
+
+
+def programs() -> list:
+    with open(SRC / "TESTS.csv") as cases:
+        return [case["Class"] for case in csv.DictReader(cases) if case["Action"] == "run"]
+
+
+def assembled(work: Path, name: str, fuse: bool) -> Path:
+    lib = work / name
+    lib.mkdir()
+    for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+        shutil.copy(builtin, lib)
+    assemble.INTERFACES.clear()
+    assemble.CONFIG.tvmlib = lib
+    results = batch_assemble.assemble_all(sorted(SRC.glob("*.asm")), lib, fuse=fuse)
+    assert not any(r.error for r in results), [r.error for r in results]
+    return lib
+
+
+def run_vm(vm: Path, lib: Path, program: str, repeat: int) -> tuple:
+    """Output, dispatches, and median seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([str(vm), "-c", "-L", str(lib), program],
+                              capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+    counts = [line.split()[1] for line in proc.stderr.splitlines()
+              if line.startswith("dispatches ")]
+    return proc.stdout, int(counts[0]) if counts else 0, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--vm", type=Path, default=ROOT / "bin" / "tiny_vm")
+    args = parser.parse_args()
+
+    print("superinstructions: " + ", ".join(
+        instr.name for instr in assemble.INSTRS.fused.values()))
+    print(f"{'program':>24} {'plain':>7} {'fused':>7} {'saved':>6} "
+          f"{'plain ms':>9} {'fused ms':>9}")
+    totals = [0, 0]
+    with tempfile.TemporaryDirectory() as tmp:
+        plain_lib = assembled(Path(tmp), "plain", fuse=False)
+        fused_lib = assembled(Path(tmp), "fused", fuse=True)
+        for program in programs():
+            out, plain, plain_time = run_vm(args.vm, plain_lib, program, args.repeat)
+            fused_out, fused, fused_time = run_vm(args.vm, fused_lib, program, args.repeat)
+            if fused_out != out:
+                print(f"{program}: output differs with superinstructions", file=sys.stderr)
+            if not plain:
+                print(f"{program:>24} (did not run to the end)")
+                continue
+            totals[0] += plain
+            totals[1] += fused
+            print(f"{program:>24} {plain:7} {fused:7} {1 - fused / plain:6.1%} "
+                  f"{plain_time * 1000:9.2f} {fused_time * 1000:9.2f}")
+    if totals[0]:
+        print(f"{'all':>24} {totals[0]:7} {totals[1]:7} {1 - totals[1] / totals[0]:6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""VM startup time with .json and binary .tvo object modules, and
+with a linked program image.
+
+The VM loads a class, and the classes it imports, before it runs
+anything.  We generate a chain of classes (each constructor makes
+an instance of the next class, so loading the first loads them
+all), assemble them, convert each to .tvo, link them into one
+image (link.py), and time the VM running the chain each way.  The
+VM's limits (MAX_CLASSES in vm_loader.c, CODE_CAPACITY in
+vm_state.h) keep programs small, so the time includes process
+start; the 1-class row shows roughly how much that is.
+
+    python3 bench/vm_startup.py [--classes 1,20,60] [--repeat N] [--vm bin/tiny_vm]
+"""
+
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import batch_assemble
+import link
+import objfile
+
+
+def chain_class(k: int, n_classes: int, n_methods: int) -> str:
+    """Class Ck, which makes an instance of C(k+1)"""
+    lines = [f".class C{k}:Obj"]
+    for m in range(n_methods):
+        lines.extend([f".method m{m}", "    enter", "    const nothing", "    return 0"])
+    lines.extend([".method $constructor", "    enter"])
+    if k + 1 < n_classes:
+        lines.extend([f"    new C{k + 1}", "    pop"])
+    lines.extend(["    load $", "    return 0"])
+    return "\n".join(lines) + "\n"
+
+
+def run_vm(vm: Path, lib: Path, options: list, repeat: int) -> float:
+    """Median seconds for the VM to load and run C0"""
+    times = []
+    main_class = [] if "-i" in options else ["C0"]
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([str(vm), *options, "-L", str(lib), *main_class],
+                       check=True, capture_output=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--classes", default="1,20,60",
+                        type=lambda s: [int(n) for n in s.split(",")])
+    parser.add_argument("--methods", type=int, default=1,
+                        help="Methods per class besides the constructor")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--vm", type=Path, default=ROOT / "bin" / "tiny_vm")
+    args = parser.parse_args()
+
+    print(f"{'classes':>8} {'json KB':>8} {'tvo KB':>7} {'image KB':>9} "
+          f"{'json ms':>8} {'tvo ms':>7} {'image ms':>9}")
+    for n_classes in args.classes:
+        with tempfile.TemporaryDirectory() as tmp:
+            work = Path(tmp)
+            lib = work / "OBJ"
+            lib.mkdir()
+            for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+                shutil.copy(builtin, lib)
+            sources = []
+            for k in range(n_classes):
+                source = work / f"C{k}.asm"
+                source.write_text(chain_class(k, n_classes, args.methods))
+                sources.append(source)
+            assemble.INTERFACES.clear()
+            assemble.CONFIG.tvmlib = lib
+            results = batch_assemble.assemble_all(sources, lib)
+            assert not any(r.error for r in results), [r.error for r in results]
+            json_size = tvo_size = 0
+            for k in range(n_classes):
+                module = lib / f"C{k}.json"
+                binary = module.with_suffix(objfile.SUFFIX)
+                binary.write_bytes(objfile.encode(json.loads(module.read_text())))
+                json_size += module.stat().st_size
+                tvo_size += binary.stat().st_size
+            image = work / f"C0{link.IMAGE_SUFFIX}"
+            image.write_bytes(link.encode_image(link.Linker(lib).link("C0")))
+            json_time = run_vm(args.vm, lib, [], args.repeat)
+            tvo_time = run_vm(args.vm, lib, ["-b"], args.repeat)
+            image_time = run_vm(args.vm, lib, ["-i", str(image)], args.repeat)
+            print(f"{n_classes:8} {json_size / 1024:8.1f} {tvo_size / 1024:7.1f} "
+                  f"{image.stat().st_size / 1024:9.1f} {json_time * 1000:8.2f} "
+                  f"{tvo_time * 1000:7.2f} {image_time * 1000:9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""A tight loop under the VM's two dispatch modes: a call through
+the op table for each instruction (vm_step), and direct-threaded
+code (vm_run_threaded, built with -DVM_THREADED=ON).
+
+The loop is Looper's without the printing: count a local up to N
+with Int:plus and Int:less, so nearly all the time is dispatch and
+the few operations in the loop.  We build the VM both ways with
+cmake in scratch directories (bin/tiny_vm is put back as it was),
+or take two VMs already built, and report the median time and
+instructions dispatched per second.
+
+    python3 bench/vm_threaded.py [--iterations 100000,1000000] [--repeat N]
+    python3 bench/vm_threaded.py --vm bin/tiny_vm --threaded-vm /tmp/tiny_vm_threaded
+"""
+
+import argparse
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import batch_assemble
+
+
+def spin_class(iterations: int) -> str:
+    return "\n".join([
+        ".class Spin:Obj",
+        ".method $constructor",
+        ".local i",
+        "    enter",
+        "    const 0",
+        "    store i",
+        "again:",
+        "    const 1",
+        "    load i",
+        "    call Int:plus",
+        "    store i",
+        f"    const {iterations}",
+        "    load i",
+        "    call Int:less",
+        "    jump_if again",
+        "    load i",
+        "    call Int:print",
+        "    pop",
+        "    load $",
+        "    return 0",
+    ]) + "\n"
+
+
+def build(threaded: bool, work: Path) -> Path:
+    """A VM built one way, copied out of bin/"""
+    name = "threaded" if threaded else "plain"
+    build_dir = work / f"build-{name}"
+    subprocess.run(["cmake", f"-DVM_THREADED={'ON' if threaded else 'OFF'}",
+                    "-S", str(ROOT), "-B", str(build_dir)],
+                   check=True, capture_output=True)
+    subprocess.run(["cmake", "--build", str(build_dir), "--target", "tiny_vm"],
+                   check=True, capture_output=True)
+    vm = work / f"tiny_vm-{name}"
+    shutil.copy(ROOT / "bin" / "tiny_vm", vm)
+    return vm
+
+
+def run_vm(vm: Path, lib: Path, repeat: int) -> tuple:
+    """Output, dispatches, and median seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([str(vm), "-c", "-L", str(lib), "Spin"],
+                              capture_output=True, text=True, check=True)
+        times.append(time.perf_counter() - start)
+    counts = [int(line.split()[1]) for line in proc.stderr.splitlines()
+              if line.startswith("dispatches ")]
+    return proc.stdout, counts[0], statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", default="100000,1000000",
+                        type=lambda s: [int(n) for n in s.split(",")])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--vm", type=Path, default=None,
+                        help="VM with table dispatch (default: build it)")
+    parser.add_argument("--threaded-vm", type=Path, default=None,
+                        help="VM with threaded dispatch (default: build it)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        vms = {"table": args.vm, "threaded": args.threaded_vm}
+        if None in vms.values():
+            installed = ROOT / "bin" / "tiny_vm"
+            saved = work / "tiny_vm-saved"
+            if installed.exists():
+                shutil.copy(installed, saved)
+            try:
+                vms["threaded"] = vms["threaded"] or build(True, work)
+                vms["table"] = vms["table"] or build(False, work)
+            finally:
+                if saved.exists():
+                    shutil.copy(saved, installed)
+        print(f"{'iterations':>10} {'dispatches':>11} {'table ms':>9} {'threaded ms':>12} "
+              f"{'table M/s':>10} {'threaded M/s':>13} {'speedup':>8}")
+        for iterations in args.iterations:
+            lib = work / f"OBJ-{iterations}"
+            lib.mkdir()
+            for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+                shutil.copy(builtin, lib)
+            source = work / "Spin.asm"
+            source.write_text(spin_class(iterations))
+            assemble.INTERFACES.clear()
+            assemble.CONFIG.tvmlib = lib
+            results = batch_assemble.assemble_all([source], lib)
+            assert not any(r.error for r in results), [r.error for r in results]
+            out, dispatches, table = run_vm(vms["table"], lib, args.repeat)
+            threaded_out, threaded_dispatches, threaded = run_vm(vms["threaded"], lib, args.repeat)
+            assert (threaded_out, threaded_dispatches) == (out, dispatches), \
+                "the two VMs ran the loop differently"
+            print(f"{iterations:10} {dispatches:11} {table * 1000:9.1f} {threaded * 1000:12.1f} "
+                  f"{dispatches / table / 1e6:10.1f} {dispatches / threaded / 1e6:13.1f} "
+                  f"{table / threaded:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""Rebuild only what changed.
+
+Compiling a Quack source writes one .asm file per class, and
+assembling a class reads the .json object files (interfaces) of
+the classes it imports: its superclass, and the classes whose
+methods it calls, whose fields it uses, or which it creates.
+main.py and assemble.py keep no record of this, so after a change
+to one class the only safe course was to rebuild everything.
+
+We keep that record in a build cache (a JSON file in the object
+directory):
+
+  - for each source file, a hash of its text and the classes
+    it defines
+  - for each class, a hash of its assembly code and, for each
+    module it imported, a hash of that module's interface (its
+    method and field lists, which are all the assembler uses)
+  - hashes of the tools: grammar.lark and the compiler modules
+    for compilation, opdefs.txt and assemble.py for assembly
+
+A source is recompiled if its text or the compiler changed.  A
+class is reassembled if its assembly code changed, the assembler
+or instruction set changed, or an interface it imported changed.
+A class whose code changed but whose interface did not (a new
+method body, say) therefore does not cause its importers to be
+reassembled.
+
+    python3 build.py [--lib OBJ] [--asm-dir asm] file.qk file.asm dir/ ...
+
+Directories are searched recursively for .qk and .asm files.  Run
+from the directory with asm.conf and opdefs.txt, as for assemble.py;
+object files go to the TVMLIB directory unless --lib says otherwise.
+The report says why each rebuilt file was rebuilt.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import assemble
+import batch_assemble
+import batch_compile
+import quack_parser
+import tracing
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+trace = tracing.tracer("build")
+
+ASM_SUFFIX = ".asm"
+CACHE_NAME = ".build_cache.json"
+CACHE_VERSION = 2
+
+# Compiled code depends on these as much as on the source
+COMPILER_MODULES = ["grammar_ast.py", "grammar_reshape.py",
+                    "grammar_types.py", "grammar_optimize.py"]
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def file_digest(path: Path) -> str:
+    return digest(path.read_bytes())
+
+
+def toolchain() -> Dict[str, str]:
+    """Hashes of the tools, by the stage they affect"""
+    here = Path(__file__).parent
+    compiler = hashlib.sha256()
+    for name in COMPILER_MODULES:
+        compiler.update(here.joinpath(name).read_bytes())
+    return {
+        "grammar": quack_parser.grammar_key(),
+        "compiler": compiler.hexdigest()[:16],
+        "opdefs": file_digest(Path(assemble.OPDEFS)),
+        "assembler": file_digest(Path(assemble.__file__)),
+    }
+
+
+COMPILE_TOOLS = ["grammar", "compiler"]
+ASSEMBLE_TOOLS = ["opdefs", "assembler"]
+
+
+class ClassTarget:
+    """A class to assemble, from src (an .asm file)"""
+    def __init__(self, src: Path, origin: Path):
+        self.src = src
+        self.origin = origin   # .qk or .asm file named on the command line
+        self.text = src.read_text()
+        lines = self.text.splitlines()
+        self.name = assemble.class_name_of(lines) or src.stem
+        self.refs = assemble.references(lines)
+
+
+class Build:
+    """One run of the build.  The cache, loaded from and saved to
+    cache_path, is updated for each file successfully rebuilt, so
+    a failure leaves the file to be rebuilt next time.
+    """
+    def __init__(self, lib: Path, asm_dir: Path, cache_path: Path,
+                 optimize: bool = True):
+        self.lib = lib
+        self.asm_dir = asm_dir
+        self.cache_path = cache_path
+        self.optimize = optimize
+        self.tools = toolchain()
+        self.cache = self._load_cache()
+        # What was rebuilt, and why: (file or class, reason)
+        self.rebuilt: List[tuple] = []
+        self.up_to_date = 0
+        self.errors: List[str] = []
+        self._interfaces: Dict[str, Optional[str]] = {}
+        self._parser = None
+
+    def _load_cache(self) -> dict:
+        empty = {"version": CACHE_VERSION, "sources": {}, "classes": {}}
+        try:
+            cache = json.loads(self.cache_path.read_text())
+        except FileNotFoundError:
+            return empty
+        except ValueError:
+            log.warning("Ignoring unreadable build cache %s", self.cache_path)
+            return empty
+        if cache.get("version") != CACHE_VERSION:
+            return empty
+        return cache
+
+    def save(self):
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.cache_path.write_text(json.dumps(self.cache, indent=1, sort_keys=True))
+
+    def _tools(self, names: List[str]) -> Dict[str, str]:
+        return {name: self.tools[name] for name in names}
+
+    def _tool_changed(self, entry: dict, names: List[str]) -> Optional[str]:
+        for name in names:
+            if entry["tools"].get(name) != self.tools[name]:
+                return f"{name} changed"
+        return None
+
+    # ---- Compiling Quack sources ----
+
+    def stale_source(self, source: Path, text_hash: str) -> Optional[str]:
+        """Why source must be recompiled, or None if it need not be"""
+        entry = self.cache["sources"].get(str(source))
+        if entry is None:
+            return "not built before"
+        if entry["hash"] != text_hash:
+            return "source changed"
+        tool = self._tool_changed(entry, COMPILE_TOOLS)
+        if tool:
+            return tool
+        for name in entry["classes"]:
+            if not self.asm_dir.joinpath(name).with_suffix(ASM_SUFFIX).exists():
+                return f"{name}{ASM_SUFFIX} missing"
+        return None
+
+    def compile_source(self, source: Path, claimed: Dict[str, Path]) -> List[Path]:
+        """The .asm files for the classes of source, compiling
+        it if need be; it fails, writing nothing, if it defines
+        a class claimed (class -> source) by another source
+        """
+        text_hash = file_digest(source)
+        why = self.stale_source(source, text_hash)
+        if why is None:
+            self.up_to_date += 1
+            trace("%s up to date", source)
+            return [self.asm_dir.joinpath(name).with_suffix(ASM_SUFFIX)
+                    for name in self.cache["sources"][str(source)]["classes"]]
+        if self._parser is None:
+            self._parser = batch_compile.make_parser(tree=False)
+        parser, inline = self._parser
+        result = batch_compile.compile_file(parser, source, self.asm_dir,
+                                            inline, self.optimize, claimed)
+        if result.error:
+            self.errors.append(f"{source}: {result.error}")
+            self.cache["sources"].pop(str(source), None)
+            return []
+        self.rebuilt.append((source, why))
+        self.cache["sources"][str(source)] = {
+            "hash": text_hash,
+            "tools": self._tools(COMPILE_TOOLS),
+            "classes": [path.stem for path in result.written]}
+        return result.written
+
+    # ---- Assembling classes ----
+
+    def interface(self, module: str) -> Optional[str]:
+        """Hash of what importers use of module's object code,
+        or None if there is none
+        """
+        if module not in self._interfaces:
+            path = self.lib.joinpath(module).with_suffix(".json")
+            try:
+                obj = json.loads(path.read_text())
+                self._interfaces[module] = digest(json.dumps(
+                    [obj["methods"], obj["fields"]]).encode("utf-8"))
+            except (FileNotFoundError, ValueError, KeyError):
+                self._interfaces[module] = None
+        return self._interfaces[module]
+
+    def stale_class(self, target: ClassTarget) -> Optional[str]:
+        """Why target must be reassembled, or None if it need not be"""
+        entry = self.cache["classes"].get(target.name)
+        if entry is None:
+            return "not built before"
+        if entry["src"] != str(target.src):
+            return f"now from {target.src}"
+        if entry["hash"] != digest(target.text.encode("utf-8")):
+            return f"code changed ({target.origin})"
+        tool = self._tool_changed(entry, ASSEMBLE_TOOLS)
+        if tool:
+            return tool
+        if self.interface(target.name) is None:
+            return f"{target.name}.json missing"
+        for module, recorded in entry["imports"].items():
+            if self.interface(module) != recorded:
+                return f"interface of {module} changed"
+        return None
+
+    def assemble_class(self, target: ClassTarget, why: str) -> bool:
+        try:
+            objcode = assemble.translate(target.text.splitlines(), str(target.src))
+        except Exception as e:
+            self.errors.append(f"{target.src}: {e.__class__.__name__}: {e}")
+            self.cache["classes"].pop(target.name, None)
+            return False
+        obj_path = self.lib.joinpath(target.name).with_suffix(".json")
+        obj_path.write_text(objcode.json() + "\n")
+        assemble.INTERFACES.pop(obj_path, None)
+        self._interfaces.pop(target.name, None)
+        self.rebuilt.append((target.name, why))
+        self.cache["classes"][target.name] = {
+            "src": str(target.src),
+            "hash": digest(target.text.encode("utf-8")),
+            "tools": self._tools(ASSEMBLE_TOOLS),
+            "imports": {module: self.interface(module)
+                        for module in objcode.imports.names()
+                        if module != target.name}}
+        return True
+
+    def assemble_all(self, targets: List[ClassTarget]):
+        """Assemble stale classes, each after the classes it refers
+        to.  A class in a cycle of references may be assembled before
+        a class it imports; it is checked again afterward, and
+        reassembled if that interface has since changed.
+        """
+        by_name = {target.name: target for target in targets}
+        waves = batch_assemble.assembly_waves(
+            {target.name: target.refs for target in targets})
+        order = [by_name[name] for wave in waves for name in wave]
+        done = set()
+        for target in order:
+            why = self.stale_class(target)
+            if why is None:
+                self.up_to_date += 1
+                trace("%s up to date", target.name)
+            elif self.assemble_class(target, why):
+                done.add(target.name)
+        for _ in range(len(order)):
+            again = [(target, self.stale_class(target)) for target in order
+                     if target.name in done]
+            again = [(target, why) for target, why in again if why is not None]
+            if not again:
+                break
+            for target, why in again:
+                self.assemble_class(target, why)
+
+    def run(self, sources: List[Path]):
+        targets: Dict[str, ClassTarget] = {}
+        for source in sources:
+            if source.suffix == ASM_SUFFIX:
+                written = [source]
+            else:
+                written = self.compile_source(
+                    source, {name: t.origin for name, t in targets.items()})
+            for asm in written:
+                target = ClassTarget(asm, source)
+                if target.name in targets:
+                    self.errors.append(f"Class {target.name} is defined by both "
+                                       f"{targets[target.name].origin} and {source}")
+                    continue
+                targets[target.name] = target
+        self.assemble_all(list(targets.values()))
+        self.save()
+
+
+def collect_sources(paths: List[str]) -> List[Path]:
+    """Files as given; directories expanded to the .qk and
+    .asm files within
+    """
+    sources = []
+    for name in paths:
+        path = Path(name)
+        if path.is_dir():
+            sources.extend(sorted(
+                list(path.rglob(f"*{batch_compile.SOURCE_SUFFIX}"))
+                + list(path.rglob(f"*{ASM_SUFFIX}"))))
+        else:
+            sources.append(path)
+    return sources
+
+
+def report(build: Build, wall: float, out=sys.stdout):
+    for what, why in build.rebuilt:
+        print(f"rebuilt {what}: {why}", file=out)
+    for error in build.errors:
+        print(f"*** {error}", file=out)
+    print(f"{len(build.rebuilt)} rebuilt, {build.up_to_date} up to date, "
+          f"{len(build.errors)} failed in {wall:.3f} s", file=out)
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(
+        description="Compile and assemble what has changed since the last build")
+    parser.add_argument("sources", nargs="+",
+                        help="Quack (.qk) or assembly (.asm) files, or directories of them")
+    parser.add_argument("--lib", type=Path, default=None,
+                        help="Directory for .json object files "
+                             f"(default: TVMLIB of asm.conf, {assemble.CONFIG.tvmlib})")
+    parser.add_argument("--asm-dir", type=Path, default=Path("asm"),
+                        help="Directory for .asm files compiled from Quack")
+    parser.add_argument("--cache", type=Path, default=None,
+                        help=f"Build cache (default: {CACHE_NAME} in the object directory)")
+    parser.add_argument("--no-optimize", action="store_true",
+                        help="Skip constant folding and simplification")
+    tracing.add_trace_option(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    tracing.enable(args.trace)
+    if args.lib is not None:
+        # The assembler looks for imported modules here too
+        assemble.CONFIG.tvmlib = args.lib
+    lib = assemble.CONFIG.tvmlib
+    lib.mkdir(parents=True, exist_ok=True)
+    args.asm_dir.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    build = Build(lib, args.asm_dir, args.cache or lib.joinpath(CACHE_NAME),
+                  optimize=not args.no_optimize)
+    build.run(collect_sources(args.sources))
+    report(build, time.perf_counter() - start)
+    if build.errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
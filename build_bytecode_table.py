@@ -1,6 +1,20 @@
 """Build table mapping integer byte codes to function pointers.
 Machine operations, their names, and the number of operands
 for each are given in opdefs.txt.
+
+An operation named a+b is a superinstruction: a followed by b in
+one dispatch.  We generate its function, which calls the functions
+of a and b in turn; each fetches its own operands, which follow the
+superinstruction's opcode in order.  a must leave the program
+counter alone (no call, return, jump, or halt), else b would run
+in the wrong place.  (tools/mine_superinstructions.py chooses the
+pairs.)
+
+We also generate vm_run_threaded, a direct-threaded interpreter
+for the same operations: each code word holds the address of its
+operation's handler (a label, by computed goto) rather than a
+function pointer, and each handler jumps straight to the next.
+It is compiled only with VM_THREADED defined (cmake -DVM_THREADED=ON).
 """
 import argparse
 import datetime
@@ -26,9 +40,78 @@ PROLOGUE = f"""
  */
  
 #include "vm_code_table.h"
-op_tbl_entry vm_op_bytecodes[] = {LB}
 """
 
+TABLE = f"""
+op_tbl_entry vm_op_bytecodes[] = {LB}"""
+
+# Operations that change the program counter, which can't come
+# first in a superinstruction.  (The int_ operations call the
+# method when the operands are not both Int.)
+TRANSFERS = {"halt", "call", "return", "jump", "jump_if", "jump_ifnot",
+             "int_equals", "int_less", "int_plus", "int_minus", "int_multiply",
+             "int_divide"}
+
+THREADED = """
+#ifdef VM_THREADED
+#ifndef __GNUC__
+#error "Threaded dispatch (VM_THREADED) needs computed goto (GCC or Clang)"
+#endif
+#include "vm_loader.h"
+#include "vm_profile.h"
+#include "builtins.h"
+#include "logger.h"
+
+void **vm_handlers = 0;
+
+/* Each handler ends by jumping to the next instruction's.  The
+ * checks vm_step makes after each instruction we make only when
+ * debugging.
+ */
+#ifdef VM_PROFILER
+#define COUNT_DISPATCH vm_dispatches++
+#define PROFILE_OP(byte_code) do {{ \\
+        if (vm_profiling) {{ \\
+            vm_profile_ops[byte_code]++; \\
+        }} \\
+    }} while (0)
+#else
+#define COUNT_DISPATCH
+#define PROFILE_OP(byte_code)
+#endif
+#define DISPATCH do {{ COUNT_DISPATCH; goto *(vm_pc++)->handler; }} while (0)
+#define NEXT do {{ \\
+        if (vm_logging == DEBUG) {{ \\
+            health_check_builtins(); \\
+            stack_dump(8); \\
+            log_debug("Step:  %s", guess_description(*vm_pc)); \\
+        }} \\
+        DISPATCH; \\
+    }} while (0)
+
+void vm_run_threaded(void) {{
+    static void *handlers[] = {{
+{labels}
+    }};
+    if (! vm_handlers) {{
+        vm_handlers = handlers;
+        vm_loader_thread(handlers);
+    }}
+    vm_run_state = VM_RUNNING;
+    DISPATCH;
+{handlers}
+}}
+#endif
+"""
+
+
+def threaded_handler(byte_code: int, name: str, funcs: list) -> str:
+    """Handler for operation byte_code in vm_run_threaded"""
+    calls = "".join(f"    {func}();\n" for func in funcs)
+    if "halt" in name.split("+"):
+        calls += "    if (vm_run_state != VM_RUNNING) {\n        return;\n    }\n"
+    return f"op_{byte_code}:  /* {name} */\n    PROFILE_OP({byte_code});\n{calls}    NEXT;\n"
+
 # Fixed code at end of generated file
 CODA = """
     { 0, 0, 0}  // SENTRY
@@ -49,10 +132,19 @@ def cli() -> object:
     return args
 
 
+def superinstruction(name: str, func: str, parts: list) -> str:
+    """C function for fused operation name"""
+    calls = "".join(f"    {part}();\n" for part in parts)
+    return f"/* Superinstruction {name} */\nstatic void {func}(void) {LB}\n{calls}{RB}\n"
+
+
 def main():
     log.info("Bytecode table generation")
     args = cli()
     print(PROLOGUE, file=args.outfile)
+    entries = []
+    handlers = []
+    ops = {}   # Name -> (byte code, function)
     next_byte_code = 0;
     for line in args.infile:
         line = line.strip()
@@ -68,10 +160,32 @@ def main():
         parts = line.split(",")
         assert len(parts) == 3, f"Couldn't parse {line}"
         name, func, inlines = parts
-        print(f'\t {LB} "{name}", {func}, {inlines} {RB}, //{next_byte_code} {comment}',
-              file=args.outfile)
+        if "+" in name:
+            parts = name.split("+")
+            assert len(parts) == 2 and all(p in ops for p in parts), \
+                f"Superinstruction {name} must fuse two operations defined before it"
+            assert parts[0] not in TRANSFERS, \
+                f"Superinstruction {name} can't begin with {parts[0]}"
+            print(superinstruction(name, func, [ops[p][1] for p in parts]),
+                  file=args.outfile)
+            codes = ", ".join(str(ops[p][0]) for p in parts)
+            entries.append(f'\t {LB} "{name}", {func}, {inlines}, {len(parts)}, {LB}{codes}{RB} {RB}, '
+                           f'//{next_byte_code} {comment}')
+        else:
+            entries.append(f'\t {LB} "{name}", {func}, {inlines} {RB}, //{next_byte_code} {comment}')
+        # Handlers call the operations' functions (a superinstruction's
+        # parts' functions), not the generated superinstruction function
+        funcs = [ops[part][1] for part in name.split("+")] if "+" in name else [func]
+        handlers.append(threaded_handler(next_byte_code, name, funcs))
+        ops[name] = (next_byte_code, func)
         next_byte_code += 1
+    print(TABLE, file=args.outfile)
+    for entry in entries:
+        print(entry, file=args.outfile)
     print(CODA, file=args.outfile)
+    labels = "\n".join(f"        &&op_{code}," for code in range(len(handlers)))
+    print(THREADED.format(labels=labels, handlers="\n".join(handlers)),
+          file=args.outfile)
     log.info("Finished bytecode table generation")
 
 if __name__ == "__main__":
@@ -731,10 +731,25 @@ class_ref the_class_Int = &the_class_Int_struct;
  * like Int in Java, not like int in Java).
  * Used by built-in vm methods like Int:add, not
  * available directly to the interpreted program.
+ *
+ * Nothing changes an Int once it is made, so small values
+ * are made once and shared (like Java's Integer.valueOf);
+ * counting loops then don't allocate an object per step.
  */
+#define SMALL_INT_MIN (-128)
+#define SMALL_INT_MAX 1023
+static obj_ref small_ints[SMALL_INT_MAX - SMALL_INT_MIN + 1];
+
 obj_ref new_int(int n) {
+    int small = SMALL_INT_MIN <= n && n <= SMALL_INT_MAX;
+    if (small && small_ints[n - SMALL_INT_MIN]) {
+        return small_ints[n - SMALL_INT_MIN];
+    }
     obj_Int boxed = (obj_Int) vm_new_obj(the_class_Int);
     boxed->value = n;
+    if (small) {
+        small_ints[n - SMALL_INT_MIN] = (obj_ref) boxed;
+    }
     return (obj_ref) boxed;
 }
 
@@ -768,3 +783,32 @@ void health_check_builtins() {
     class_health_check(the_class_Boolean);
     class_health_check(the_class_Nothing);
 }
+
+#define BUILTIN_CODE(method) {method, sizeof method / sizeof method[0]}
+
+struct builtin_code vm_builtin_code[] = {
+        BUILTIN_CODE(method_tbd_0),
+        BUILTIN_CODE(method_tbd_1),
+        BUILTIN_CODE(method_tbd_2),
+        BUILTIN_CODE(method_Obj_constructor),
+        BUILTIN_CODE(method_Obj_string),
+        BUILTIN_CODE(method_Obj_print),
+        BUILTIN_CODE(method_Obj_equals),
+        BUILTIN_CODE(method_String_constructor),
+        BUILTIN_CODE(method_String_string),
+        BUILTIN_CODE(method_String_print),
+        BUILTIN_CODE(method_String_equals),
+        BUILTIN_CODE(method_Boolean_constructor),
+        BUILTIN_CODE(method_Boolean_string),
+        BUILTIN_CODE(method_Nothing_constructor),
+        BUILTIN_CODE(method_Nothing_string),
+        BUILTIN_CODE(method_int_constructor),
+        BUILTIN_CODE(method_Int_string),
+        BUILTIN_CODE(method_Int_equals),
+        BUILTIN_CODE(method_Int_less),
+        BUILTIN_CODE(method_Int_plus),
+        BUILTIN_CODE(method_Int_minus),
+        BUILTIN_CODE(method_Int_multiply),
+        BUILTIN_CODE(method_Int_divide),
+        {0, 0}
+};
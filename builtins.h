@@ -266,4 +266,14 @@ extern void class_health_check(class_ref clazz);
 /* Purely debugging ... stop when we corrupt a built-in class structure */
 extern void health_check_builtins();
 
+/* The code of every built-in method, ending with {0, 0}, so that
+ * the threaded VM can translate it (vm_loader_thread).  A new
+ * built-in method must be listed here.
+ */
+struct builtin_code {
+    vm_Word *code;
+    int n_words;
+};
+extern struct builtin_code vm_builtin_code[];
+
 #endif //TINY_VM_BUILTINS_H
@@ -1,38 +1,152 @@
 """Abstract syntax representation of a sequence of sums."""
 
+import itertools
 import logging
-from typing import Callable
+import sys
+from typing import Callable, Optional, Union
 logging.basicConfig()
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
 
 LB = "{"
 RB = "}"
 
+# Quack class names that differ in the assembler's object library
+ASM_CLASS_NAMES = {"Boolean": "Bool"}
+
+_LABEL_NUMBERS = itertools.count()
+
+
+def gen_label(prefix: str) -> str:
+    """A fresh label for generated code"""
+    return f"{prefix}_{next(_LABEL_NUMBERS)}"
+
+
+def flatten(nodes) -> list:
+    """Children may be nested in lists (e.g., a block inside
+    a list of statements) or absent (None, for optional parts
+    of the grammar); produce a flat list of what is present.
+    """
+    flat = []
+    for node in nodes:
+        if isinstance(node, list):
+            flat.extend(flatten(node))
+        elif node is not None:
+            flat.append(node)
+    return flat
+
+class NodePool:
+    """Shares identical leaves among the nodes of an AST.
+    A generated source may mention the same identifier or literal
+    thousands of times; with a pool, each distinct one is built once.
+    Only leaves may be shared:  a pooled node must never be modified,
+    nor hold per-occurrence information (like a source position).
+    """
+    def __init__(self):
+        self.leaves: dict[tuple, "ASTNode"] = {}
+        self.hits = 0
+
+    def name(self, text: str) -> str:
+        """One copy of each identifier"""
+        return sys.intern(str(text))
+
+    def leaf(self, cls: type, *key) -> "ASTNode":
+        """The node cls(*key), shared with any identical node
+        built earlier from this pool.
+        """
+        # Key on the class and the value types, so that 1 and "1"
+        # (or True and 1) are kept apart
+        pool_key = (cls, *key, *(type(k) for k in key))
+        node = self.leaves.get(pool_key)
+        if node is None:
+            node = cls(*key)
+            self.leaves[pool_key] = node
+        else:
+            self.hits += 1
+        return node
+
+
+# Stack marker for ASTNode.walk
+_LEAVE = object()
+
+
+def ignore(node: "ASTNode", visit_state):
+    """A visit that does nothing, e.g., as the post_visit of a walk"""
+    pass
+
+
 class ASTNode:
-    """Abstract base class"""
+    """Abstract base class.
+
+    Large sources produce very many nodes, so node classes declare
+    their fields in __slots__ rather than carrying a __dict__.
+    Each subclass must list the fields it adds.
+    """
+    __slots__ = ("_children", "_child_nodes")
+
     def __init__(self):
         self.children = []    # Internal nodes should set this to list of child nodes
 
+    # The flattened list of child nodes is computed once, on first use.
+    # Assigning to children resets it; children lists should be
+    # replaced rather than modified in place once the node is built.
+
+    @property
+    def children(self) -> list:
+        return self._children
+
+    @children.setter
+    def children(self, children: list):
+        self._children = children
+        self._child_nodes = None
+
+    def child_nodes(self) -> list["ASTNode"]:
+        """Children that are AST nodes, flattened.  (Parts of the
+        parse tree that have not been reshaped are skipped.)
+        """
+        if self._child_nodes is None:
+            self._child_nodes = [child for child in flatten(self._children)
+                                 if isinstance(child, ASTNode)]
+        return self._child_nodes
+
     # Visitor-like functionality for walking over the AST. Define default methods in ASTNode
     # and specific overrides in node types in which the visitor should do something
     def walk(self, visit_state, pre_visit: Callable, post_visit: Callable):
-        pre_visit(self, visit_state)
-        for child in flatten(self.children):
-            log.debug(f"Visiting ASTNode of class {child.__class__.__name__}")
+        """Call pre_visit on each node of this subtree before its children,
+        and post_visit after them.  We keep our own stack rather than
+        recursing, so deeply nested expressions cannot exhaust the
+        Python stack.  An exception in a visit below this node is
+        logged, and the rest of that node's subtree is abandoned.
+        """
+        # Nodes on the stack are waiting to be entered.  _LEAVE above
+        # a node means its children are done and it awaits post_visit.
+        stack = [self]
+        pop, push = stack.pop, stack.append
+        while stack:
+            node = pop()
             try:
-                child.walk(visit_state, pre_visit, post_visit)
-            except Exception as e:
-                log.error(f"Failed walking {self.__class__.__name__} to  {child.__class__.__name__}")
-        post_visit(self, visit_state)
+                if node is _LEAVE:
+                    node = pop()
+                    post_visit(node, visit_state)
+                    continue
+                pre_visit(node, visit_state)
+                children = node.child_nodes()
+                if not children:
+                    post_visit(node, visit_state)
+                    continue
+                push(node)
+                push(_LEAVE)
+                stack.extend(reversed(children))
+            except Exception:
+                if node is self:
+                    raise
+                # A failed pre_visit has not yet pushed the node's
+                # children, so its subtree is skipped.
+                log.error("Failed walking to %s", node.__class__.__name__)
 
     # Example walk to gather method signatures
     def method_table_visit(self, visit_state: dict):
         ignore(self, visit_state)
 
-    # def ignore():
-    #     pass
-
     def r_eval(self, buffer: list[str]):
         """Evaluate for value, i.e., generate
         code that will result in evaluating an
@@ -47,7 +161,20 @@ class ASTNode:
         raise NotImplementedError(f"r_eval not implemented for node type {self.__class__.__name__}")
 
     def c_eval(self, true_branch: str, false_branch: str, buffer: list[str]):
-        raise NotImplementedError(f"c_eval not implemented for node type {self.__class__.__name__}")
+        """Evaluate for control flow, i.e., generate code that
+        jumps to true_branch or false_branch.  Unless a node knows
+        better, we evaluate it for value and test the result.
+        """
+        self.r_eval(buffer)
+        buffer.append(f"\tjump_if {true_branch}")
+        buffer.append(f"\tjump {false_branch}")
+
+    def l_eval(self, buffer: list[str]):
+        """Evaluate as a location:  generate code that stores
+        the value on top of the stack there.  Implement for
+        nodes that may be the target of an assignment.
+        """
+        raise NotImplementedError(f"l_eval not implemented for node type {self.__class__.__name__}")
 
     def gen_code(self, buffer: list[str]):
         """Gen code should be implemented for program, class,
@@ -72,12 +199,16 @@ class ASTNode:
         """Add relevant dot code to this node"""
         this_node = self.dot_id()
         buffer.append(f'{this_node}[label="{LB}{self.dot_label()}{RB}"]')
-        for child in flatten(self.children):
+        for child in self.child_nodes():
             buffer.append(f"{this_node} -> {child.dot_id()};")
             child.to_dot(buffer)
 
 
+
+
 class ProgramNode(ASTNode):
+    __slots__ = ("classes",)
+    classes: list[ASTNode]
 
     def __init__(self, classes: list[ASTNode], main_block: ASTNode):
         super().__init__()
@@ -95,6 +226,12 @@ class ProgramNode(ASTNode):
 
 
 class ClassNode(ASTNode):
+    __slots__ = ("name", "super_class", "methods", "constructor", "fields")
+    name: str
+    super_class: str
+    methods: list[ASTNode]
+    constructor: "MethodNode"
+    fields: list[str]      # Those added by this class; see grammar_types
 
     def __init__(self, name: str, formals: list[ASTNode],
                  super_class: str,
@@ -104,6 +241,7 @@ class ClassNode(ASTNode):
         self.super_class = super_class
         self.methods = methods
         self.constructor = MethodNode("$constructor", formals, name, block)
+        self.fields = []
         self.children = methods +  [self.constructor]
 
     def __str__(self):
@@ -129,8 +267,22 @@ class ClassNode(ASTNode):
             "methods": {}
         }
 
+    def gen_code(self, buffer: list[str]):
+        """One class is one assembler module"""
+        buffer.append(f".class {self.name}:{self.super_class}")
+        for field in self.fields:
+            buffer.append(f".field {field}")
+        # Methods may call methods defined after them
+        for method in self.methods:
+            buffer.append(f".method {method.name} forward")
+        for method in self.methods:
+            method.gen_code(buffer)
+        self.constructor.gen_code(buffer)
+
 
 class BlockNode(ASTNode):
+    __slots__ = ("stmts",)
+    stmts: list[ASTNode]
 
     def __init__(self, stmts: list[ASTNode]):
         self.stmts = stmts
@@ -139,8 +291,16 @@ class BlockNode(ASTNode):
     def __str__(self):
         return "".join([str(stmt) + ";\n" for stmt in self.stmts])
 
+    def gen_code(self, buffer: list[str]):
+        for stmt in self.stmts:
+            stmt.gen_code(buffer)
+
 
 class FormalNode(ASTNode):
+    __slots__ = ("var_name", "var_type")
+    var_name: str
+    var_type: str
+
     def __init__(self, var_name: str, var_type: str):
         self.var_name = var_name
         self.var_type = var_type
@@ -152,6 +312,8 @@ class FormalNode(ASTNode):
 
 class ExprNode(ASTNode):
     """Just identifiers in this stub"""
+    __slots__ = ("e",)
+
     def __init__(self, e):
         self.e = e
         self.children = [e]
@@ -161,6 +323,10 @@ class ExprNode(ASTNode):
 
 
 class IfNode(ASTNode):
+    __slots__ = ("cond", "thenpart", "elsepart")
+    cond: ASTNode
+    thenpart: ASTNode
+    elsepart: ASTNode
 
     def __init__(self,
                  cond: ASTNode,
@@ -172,23 +338,13 @@ class IfNode(ASTNode):
         self.children = [cond, thenpart, elsepart]
 
     def __str__(self):
-        return f"""if {self.cond} {LB}\n
+        return f"""if {self.cond} {LB}
                 {self.thenpart}
              {RB} else {LB}
-                {self.elsepart} {LB}
-            {RB}
+                {self.elsepart}
+             {RB}
             """
 
-    def c_eval(self, true_branch: str, false_branch: str, buffer: list[str]):
-        """We could be evaluating a comparison or other boolean method
-        for control flow.  In that case we generate code as if for value,
-        then use it to control the jump.
-        """
-        self.r_eval(buffer)
-        buffer.append(f"\tjump_ifnot {false_branch}")
-        buffer.append(f"\tjump {true_branch}")
-
-
     def gen_code(self, buffer: list[str]):
         """An If statement generates control flow to
         execute either the `then` or the `else` part.
@@ -205,17 +361,135 @@ class IfNode(ASTNode):
         buffer.append(f"{endif_label}: ")
 
 
+class WhileNode(ASTNode):
+    __slots__ = ("cond", "body")
+    cond: ASTNode
+    body: ASTNode
+
+    def __init__(self, cond: ASTNode, body: ASTNode):
+        self.cond = cond
+        self.body = body
+        self.children = [cond, body]
+
+    def __str__(self):
+        return f"while {self.cond} {LB}\n{self.body}{RB}"
+
+    def gen_code(self, buffer: list[str]):
+        """The test is at the bottom, so each trip
+        around the loop takes only one jump.
+        """
+        test_label = gen_label("while")
+        loop_label = gen_label("loop")
+        end_label = gen_label("endwhile")
+        buffer.append(f"\tjump {test_label}")
+        buffer.append(f"{loop_label}: ")
+        self.body.gen_code(buffer)
+        buffer.append(f"{test_label}: ")
+        self.cond.c_eval(loop_label, end_label, buffer)
+        buffer.append(f"{end_label}: ")
+
+
+class ReturnNode(ASTNode):
+    __slots__ = ("expr", "n_args")
+    expr: Optional[ASTNode]
+    n_args: int     # Of the method we return from; set by MethodNode
+
+    def __init__(self, expr: Optional[ASTNode]):
+        self.expr = expr
+        self.n_args = 0
+        self.children = [expr]
+
+    def __str__(self):
+        return f"return {self.expr}" if self.expr is not None else "return"
+
+    def gen_code(self, buffer: list[str]):
+        if self.expr is None:
+            buffer.append("\tconst nothing")
+        else:
+            self.expr.r_eval(buffer)
+        buffer.append(f"\treturn {self.n_args}")
+
+
 class MethodNode(ASTNode):
+    __slots__ = ("name", "formals", "return_type", "block")
+    name: str
+    formals: list[ASTNode]
+    return_type: str
+    block: ASTNode
 
     def __init__(self, name: str, arguments: list[ASTNode], return_type: str, block: ASTNode):
         self.name = name 
         self.formals = arguments
         self.return_type = return_type
         self.block = block
+        self.children = [block]
+        # Each return pops our arguments
+        def set_n_args(node: ASTNode, n_args: int):
+            if isinstance(node, ReturnNode):
+                node.n_args = n_args
+        self.walk(len(arguments), set_n_args, ignore)
+
+    def __str__(self):
+        formals = ", ".join(str(f) for f in self.formals)
+        return f"def {self.name}({formals}): {self.return_type} {LB}\n{self.block}{RB}"
+
+    def local_names(self) -> list[str]:
+        """Variables assigned in the method body, other than
+        arguments, in order of first assignment
+        """
+        names = {}
+        def assigned(node: ASTNode, names: dict):
+            if (isinstance(node, AssignmentNode)
+                    and isinstance(node.target, VariableReferenceNode)):
+                names[node.target.name] = True
+        self.walk(names, assigned, ignore)
+        args = {f.var_name for f in self.formals}
+        return [name for name in names if name not in args and name != "this"]
+
+    def gen_code(self, buffer: list[str]):
+        buffer.append(f".method {self.name}")
+        if self.formals:
+            buffer.append(f".args {','.join(str(f.var_name) for f in self.formals)}")
+        local_names = self.local_names()
+        if local_names:
+            buffer.append(f".local {','.join(local_names)}")
+        buffer.append("\tenter")
+        for stmt in flatten([self.block]):
+            stmt.gen_code(buffer)
+        # Fall off the end: constructors return "this", others nothing
+        if self.name == "$constructor":
+            buffer.append("\tload $")
+        else:
+            buffer.append("\tconst nothing")
+        buffer.append(f"\treturn {len(self.formals)}")
+
+
+# Operators QuackTransformer does not make into method calls
+# (there are no such methods), but into control flow
+BOOLEAN_OPERATORS = ("BOOLEAN_AND", "BOOLEAN_OR", "BOOLEAN_NOT")
+
+# Methods of Int with an operation of their own (int_plus, ...;
+# opdefs.txt), which the VM does without a call when the receiver
+# and argument are both Int
+INT_OPERATIONS = ("equals", "less", "plus", "minus", "multiply", "divide")
 
-    #TODO: Fill out
 
 class MethodCallNode(ASTNode):
+    """receiver.name(actuals).  Operators are method calls too,
+    named like their tokens (PLUS, LT, ...); type inference
+    (grammar_types) resolves each call to the method it invokes.
+    """
+    __slots__ = ("name", "receiver", "actuals",
+                 "static_type", "static_class", "asm_class", "method", "slot")
+    name: str
+    receiver: ASTNode
+    actuals: list[ASTNode]
+    # Filled in by type inference:
+    static_type: Optional[str]    # Of the result
+    static_class: Optional[str]   # Of the receiver, where the method is looked up
+    asm_class: Optional[str]      # static_class as named in assembly code
+    method: Optional[str]         # Method name, e.g., "plus" for PLUS
+    slot: Optional[int]           # Position of method in the vtable
 
     def __init__(self,
                  name: str,
@@ -224,6 +498,11 @@ class MethodCallNode(ASTNode):
         self.name = name
         self.receiver = receiver
         self.actuals = actuals
+        self.static_type = None
+        self.static_class = None
+        self.asm_class = None
+        self.method = None
+        self.slot = None
         self.children = [ self.receiver ] + self.actuals
 
     def __str__(self):
@@ -235,35 +514,103 @@ class MethodCallNode(ASTNode):
         return f"Method Call|{self.name}"
 
     def r_eval(self, buffer: list[str]):
+        if self.name in BOOLEAN_OPERATORS:
+            true_label = gen_label("true")
+            false_label = gen_label("false")
+            end_label = gen_label("endbool")
+            self.c_eval(true_label, false_label, buffer)
+            buffer.append(f"{true_label}: ")
+            buffer.append("\tconst true")
+            buffer.append(f"\tjump {end_label}")
+            buffer.append(f"{false_label}: ")
+            buffer.append("\tconst false")
+            buffer.append(f"{end_label}: ")
+            return
+        if self.method is None:
+            raise Exception(f"Call {self} not resolved; infer types before generating code")
         for actual in self.actuals:
             actual.r_eval(buffer)
         self.receiver.r_eval(buffer)
-        buffer.append(f"call Int:{self.name}")
-        # FIXME:  We need to infer type from expression,
-        # not just assume it's Int.  To do this, we need to
-        # use the inferred type of the receiver object, which
-        # could itself be an expression.
+        if self.asm_class == "Int" and self.method in INT_OPERATIONS:
+            buffer.append(f"\tint_{self.method}")
+        else:
+            buffer.append(f"\tcall {self.asm_class}:{self.method}")
+
+    def c_eval(self, true_branch: str, false_branch: str, buffer: list[str]):
+        """and, or, and not are short-circuit control flow"""
+        if self.name == "BOOLEAN_NOT":
+            self.receiver.c_eval(false_branch, true_branch, buffer)
+        elif self.name == "BOOLEAN_AND":
+            right_label = gen_label("and")
+            self.receiver.c_eval(right_label, false_branch, buffer)
+            buffer.append(f"{right_label}: ")
+            self.actuals[0].c_eval(true_branch, false_branch, buffer)
+        elif self.name == "BOOLEAN_OR":
+            right_label = gen_label("or")
+            self.receiver.c_eval(true_branch, right_label, buffer)
+            buffer.append(f"{right_label}: ")
+            self.actuals[0].c_eval(true_branch, false_branch, buffer)
+        else:
+            super().c_eval(true_branch, false_branch, buffer)
+
+
+class ConstructorCallNode(ASTNode):
+    """ClassName(actuals) creates an object"""
+    __slots__ = ("class_name", "actuals", "asm_class")
+    class_name: str
+    actuals: list[ASTNode]
+    asm_class: Optional[str]      # Set by type inference
+
+    def __init__(self, class_name: str, actuals: list[ASTNode]):
+        self.class_name = class_name
+        self.actuals = actuals
+        self.asm_class = None
+        self.children = actuals
 
+    def __str__(self):
+        actuals = ",".join(str(actual) for actual in self.actuals)
+        return f"{self.class_name}({actuals})"
+
+    @property
+    def static_type(self) -> str:
+        return self.class_name
+
+    def r_eval(self, buffer: list[str]):
+        if self.asm_class is None:
+            raise Exception(f"Constructor {self} not resolved; infer types before generating code")
+        for actual in self.actuals:
+            actual.r_eval(buffer)
+        buffer.append(f"\tnew {self.asm_class}")
+        buffer.append(f"\tcall {self.asm_class}:$constructor")
 
 
 class AssignmentNode(ASTNode):
-    
-    def __init__(self, name_assigning_to: str, expression_assigned: ASTNode):
-        self.name_assigning_to = name_assigning_to
+    __slots__ = ("target", "declared_type", "expression_assigned")
+    target: ASTNode               # A variable or field reference
+    declared_type: Optional[str]  # As in  x: Int = 3;
+    expression_assigned: ASTNode
+
+    def __init__(self, target: ASTNode, expression_assigned: ASTNode,
+                 declared_type: Optional[str] = None):
+        self.target = target
+        self.declared_type = declared_type
         self.expression_assigned = expression_assigned
-        self.children = []
+        self.children = [target, expression_assigned]
 
     def __str__(self):
-        actuals = ",".join(str(actual) for actual in self.actuals)
-        return f"{name_assigning_to} = {expression_assigned.__str__()}"
+        declared = f": {self.declared_type}" if self.declared_type else ""
+        return f"{self.target}{declared} = {self.expression_assigned}"
 
     def gen_code(self, buffer: list[str]):
-        buffer.append(f"find out how to assign \"{self.expression_assigned}\" to {self.name}")
+        self.expression_assigned.r_eval(buffer)
+        self.target.l_eval(buffer)
 
 
 
 class ExpressionNode(ASTNode):
     """Just identifiers in this stub"""
+    __slots__ = ("e",)
+
     def __init__(self, e):
         self.e = e
         self.children = [e]
@@ -273,7 +620,9 @@ class ExpressionNode(ASTNode):
 
 
 class BareExpressionNode(ASTNode):
-    
+    """An expression evaluated as a statement, for its effect"""
+    __slots__ = ("e",)
+
     def __init__(self, e):
         self.e = e
         self.children = [e]
@@ -281,30 +630,105 @@ class BareExpressionNode(ASTNode):
     def __str__(self):
         return str(self.e)
 
+    def gen_code(self, buffer: list[str]):
+        self.e.r_eval(buffer)
+        buffer.append("\tpop")
+
 
 class ConstNode(ASTNode):
-    pass
+    """A literal: an int, boolean, or string constant, or
+    none (value None).  String values are kept as written
+    between the quotes, escapes and all, as the assembler
+    expects them.
+    """
+    __slots__ = ("value",)
+    value: Optional[Union[int, bool, str]]
+
+    def __init__(self, value: Optional[Union[int, bool, str]]):
+        super().__init__()
+        self.value = value
+
+    def __str__(self):
+        if self.value is None:
+            return "nothing"
+        if isinstance(self.value, bool):
+            return "true" if self.value else "false"
+        if isinstance(self.value, str):
+            return f'"{self.value}"'
+        return str(self.value)
+
+    @property
+    def static_type(self) -> str:
+        if self.value is None:
+            return "Nothing"
+        return {int: "Int", bool: "Boolean", str: "String"}[type(self.value)]
+
+    def r_eval(self, buffer: list[str]):
+        buffer.append(f"\tconst {self}")
 
 
 class VariableReferenceNode(ASTNode):
     """Reference to a variable in an expression.
     This will typically evaluate to a 'load' operation.
     """
+    __slots__ = ("name", "static_type")
+    name: str
+    static_type: Optional[str]    # Here; set by type inference
+
     def __init__(self, name: str):
         assert isinstance(name, str)
         self.name = name
+        self.static_type = None
         self.children = []
 
     def __str__(self):
         return self.name
 
+    def asm_name(self) -> str:
+        return "$" if self.name == "this" else self.name
+
+    def r_eval(self, buffer: list[str]):
+        buffer.append(f"\tload {self.asm_name()}")
+
+    def l_eval(self, buffer: list[str]):
+        buffer.append(f"\tstore {self.asm_name()}")
+
+
+class FieldReferenceNode(ASTNode):
+    """obj.field; Quack allows only this.field"""
+    __slots__ = ("obj", "field", "static_type")
+    obj: ASTNode
+    field: str
+    static_type: Optional[str]    # Set by type inference
+
+    def __init__(self, obj: ASTNode, field: str):
+        self.obj = obj
+        self.field = field
+        self.static_type = None
+        self.children = [obj]
+
+    def __str__(self):
+        return f"{self.obj}.{self.field}"
+
+    def r_eval(self, buffer: list[str]):
+        self.obj.r_eval(buffer)
+        buffer.append(f"\tload_field $:{self.field}")
+
+    def l_eval(self, buffer: list[str]):
+        self.obj.r_eval(buffer)
+        buffer.append(f"\tstore_field $:{self.field}")
+
 
 class BooleanConditionNode(ASTNode):
     """Boolean condition. It can evaluate to jumps,
     but in this grammar it's just a placeholder.
     """
+    __slots__ = ("cond",)
+    cond: str
+
     def __init__(self, cond: str):
         self.cond = cond
+        self.children = []
 
     def __str__(self):
         return f"{self.cond}"
@@ -313,4 +737,4 @@ class BooleanConditionNode(ASTNode):
 
 
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    pass
@@ -0,0 +1,241 @@
+"""Constant folding and algebraic simplification of the Quack AST.
+
+QuackTransformer turns every operator into a MethodCallNode, so
+1 + 2 * 3 becomes a chain of method calls, each a full method
+dispatch and a new Int object at run time.  This pass, applied
+between the transformer and code generation, replaces
+
+  - operators on Int literals (+ - * /) by their value
+  - comparisons of literals (== < <= > >=) by true or false
+  - and, or, not of boolean literals by their value
+  - x + 0, 0 + x, x - 0, x * 1, 1 * x, x / 1 by x, when x is an Int
+
+Folding must not change what the program does, so we compute as
+the VM does (32 bit C ints, division truncating toward zero), and
+leave alone any operation that would overflow or divide by zero;
+those fail (or not) at run time exactly as before.
+
+An identity like x * 1 is x only if x is an Int; a user class may
+define its own 'multiply'.  By default we use the static types that
+type inference (grammar_types) recorded in the tree, or if it has
+not run, what literals alone tell us; pass type_of to do otherwise.
+"""
+
+import functools
+import operator
+from typing import Callable, Optional
+
+import lark
+
+import grammar_ast
+from grammar_ast import ASTNode, ConstNode, MethodCallNode
+import tracing
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+trace = tracing.tracer("grammar_optimize")
+
+# Int is a C int in the VM
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+
+def c_divide(left: int, right: int) -> int:
+    """Integer division as in C, truncating toward zero"""
+    quotient = abs(left) // abs(right)
+    return quotient if (left < 0) == (right < 0) else -quotient
+
+
+# Operators as QuackTransformer names them (the method name
+# of the MethodCallNode), with their values on literals
+INT_ARITHMETIC = {
+    "PLUS": operator.add,
+    "MINUS": operator.sub,
+    "MULTIPLY": operator.mul,
+    "DIVIDE": c_divide,
+}
+
+# QuackTransformer makes a > b of b < a, and a <= b and a >= b
+# of BOOLEAN_NOT around LT, so these two are all it leaves
+COMPARISONS = {
+    "EQ": operator.eq,
+    "LT": operator.lt,
+}
+
+BOOLEAN_OPS = {
+    "BOOLEAN_AND": lambda left, right: left and right,
+    "BOOLEAN_OR": lambda left, right: left or right,
+}
+
+BOOLEAN_NOT = "BOOLEAN_NOT"
+
+# x op identity is x  (right identities), identity op x is x (left)
+RIGHT_IDENTITIES = {"PLUS": 0, "MINUS": 0, "MULTIPLY": 1, "DIVIDE": 1}
+LEFT_IDENTITIES = {"PLUS": 0, "MULTIPLY": 1}
+
+
+def literal(node) -> Optional[object]:
+    """Value of an Int or Boolean literal, else None"""
+    if isinstance(node, ConstNode) and type(node.value) in (int, bool):
+        return node.value
+    return None
+
+
+def literal_type(node) -> Optional[str]:
+    """Static type of node, as far as literals alone tell us;
+    None if unknown.
+    """
+    if isinstance(node, ConstNode):
+        return node.static_type
+    if isinstance(node, MethodCallNode) and len(node.actuals) == 1:
+        left = literal_type(node.receiver)
+        right = literal_type(node.actuals[0])
+        if node.name in INT_ARITHMETIC and left == right == "Int":
+            return "Int"
+        if node.name in COMPARISONS and left == right == "Int":
+            return "Boolean"
+    return None
+
+
+def static_type(node) -> Optional[str]:
+    """Static type of node as recorded by type inference,
+    or failing that, as far as literals tell us
+    """
+    recorded = getattr(node, "static_type", None)
+    return recorded if recorded is not None else literal_type(node)
+
+
+@functools.lru_cache(maxsize=None)
+def _fields(cls: type) -> tuple[str, ...]:
+    """Names of the slots of a node class that may hold children"""
+    names = []
+    for klass in reversed(cls.__mro__):
+        for name in getattr(klass, "__slots__", ()):
+            if name != "_child_nodes" and name not in names:
+                names.append(name)
+    return tuple(names)
+
+
+class Optimizer:
+    """Rewrites an AST bottom up.  Nodes are simplified in the
+    post_visit of a walk, so the operands of an expression have
+    been simplified before the expression itself; a simplified
+    node's parent then picks up its replacement.
+    """
+    def __init__(self,
+                 type_of: Callable[[object], Optional[str]] = static_type,
+                 pool: Optional[grammar_ast.NodePool] = None):
+        self.type_of = type_of
+        self.pool = pool
+        self.folded = 0
+        self.simplified = 0
+        # id(original) -> (original, replacement).  Holding the
+        # original keeps its id from being reused.
+        self._replaced: dict[int, tuple[ASTNode, ASTNode]] = {}
+        # Parse tree fragments QuackTransformer has not yet reshaped;
+        # the walk does not enter them, so we do.
+        self._trees_done: set[int] = set()
+
+    def optimize(self, root: ASTNode) -> ASTNode:
+        """The simplified tree; root itself may be replaced"""
+        root.walk(None, grammar_ast.ignore, self._post_visit)
+        return self._subst(root)
+
+    def _post_visit(self, node: ASTNode, visit_state):
+        self._patch(node)
+        replacement = self.simplify(node)
+        if replacement is not node:
+            self._replaced[id(node)] = (node, replacement)
+
+    def _patch(self, node: ASTNode):
+        """Substitute replacements of node's children"""
+        for name in _fields(type(node)):
+            value = getattr(node, name, None)
+            if value is None:
+                continue
+            if name == "_children":
+                node.children = self._subst(value)
+            else:
+                setattr(node, name, self._subst(value))
+
+    def _subst(self, value, walked: bool = True):
+        if isinstance(value, ASTNode):
+            if not walked:
+                return self.optimize(value)
+            return self._replaced.get(id(value), (None, value))[1]
+        if isinstance(value, list):
+            return [self._subst(item, walked) for item in value]
+        if isinstance(value, lark.Tree) and id(value) not in self._trees_done:
+            self._trees_done.add(id(value))
+            value.children = [self._subst(child, walked=False) for child in value.children]
+        return value
+
+    def const(self, value) -> ConstNode:
+        if self.pool is not None:
+            return self.pool.leaf(ConstNode, value)
+        return ConstNode(value)
+
+    def simplify(self, node: ASTNode) -> ASTNode:
+        """A node equivalent to node (or node itself)"""
+        if not isinstance(node, MethodCallNode):
+            return node
+        if node.name == BOOLEAN_NOT and not node.actuals:
+            value = literal(node.receiver)
+            if type(value) is bool:
+                return self._fold(node, not value)
+            return node
+        if len(node.actuals) != 1:
+            return node
+        left, right = node.receiver, node.actuals[0]
+        left_value, right_value = literal(left), literal(right)
+        if left_value is not None and right_value is not None:
+            return self._fold_binary(node, left_value, right_value)
+        if (node.name in RIGHT_IDENTITIES and right_value is not None
+                and type(right_value) is int
+                and right_value == RIGHT_IDENTITIES[node.name]
+                and self.type_of(left) == "Int"):
+            return self._simplified(node, left)
+        if (node.name in LEFT_IDENTITIES and left_value is not None
+                and type(left_value) is int
+                and left_value == LEFT_IDENTITIES[node.name]
+                and self.type_of(right) == "Int"):
+            return self._simplified(node, right)
+        return node
+
+    def _fold_binary(self, node: MethodCallNode, left, right) -> ASTNode:
+        both = type(left) if type(left) is type(right) else None
+        if node.name in INT_ARITHMETIC and both is int:
+            if node.name == "DIVIDE" and right == 0:
+                return node  # Fails at run time, as written
+            value = INT_ARITHMETIC[node.name](left, right)
+            if INT_MIN <= value <= INT_MAX:
+                return self._fold(node, value)
+        elif node.name in COMPARISONS and both is int:
+            return self._fold(node, COMPARISONS[node.name](left, right))
+        elif node.name == "EQ" and both is bool:
+            return self._fold(node, left == right)
+        elif node.name in BOOLEAN_OPS and both is bool:
+            return self._fold(node, BOOLEAN_OPS[node.name](left, right))
+        return node
+
+    def _fold(self, node: ASTNode, value) -> ConstNode:
+        self.folded += 1
+        folded = self.const(value)
+        if trace.on:
+            trace("Folded %s to %s", node, folded)
+        return folded
+
+    def _simplified(self, node: ASTNode, replacement: ASTNode) -> ASTNode:
+        self.simplified += 1
+        if trace.on:
+            trace("Simplified %s to %s", node, replacement)
+        return replacement
+
+
+def optimize(root: ASTNode, **options) -> ASTNode:
+    """Fold constants and simplify identities in the tree
+    rooted at root, returning the new root.  Options are
+    those of Optimizer.
+    """
+    return Optimizer(**options).optimize(root)
@@ -7,11 +7,15 @@ for this example so there is no confusion about the parts.
 
 import grammar_ast
 import lark
+import tracing
 
 import logging
 logging.basicConfig()
 log = logging.getLogger(__name__)
-#log.setLevel(logging.DEBUG)
+trace = tracing.tracer("grammar_reshape")
+
+# Identifiers that are really literals
+NAMED_LITERALS = {"true": True, "false": False, "none": None}
 
 class QuackTransformer(lark.Transformer):
     """We write a transformer for each node in the parse tree
@@ -22,7 +26,19 @@ class QuackTransformer(lark.Transformer):
     passed a lark.Token structure.
     """
 
-    def __init__(self, write_to_file: bool, file_name: str):
+    def __init__(self, write_to_file: bool, file_name: str,
+                 pool: grammar_ast.NodePool = None):
+        """With a pool, identical identifiers and literals
+        are shared rather than built anew at each occurrence.
+        """
+        self.pool = pool
+        self.reset(file_name)
+
+    def reset(self, file_name: str):
+        """Start over for another source file.  A transformer
+        built into the parser (Lark's transformer= option) is
+        reused for every file the parser handles.
+        """
         self.buffer = [""]
         self.file_name = file_name
         self.variables = {}
@@ -30,54 +46,57 @@ class QuackTransformer(lark.Transformer):
 
     def Number(self, data):
         #Terminal symbol, a regular expression in the grammar
-        log.debug(f"Processing token NUMBER with {data}")
+        trace("Processing token NUMBER with %s", data)
         val = int(data.value)
         ast_node = grammar_ast.Number(val)
-        log.debug(f"Processed token into value {ast_node}")
+        trace("Processed token into value %s", ast_node)
         return ast_node
 
     def program(self, e):
-        log.debug("-> program")
-        # log.debug(f"---{len(e)}")
-        # log.debug(f"---{e}")
-        # for i in range(len(e)):
-        #     log.debug(f"\n\n-----{e[i]}")
-
+        trace("-> program")
         classes = []
-        main_block = []
         i = 0
-        while type(e[i]) == lark.Tree:
+        while i < len(e) and isinstance(e[i], grammar_ast.ClassNode):
             classes.append(e[i])
             i += 1
-
-        while i < len(e):
-            main_block.append(e[i])
-            i += 1
-        
-
+        main_block = grammar_ast.BlockNode(e[i:])
         return grammar_ast.ProgramNode(classes, main_block)
 
     def classes(self, e):
         return e
 
     def clazz(self, e):
-        log.debug("->clazz")
-        name, formals, super, methods, constructor = e
-        return grammar_ast.ClassNode(name, formals, super, methods, constructor)
+        trace("->clazz")
+        (name, formals, super_name), (stmts, methods) = e
+        constructor = grammar_ast.BlockNode(stmts)
+        return grammar_ast.ClassNode(name, formals, super_name, methods, constructor)
+
+    def class_signature(self, e):
+        class_token, name, formals, extends_token, super_name = e
+        return name, formals, super_name or "Obj"
+
+    def class_body(self, e):
+        """Constructor statements, then methods"""
+        stmts = [s for s in e if not isinstance(s, grammar_ast.MethodNode)]
+        methods = [m for m in e if isinstance(m, grammar_ast.MethodNode)]
+        return stmts, methods
+
+    def formal_args(self, e):
+        # Alternating names and types, or None if there are none
+        parts = [part for part in e if part is not None]
+        return [grammar_ast.FormalNode(parts[i], parts[i + 1])
+                for i in range(0, len(parts), 2)]
 
     def methods(self, e):
         return e
 
     def method(self, e):
-        #def __init__(self, name: str, arguments: list[ASTNode], return_type: str, block: ASTNode)
-        log.debug("-> method")
-        log.debug(f"---{e}")
-        log.debug(f"---{len(e)}")
-        def_string, name, formals, returns, body = e
-        #return grammar_ast.MethodNode(name, formals, returns, body)
+        trace("-> method %s", e[1])
+        def_token, name, formals, returns, body = e
+        return grammar_ast.MethodNode(name, formals, returns or "Nothing", body)
 
     def statement(self, e):
-        log.debug("-> statement")
+        trace("-> statement")
         return e
 
     def returns(self, e):
@@ -92,108 +111,217 @@ class QuackTransformer(lark.Transformer):
 
 
     def formal(self, e):
-        log.debug("->formal")
+        trace("->formal")
         var_name, var_type = e
         return grammar_ast.FormalNode(var_name, var_type)
 
 
     def expr(self, e):
-        log.debug("->expr")
+        trace("->expr")
         return grammar_ast.ExpressionNode(e[0])
 
 
     def ident(self, e):
         """A terminal symbol """
-        log.debug(f"-> ident, name: {e[0]}")
+        trace("-> ident, name: %s", e[0])
+        if self.pool is not None:
+            return self.pool.name(e[0])
         return e[0]
 
 
+    def int_literal(self, e):
+        return self.const(int(e[0]))
+
+
+    def string_literal(self, e):
+        # Keep the text between the quotes as written
+        return self.const(e[0][1:-1])
+
+
+    def const(self, value) -> grammar_ast.ConstNode:
+        if self.pool is not None:
+            return self.pool.leaf(grammar_ast.ConstNode, value)
+        return grammar_ast.ConstNode(value)
+
+
     def variable_ref(self, e):
-        """A reference to a variable"""
-        log.debug("->variable_ref")
-        return grammar_ast.VariableRefNode(e[0])
+        """A reference to a variable, or one of the
+        literals that look like variables
+        """
+        trace("->variable_ref")
+        name = e[0]
+        if name in NAMED_LITERALS:
+            return self.const(NAMED_LITERALS[name])
+        return grammar_ast.VariableReferenceNode(name)
+
+
+    def field_reference(self, e):
+        trace("->field_reference")
+        obj, field = e
+        return grammar_ast.FieldReferenceNode(obj, field)
+
+
+    def function_call(self, e):
+        trace("->function_call")
+        receiver, name, actuals = e
+        return grammar_ast.MethodCallNode(name, receiver, actuals)
+
+
+    def method_call(self, e):
+        """ClassName(actuals) constructs an object"""
+        trace("->constructor call")
+        class_name, actuals = e
+        return grammar_ast.ConstructorCallNode(class_name, actuals)
+
+
+    def actual_args(self, e):
+        return [actual for actual in e if actual is not None]
 
 
     def block(self, e) -> grammar_ast.ASTNode:
-        log.debug("->block")
+        trace("->block")
         stmts = e
         return grammar_ast.BlockNode(stmts)
 
 
     def assignment(self, e) -> grammar_ast.ASTNode:
-        log.debug("->assignment")
-        # Structure of e is [Token('BLAH','blah')]
-        blah = str(e[0])
-        return grammar_ast.AssignmentNode(blah)
+        trace("->assignment")
+        target, declared_type, assign_token, value = e
+        return grammar_ast.AssignmentNode(target, value, declared_type)
 
 
     def if_statement(self, e) -> grammar_ast.ASTNode:
-        log.debug("->ifstmt")
-        cond, thenpart, elsepart = e
-        return grammar_ast.IfStmtNode(cond, thenpart, elsepart)
+        trace("->ifstmt")
+        # if c1 {b1} elif c2 {b2} ... else {bn}, without the keywords
+        # (and without None, from an absent else)
+        parts = [part for part in e
+                 if part is not None and not isinstance(part, lark.Token)]
+        if len(parts) % 2:
+            stmt = parts.pop()
+        else:
+            stmt = grammar_ast.BlockNode([])
+        # elif is an if in the else part
+        while parts:
+            thenpart = parts.pop()
+            cond = parts.pop()
+            stmt = grammar_ast.IfNode(cond, thenpart, stmt)
+            if parts:
+                stmt = grammar_ast.BlockNode([stmt])
+        return stmt
+
+
+    def while_statement(self, e) -> grammar_ast.ASTNode:
+        trace("->while")
+        while_token, cond, body = e
+        return grammar_ast.WhileNode(cond, body)
+
+
+    def return_statement(self, e) -> grammar_ast.ASTNode:
+        trace("->return")
+        return_token, expr = e
+        return grammar_ast.ReturnNode(expr)
+
+
+    def bare_expression(self, e) -> grammar_ast.ASTNode:
+        trace("->bare_expression")
+        return grammar_ast.BareExpressionNode(e[0])
 
 
     def otherwise(self, e) -> grammar_ast.ASTNode:
-        log.debug("->otherwise")
+        trace("->otherwise")
         return e
 
 
     def elseblock(self, e) -> grammar_ast.ASTNode:
-        log.debug("->elseblock")
+        trace("->elseblock")
         return e[0]  # Unwrap one level of block
 
 
     def cond(self, e) -> grammar_ast.ASTNode:
-        log.debug("->cond")
+        trace("->cond")
         return e
 
 
     def plus(self, e):
         left, operand, right = e
-        log.debug(f"-> adding {left} {operand} {right}")
+        trace("-> adding %s %s %s", left, operand, right)
         return grammar_ast.MethodCallNode("PLUS", left, [ right ])
 
 
     def minus(self, e):
-        log.debug("-> minus")
+        trace("-> minus")
         left, operand, right = e
-        log.debug(f"-> subtracting {left} {operand} {right}")
+        trace("-> subtracting %s %s %s", left, operand, right)
         return grammar_ast.MethodCallNode("MINUS", left, [ right ])
 
 
     def multiply(self, e):
         left, operand, right = e
-        log.debug(f"-> multiplying {left} {operand} {right}")
+        trace("-> multiplying %s %s %s", left, operand, right)
         return grammar_ast.MethodCallNode("MULTIPLY", left, [ right ])
 
 
     def divide(self, e):
         left, operand, right = e
-        log.debug(f"-> dividing {left} {operand} {right}")
+        trace("-> dividing %s %s %s", left, operand, right)
         return grammar_ast.MethodCallNode("DIVIDE", left, [ right ])
 
 
-    def boolean_and(self, e):
+    def equality(self, e):
+        left, operand, right = e
+        trace("-> comparing %s %s %s", left, operand, right)
+        return grammar_ast.MethodCallNode("EQ", left, [ right ])
+
+
+    # Objects have only 'less' and 'equals', so we rewrite
+    # the other comparisons in terms of 'less'.  (Evaluation
+    # order is unchanged:  arguments are evaluated before
+    # the receiver, so a > b still evaluates a first.)
+    def lessthan(self, e):
+        left, operand, right = e
+        trace("-> comparing %s %s %s", left, operand, right)
+        return grammar_ast.MethodCallNode("LT", left, [ right ])
+
+
+    def lessthan_equalto(self, e):
+        left, operand, right = e
+        trace("-> comparing %s %s %s", left, operand, right)
+        greater = grammar_ast.MethodCallNode("LT", right, [ left ])
+        return grammar_ast.MethodCallNode("BOOLEAN_NOT", greater, [])
+
+
+    def greaterthan(self, e):
         left, operand, right = e
-        log.debug(f"-> and {left} {operand} {right}")
+        trace("-> comparing %s %s %s", left, operand, right)
+        return grammar_ast.MethodCallNode("LT", right, [ left ])
+
+
+    def greaterthan_equalto(self, e):
+        left, operand, right = e
+        trace("-> comparing %s %s %s", left, operand, right)
+        less = grammar_ast.MethodCallNode("LT", left, [ right ])
+        return grammar_ast.MethodCallNode("BOOLEAN_NOT", less, [])
+
+
+    def bool_and(self, e):
+        left, operand, right = e
+        trace("-> and %s %s %s", left, operand, right)
         return grammar_ast.MethodCallNode("BOOLEAN_AND", left, [ right ])
 
 
-    def boolean_or(self, e):
+    def bool_or(self, e):
         left, operand, right = e
-        log.debug(f"-> or {left} {operand} {right}")
+        trace("-> or %s %s %s", left, operand, right)
         return grammar_ast.MethodCallNode("BOOLEAN_OR", left, [ right ])
 
 
-    def boolean_not(self, e):
+    def bool_not(self, e):
         operand, right = e
-        log.debug(f"-> not {operand} {right}")
-        return grammar_ast.MethodCallNode("BOOLEAN_NOT", [ right ])
+        trace("-> not %s %s", operand, right)
+        return grammar_ast.MethodCallNode("BOOLEAN_NOT", right, [])
 
 
     def times_negative_one(self, e):
         operand, right = e
-        log.debug(f"-> negating/multiplying -1 {operand} {right}")
-        return grammar_ast.MethodCallNode("MULTIPLY", -1, [ right ])
-
-
+        trace("-> negating/multiplying -1 %s %s", operand, right)
+        return grammar_ast.MethodCallNode("MULTIPLY", self.const(-1), [ right ])
@@ -0,0 +1,583 @@
+"""Static type inference for Quack.
+
+Before code generation we must know, for each method call, the
+class in which to look up the method:  the vtable slot of 'plus'
+in Int is not its slot in String or in a user class.  We infer the
+static type of every expression, and resolve each MethodCallNode
+to its class and slot (recorded in the node for code generation
+and later optimizations).
+
+Built-in classes come from the object library (OBJ/*.json), which
+gives their method and field names in vtable order; their argument
+and return types, which the library does not record, are in
+BUILTIN_SIGNATURES.  User classes come from the program.
+
+Types of variables are flow-sensitive:  a variable has, at each
+point in a method, the type of the values that may have been
+assigned to it along the paths to that point.  Where paths join
+(after an if, around a loop) types join at their least common
+ancestor class.  Each statement is visited once, except loop
+bodies, which are visited until their types stop changing (types
+only move up the class hierarchy, so that takes at most a few
+passes), so inference takes time linear in the size of the program.
+"""
+
+import functools
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import grammar_ast
+from grammar_ast import (ASTNode, AssignmentNode, BareExpressionNode,
+                         BlockNode, ClassNode, ConstNode, ConstructorCallNode,
+                         FieldReferenceNode, IfNode, MethodCallNode,
+                         MethodNode, ProgramNode, ReturnNode,
+                         VariableReferenceNode, WhileNode)
+import tracing
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+trace = tracing.tracer("grammar_types")
+
+OBJ_LIBRARY = Path(__file__).with_name("OBJ")
+
+# (argument types, return type)
+Signature = Tuple[List[str], str]
+
+# Argument and return types of built-in methods.  A class
+# inherits the signatures of its superclass.
+BUILTIN_SIGNATURES: Dict[str, Dict[str, Signature]] = {
+    "Obj": {
+        "$constructor": ([], "Obj"),
+        "string": ([], "String"),
+        "print": ([], "Nothing"),
+        "equals": (["Obj"], "Boolean"),
+    },
+    "Int": {
+        "$constructor": ([], "Int"),
+        "less": (["Int"], "Boolean"),
+        "plus": (["Int"], "Int"),
+        "minus": (["Int"], "Int"),
+        "multiply": (["Int"], "Int"),
+        "divide": (["Int"], "Int"),
+    },
+    "String": {
+        "$constructor": ([], "String"),
+        "less": (["String"], "Boolean"),
+        "plus": (["String"], "String"),
+    },
+    "Boolean": {"$constructor": ([], "Boolean")},
+    "Nothing": {"$constructor": ([], "Nothing")},
+}
+
+# Operators, as QuackTransformer names them, are calls of these methods
+OPERATOR_METHODS = {
+    "PLUS": "plus",
+    "MINUS": "minus",
+    "MULTIPLY": "multiply",
+    "DIVIDE": "divide",
+    "EQ": "equals",
+    "LT": "less",
+}
+
+
+class QuackTypeError(Exception):
+    """The program is not type correct"""
+
+
+class ClassInfo:
+    """What type inference knows of one class"""
+    def __init__(self, name: str, super_name: Optional[str], methods: List[str]):
+        self.name = name
+        self.super_name = super_name   # None only for Obj
+        self.methods = methods         # In vtable order
+        self.slots = {method: slot for slot, method in enumerate(methods)}
+        # Including inherited methods and fields
+        self.signatures: Dict[str, Signature] = {}
+        self.fields: Dict[str, str] = {}
+        self.depth = 0                 # Obj is 0, its subclasses 1, ...
+
+    def asm_name(self) -> str:
+        return grammar_ast.ASM_CLASS_NAMES.get(self.name, self.name)
+
+
+@functools.lru_cache(maxsize=None)
+def builtin_classes(library: Path = OBJ_LIBRARY) -> Dict[str, ClassInfo]:
+    """The built-in classes, from the object library.  They are
+    shared by every ClassHierarchy, so never modify them.
+    """
+    classes = {}
+    # Superclasses first
+    for name in ["Obj", "Int", "String", "Boolean", "Nothing"]:
+        path = library.joinpath(grammar_ast.ASM_CLASS_NAMES.get(name, name))
+        with open(path.with_suffix(".json")) as f:
+            record = json.load(f)
+        super_name = None if name == "Obj" else "Obj"
+        info = ClassInfo(name, super_name, record["methods"])
+        if super_name:
+            info.signatures.update(classes[super_name].signatures)
+            info.fields.update(classes[super_name].fields)
+            info.depth = classes[super_name].depth + 1
+        info.signatures.update(BUILTIN_SIGNATURES[name])
+        # The library lists fields by name only; built-ins have none
+        for field in record["fields"]:
+            info.fields[field] = "Obj"
+        classes[name] = info
+    return classes
+
+
+class ClassHierarchy:
+    """Built-in classes and the classes of one program"""
+    def __init__(self, library: Path = OBJ_LIBRARY):
+        self.classes: Dict[str, ClassInfo] = dict(builtin_classes(library))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.classes
+
+    def __getitem__(self, name: str) -> ClassInfo:
+        return self.classes[name]
+
+    def is_builtin(self, name: str) -> bool:
+        return name in BUILTIN_SIGNATURES
+
+    def add_class(self, node: ClassNode) -> ClassInfo:
+        """Methods and signatures of a user class, whose
+        superclass must already be present.  (Fields are
+        added as the constructor is inferred.)
+        """
+        parent = self.classes[node.super_class]
+        methods = list(parent.methods)
+        for method in node.methods:
+            if method.name not in parent.slots:
+                methods.append(method.name)
+        info = ClassInfo(node.name, parent.name, methods)
+        info.depth = parent.depth + 1
+        info.signatures.update(parent.signatures)
+        info.fields.update(parent.fields)
+        for method in node.methods + [node.constructor]:
+            info.signatures[method.name] = (
+                [formal.var_type for formal in method.formals],
+                method.return_type)
+        self.classes[node.name] = info
+        return info
+
+    def is_subtype(self, sub: str, sup: str) -> bool:
+        info = self.classes.get(sub)
+        while info is not None:
+            if info.name == sup:
+                return True
+            info = self.classes.get(info.super_name)
+        return False
+
+    def join(self, a: Optional[str], b: Optional[str]) -> Optional[str]:
+        """Least common ancestor of a and b; None is 'no type yet'"""
+        if a is None or a == b:
+            return b
+        if b is None:
+            return a
+        if a not in self.classes or b not in self.classes:
+            return "Obj"    # Unknown type; already reported
+        left, right = self.classes[a], self.classes[b]
+        while left.depth > right.depth:
+            left = self.classes[left.super_name]
+        while right.depth > left.depth:
+            right = self.classes[right.super_name]
+        while left is not right:
+            left = self.classes[left.super_name]
+            right = self.classes[right.super_name]
+        return left.name
+
+
+# Variable name -> static type at a point in a method.  Within a
+# constructor, fields being initialized appear as "this.field".
+Env = Dict[str, str]
+
+
+def join_envs(hierarchy: ClassHierarchy, a: Env, b: Env) -> Env:
+    """Variables defined on both paths, at the join of their types"""
+    return {var: hierarchy.join(a[var], b[var]) for var in a if var in b}
+
+
+class TypeInference:
+    """Infers static types throughout a program, recording them in
+    the AST, and collecting type errors (in errors) rather than
+    stopping at the first.
+    """
+    def __init__(self, hierarchy: Optional[ClassHierarchy] = None):
+        self.hierarchy = hierarchy if hierarchy is not None else ClassHierarchy()
+        self.errors: List[str] = []
+        # While typing a loop (see infer_while): errors held back
+        # until it settles, and the types at the head of each loop
+        # in it, by id of the WhileNode
+        self.pending: Optional[List[str]] = None
+        self.loop_heads: Optional[Dict[int, Env]] = None
+        self.loops_changed = False
+        # Where we are
+        self.clazz: Optional[ClassInfo] = None
+        self.method: Optional[MethodNode] = None
+
+    def error(self, msg: str):
+        where = ""
+        if self.clazz is not None:
+            where = self.clazz.name
+            if self.method is not None:
+                where += f".{self.method.name}"
+            where += ": "
+        self.report(where + msg)
+
+    def report(self, msg: str):
+        if self.pending is not None:
+            self.pending.append(msg)
+            return
+        log.error("%s", msg)
+        self.errors.append(msg)
+
+    def check(self):
+        """Raise QuackTypeError if there were type errors"""
+        if self.errors:
+            raise QuackTypeError(f"{len(self.errors)} type error(s), first: {self.errors[0]}")
+
+    # ---- Classes ----
+
+    def infer_program(self, program: ProgramNode):
+        classes = self.declare_classes(program.classes)
+        for node in classes:
+            self.clazz = self.hierarchy[node.name]
+            self.infer_constructor(node)
+            for method in node.methods:
+                self.infer_method(method)
+            self.clazz = self.method = None
+
+    def declare_classes(self, nodes: List[ClassNode]) -> List[ClassNode]:
+        """Add classes to the hierarchy, superclasses first,
+        and return them in that order
+        """
+        by_name: Dict[str, ClassNode] = {}
+        for node in nodes:
+            if node.name in by_name or node.name in self.hierarchy:
+                self.error(f"Class {node.name} is already defined")
+            else:
+                by_name[node.name] = node
+        ordered = []
+        state: Dict[str, str] = {}     # name -> "visiting" or "done"
+        for name in by_name:
+            # Walk up to a known class, then add classes on the way down
+            chain = []
+            while name in by_name and name not in state:
+                state[name] = "visiting"
+                chain.append(by_name[name])
+                name = by_name[name].super_class
+            if name not in self.hierarchy:
+                if state.get(name) == "visiting":
+                    self.error(f"Class {name} inherits from itself")
+                elif name not in by_name:
+                    self.error(f"Class {chain[-1].name} extends unknown class {name}")
+                # else it inherits from a class that failed, already reported.
+                # Not added, but done: its subclasses will stop here
+                for node in chain:
+                    state[node.name] = "done"
+                continue
+            for node in reversed(chain):
+                state[node.name] = "done"
+                if self.hierarchy.is_builtin(node.super_class) and node.super_class != "Obj":
+                    self.error(f"Class {node.name} may not extend {node.super_class}")
+                self.hierarchy.add_class(node)
+                ordered.append(node)
+        for node in ordered:
+            self.clazz = self.hierarchy[node.name]
+            self.check_signatures(node)
+        self.clazz = None
+        return ordered
+
+    def check_signatures(self, node: ClassNode):
+        """Types named in signatures exist; overriding
+        methods are compatible with what they override
+        """
+        parent = self.hierarchy[node.super_class]
+        for method in node.methods + [node.constructor]:
+            self.method = method
+            for formal in method.formals:
+                if formal.var_type not in self.hierarchy:
+                    self.error(f"Unknown type {formal.var_type} of argument {formal.var_name}")
+            if method.return_type not in self.hierarchy:
+                self.error(f"Unknown return type {method.return_type}")
+            if method is node.constructor or method.name not in parent.signatures:
+                continue
+            arg_types, return_type = parent.signatures[method.name]
+            if len(arg_types) != len(method.formals):
+                self.error(f"Overrides {parent.name}.{method.name} "
+                           f"with a different number of arguments")
+                continue
+            for formal, inherited in zip(method.formals, arg_types):
+                if not self.hierarchy.is_subtype(inherited, formal.var_type):
+                    self.error(f"Argument {formal.var_name}: {formal.var_type} "
+                               f"does not accept {inherited}, as in {parent.name}.{method.name}")
+            if not self.hierarchy.is_subtype(method.return_type, return_type):
+                self.error(f"Returns {method.return_type}, not the {return_type} "
+                           f"of {parent.name}.{method.name}")
+        self.method = None
+
+    def formals_env(self, method: MethodNode) -> Env:
+        env = {"this": self.clazz.name}
+        for formal in method.formals:
+            env[formal.var_name] = formal.var_type
+        return env
+
+    def infer_constructor(self, node: ClassNode):
+        """The constructor determines the fields of the class"""
+        constructor = node.constructor
+        self.method = constructor
+        env = self.infer_block(constructor.block, self.formals_env(constructor))
+        fields = {var[len("this."):]: var_type for var, var_type in env.items()
+                  if var.startswith("this.")}
+        inherited = self.hierarchy[node.super_class].fields
+        for field, field_type in inherited.items():
+            if field not in fields:
+                self.error(f"Inherited field {field} is not initialized")
+            elif not self.hierarchy.is_subtype(fields[field], field_type):
+                self.error(f"Field {field} is {fields[field]}, not {field_type} as inherited")
+        self.clazz.fields = dict(inherited)
+        node.fields = []
+        for field, field_type in fields.items():
+            if field not in inherited:
+                self.clazz.fields[field] = field_type
+                node.fields.append(field)
+        self.method = None
+
+    def infer_method(self, method: MethodNode):
+        self.method = method
+        self.infer_block(method.block, self.formals_env(method))
+        self.method = None
+
+    # ---- Statements ----
+
+    def infer_block(self, block, env: Env) -> Env:
+        """Infer types in a statement or list of statements,
+        given the types of variables before, and return
+        their types after.
+        """
+        for stmt in grammar_ast.flatten([block]):
+            env = self.infer_statement(stmt, env)
+        return env
+
+    def infer_statement(self, stmt, env: Env) -> Env:
+        if isinstance(stmt, BlockNode):
+            return self.infer_block(stmt.stmts, env)
+        if isinstance(stmt, AssignmentNode):
+            return self.infer_assignment(stmt, env)
+        if isinstance(stmt, BareExpressionNode):
+            self.infer_expr(stmt.e, env)
+            return env
+        if isinstance(stmt, ReturnNode):
+            self.infer_return(stmt, env)
+            return env
+        if isinstance(stmt, IfNode):
+            self.expect_boolean(stmt.cond, env, "if condition")
+            then_env = self.infer_block(stmt.thenpart, dict(env))
+            else_env = self.infer_block(stmt.elsepart, dict(env))
+            return join_envs(self.hierarchy, then_env, else_env)
+        if isinstance(stmt, WhileNode):
+            return self.infer_while(stmt, env)
+        self.error(f"Cannot infer types of statement {stmt!r:.60}")
+        return env
+
+    def infer_assignment(self, stmt: AssignmentNode, env: Env) -> Env:
+        value_type = self.infer_expr(stmt.expression_assigned, env)
+        target = stmt.target
+        if stmt.declared_type is not None:
+            if stmt.declared_type not in self.hierarchy:
+                self.error(f"Unknown type {stmt.declared_type} of {target}")
+            elif not self.hierarchy.is_subtype(value_type, stmt.declared_type):
+                self.error(f"Assigning {value_type} to {target}: {stmt.declared_type}")
+            else:
+                value_type = stmt.declared_type
+        env = dict(env)
+        if isinstance(target, VariableReferenceNode):
+            if target.name == "this":
+                self.error("Cannot assign to this")
+            target.static_type = value_type
+            env[target.name] = value_type
+        elif isinstance(target, FieldReferenceNode) and self.is_this(target.obj):
+            target.obj.static_type = self.clazz.name
+            target.static_type = value_type
+            if self.method.name == "$constructor":
+                env[f"this.{target.field}"] = value_type
+            elif target.field not in self.clazz.fields:
+                self.error(f"No field {target.field}")
+            elif not self.hierarchy.is_subtype(value_type, self.clazz.fields[target.field]):
+                self.error(f"Assigning {value_type} to field {target.field}: "
+                           f"{self.clazz.fields[target.field]}")
+        else:
+            self.error(f"Cannot assign to {target}")
+        return env
+
+    def infer_return(self, stmt: ReturnNode, env: Env):
+        if stmt.expr is None:
+            value_type = "Nothing"
+        else:
+            value_type = self.infer_expr(stmt.expr, env)
+        if self.method.name == "$constructor":
+            self.error("Constructors may not return a value")
+        elif not self.hierarchy.is_subtype(value_type, self.method.return_type):
+            self.error(f"Returns {value_type}, not {self.method.return_type}")
+
+    def infer_while(self, stmt: WhileNode, env: Env) -> Env:
+        """The body may run any number of times, so we iterate
+        to the types that hold at the top of every trip around
+        the loop.  (Types only move up, so this terminates.)
+        Only the outermost loop is iterated: each trip of it makes
+        one trip of each loop within (loop_trip), and it goes
+        around again until none of them changed, so the trips of
+        nested loops grow with their number, not their depth.
+        The last trip is made with the final types, so the types
+        it records in the nodes stand; the errors it finds are
+        held back until then, and reported just once.
+        """
+        if self.loop_heads is not None:
+            return self.loop_trip(stmt, env)
+        self.loop_heads = {}
+        while True:
+            self.pending = []
+            self.loops_changed = False
+            after = self.loop_trip(stmt, env)
+            if not self.loops_changed:
+                break
+        errors, self.pending, self.loop_heads = self.pending, None, None
+        for msg in errors:
+            self.report(msg)
+        return after
+
+    def loop_trip(self, stmt: WhileNode, env: Env) -> Env:
+        """One trip around a loop, from the types at its head:
+        those it came to on the last trip (if any) joined with
+        those it is entered with.  Returns the new types at the
+        head, which hold after the loop once nothing changes.
+        """
+        head = self.loop_heads.get(id(stmt))
+        head = env if head is None else join_envs(self.hierarchy, head, env)
+        self.expect_boolean(stmt.cond, head, "while condition")
+        after_body = self.infer_block(stmt.body, dict(head))
+        joined = join_envs(self.hierarchy, head, after_body)
+        if joined != head:
+            trace("Loop in %s again with %s", self.method.name, joined)
+            self.loops_changed = True
+        self.loop_heads[id(stmt)] = joined
+        return joined
+
+    # ---- Expressions ----
+
+    def expect_boolean(self, expr: ASTNode, env: Env, what: str):
+        cond_type = self.infer_expr(expr, env)
+        if cond_type != "Boolean":
+            self.error(f"The {what} {expr} is {cond_type}, not Boolean")
+
+    def infer_expr(self, expr: ASTNode, env: Env) -> str:
+        """Static type of expr, with variables typed as in env.
+        Types of subexpressions are recorded in their nodes.
+        """
+        if not isinstance(expr, ASTNode):
+            self.error(f"Cannot infer type of {expr!r:.60}")
+            return "Obj"
+        # Post-order, so operands are typed before operations
+        expr.walk(env, grammar_ast.ignore, self._type_visit)
+        return expr.static_type or "Obj"
+
+    def is_this(self, node) -> bool:
+        return isinstance(node, VariableReferenceNode) and node.name == "this"
+
+    def _type_visit(self, node: ASTNode, env: Env):
+        if isinstance(node, VariableReferenceNode):
+            if node.name not in env:
+                self.error(f"Variable {node.name} may be used before it is assigned")
+                node.static_type = "Obj"
+            else:
+                node.static_type = env[node.name]
+        elif isinstance(node, FieldReferenceNode):
+            self.type_field(node, env)
+        elif isinstance(node, MethodCallNode):
+            self.resolve_call(node)
+        elif isinstance(node, ConstructorCallNode):
+            self.resolve_constructor(node)
+        elif not isinstance(node, ConstNode):
+            self.error(f"Cannot infer type of {node.__class__.__name__}")
+
+    def type_field(self, node: FieldReferenceNode, env: Env):
+        node.static_type = "Obj"
+        if not self.is_this(node.obj):
+            self.error(f"Field {node} of another object; only this.{node.field} is allowed")
+        elif self.method.name == "$constructor":
+            key = f"this.{node.field}"
+            if key not in env:
+                self.error(f"Field {node.field} may be used before it is initialized")
+            else:
+                node.static_type = env[key]
+        elif node.field not in self.clazz.fields:
+            self.error(f"No field {node.field}")
+        else:
+            node.static_type = self.clazz.fields[node.field]
+
+    def asm_class(self, info: ClassInfo) -> str:
+        """How code for the current class refers to class info"""
+        return "$" if info is self.clazz else info.asm_name()
+
+    def resolve_call(self, node: MethodCallNode):
+        """Static type of the call, and where the method is"""
+        if node.name in grammar_ast.BOOLEAN_OPERATORS:
+            for operand in [node.receiver] + node.actuals:
+                if operand.static_type != "Boolean":
+                    self.error(f"Operand {operand} of {node.name} is "
+                               f"{operand.static_type}, not Boolean")
+            node.static_type = "Boolean"
+            return
+        node.static_type = "Obj"
+        receiver_type = node.receiver.static_type or "Obj"
+        if receiver_type not in self.hierarchy:
+            return      # Unknown type; already reported
+        info = self.hierarchy[receiver_type]
+        method = OPERATOR_METHODS.get(node.name, node.name)
+        if method not in info.slots or method not in info.signatures:
+            self.error(f"{receiver_type} has no method {method}")
+            return
+        arg_types, return_type = info.signatures[method]
+        if len(arg_types) != len(node.actuals):
+            self.error(f"{receiver_type}.{method} takes {len(arg_types)} "
+                       f"argument(s), not {len(node.actuals)}")
+        for actual, arg_type in zip(node.actuals, arg_types):
+            actual_type = actual.static_type or "Obj"
+            if not self.hierarchy.is_subtype(actual_type, arg_type):
+                self.error(f"Argument {actual} of {receiver_type}.{method} "
+                           f"is {actual_type}, not {arg_type}")
+        node.static_type = return_type
+        node.static_class = receiver_type
+        node.asm_class = self.asm_class(info)
+        node.method = method
+        node.slot = info.slots[method]
+        if trace.on:
+            trace("%s resolved to %s slot %s", node, receiver_type, node.slot)
+
+    def resolve_constructor(self, node: ConstructorCallNode):
+        if node.class_name not in self.hierarchy:
+            self.error(f"No class {node.class_name}")
+            return
+        if self.hierarchy.is_builtin(node.class_name):
+            self.error(f"Cannot construct {node.class_name}; use a literal")
+            return
+        info = self.hierarchy[node.class_name]
+        arg_types, _ = info.signatures["$constructor"]
+        if len(arg_types) != len(node.actuals):
+            self.error(f"{node.class_name}() takes {len(arg_types)} "
+                       f"argument(s), not {len(node.actuals)}")
+        for actual, arg_type in zip(node.actuals, arg_types):
+            actual_type = actual.static_type or "Obj"
+            if not self.hierarchy.is_subtype(actual_type, arg_type):
+                self.error(f"Argument {actual} of {node.class_name}() "
+                           f"is {actual_type}, not {arg_type}")
+        node.asm_class = self.asm_class(info)
+
+
+def infer(program: ProgramNode, hierarchy: Optional[ClassHierarchy] = None) -> TypeInference:
+    """Infer types throughout program; see TypeInference.errors"""
+    inference = TypeInference(hierarchy)
+    inference.infer_program(program)
+    return inference
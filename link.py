@@ -0,0 +1,237 @@
+"""Link a program into one image for the tiny virtual machine.
+
+Without linking, the VM loads a program a class at a time: it
+finds each class's object module in the load library, then
+renumbers the module's constants into the program's constant pool
+and its class numbers into references to loaded classes.  For a
+short program run often, that is much of the time it takes.  The
+linker does it once: it gathers the main class and every class it
+needs (through imports and superclasses, transitively) from the
+object directory, merges their constant pools into one, numbers
+all the classes in one table, rewrites the operands of const, new,
+and is_instance to match, and writes a single image that the VM
+maps and loads in one read.
+
+    python3 link.py Main [-L OBJ] [-o OBJ/Main.tvi]
+    bin/tiny_vm -i OBJ/Main.tvi
+
+The image is in the binary form of objfile.py:
+
+    "TVMI"  version
+    main_class
+    n_constants  (kind  value) ...
+    n_classes  (class_name  super  n_fields  n_methods  n_inherited
+                n_code  (name  slot  n_words  word ...) ...) ...
+
+Classes come superclass first.  Built-in classes (whose object
+modules have no code) are in the class table, with an empty
+superclass name, so that code can refer to them; the VM supplies
+them.  As for assemble.py, run from the directory with asm.conf
+and opdefs.txt.
+"""
+
+import argparse
+import collections
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import assemble
+import objfile
+import tracing
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+trace = tracing.tracer("link")
+
+IMAGE_MAGIC = b"TVMI"
+IMAGE_VERSION = 1
+IMAGE_SUFFIX = ".tvi"
+
+
+class LinkError(Exception):
+    """A class we can't find, or object code we can't make sense of"""
+    pass
+
+
+def read_module(lib: Path, name: str) -> dict:
+    """The object module for class name, .json or binary"""
+    path = lib.joinpath(name).with_suffix(objfile.JSON_SUFFIX)
+    if path.exists():
+        return json.loads(path.read_text())
+    path = path.with_suffix(objfile.SUFFIX)
+    if path.exists():
+        return objfile.decode(path.read_bytes(), str(path))
+    raise LinkError(f"No object module for class {name} in {lib}")
+
+
+def is_builtin(module: dict) -> bool:
+    """Built-in classes have object modules for the assembler
+    (methods and fields), but no code
+    """
+    return "code" not in module
+
+
+class Linker:
+    """The classes of a program, in the order the VM must create
+    them, and one constant pool for all of them
+    """
+    def __init__(self, lib: Path):
+        self.lib = lib
+        self.modules: Dict[str, dict] = {}
+        self.order: List[str] = []      # Superclass first
+        self.constants: List[Tuple[str, str]] = []
+        self.const_index: Dict[Tuple[str, str], int] = {}
+        self.class_index: Dict[str, int] = {}
+        # Which operands to rewrite: by opcode, the operation each
+        # operand is for (a superinstruction's are its parts')
+        self.operand_ops = {instr.code: [part.code for part in instr.parts or [instr]
+                                         if int(part.ops)]
+                            for instr in assemble.INSTRS.codes}
+        self.const_op = assemble.INSTRS["const"].code
+        self.class_ops = {assemble.INSTRS["new"].code,
+                          assemble.INSTRS["is_instance"].code}
+
+    def _place(self, name: str, pending: collections.deque, subclasses: Tuple[str, ...] = ()):
+        """Add class name to the order, after its superclasses"""
+        if name in self.modules:
+            return
+        if name in subclasses:
+            raise LinkError(f"Class {name} inherits from itself")
+        module = read_module(self.lib, name)
+        if module.get("class_name") != name:
+            raise LinkError(f"Object module for {name} defines {module.get('class_name')}")
+        if not is_builtin(module):
+            self._place(module["super"], pending, subclasses + (name,))
+            pending.extend(module["imports"])
+        self.modules[name] = module
+        self.order.append(name)
+
+    def gather(self, main_class: str):
+        """main_class and every class it needs"""
+        pending = collections.deque([main_class])
+        while pending:
+            self._place(pending.popleft(), pending)
+        self.class_index = {name: i for i, name in enumerate(self.order)}
+        trace("%d classes: %s", len(self.order), " ".join(self.order))
+
+    def constant(self, constant: dict) -> int:
+        """Index of constant in the program's pool"""
+        key = (constant["kind"], constant["value"])
+        if key not in self.const_index:
+            self.const_index[key] = len(self.constants)
+            self.constants.append(key)
+        return self.const_index[key]
+
+    def relocate(self, module: dict) -> List[dict]:
+        """The code of module, with its constant and class numbers
+        replaced by the program's
+        """
+        name = module["class_name"]
+        const_map = [self.constant(c) for c in module["constants"]]
+        class_map = [self.class_index[imported] for imported in module["imports"]]
+        code = []
+        for method in module["code"]:
+            words = list(method["code"])
+            i = 0
+            while i < len(words):
+                opcode = words[i]
+                if opcode not in self.operand_ops:
+                    raise LinkError(f"{name}.{method['name']}: bad opcode {opcode} at {i}")
+                for op in self.operand_ops[opcode]:
+                    i += 1
+                    if i == len(words):
+                        raise LinkError(f"{name}.{method['name']}: missing operand at {i}")
+                    try:
+                        if op == self.const_op and words[i] >= 0:
+                            # Negative operands are the named constants
+                            words[i] = const_map[words[i]]
+                        elif op in self.class_ops:
+                            words[i] = class_map[words[i]]
+                    except IndexError:
+                        raise LinkError(f"{name}.{method['name']}: operand "
+                                        f"{words[i]} out of range at {i}")
+                i += 1
+            code.append({"name": method["name"], "slot": method["slot"], "code": words})
+        return code
+
+    def link(self, main_class: str) -> dict:
+        """The program image, as a structure (see encode_image)"""
+        self.gather(main_class)
+        classes = []
+        for name in self.order:
+            module = self.modules[name]
+            if is_builtin(module):
+                classes.append({"class_name": name, "super": "", "n_fields": 0,
+                                "n_methods": 0, "n_inherited": 0, "code": []})
+                continue
+            classes.append({"class_name": name, "super": module["super"],
+                            "n_fields": module["n_fields"],
+                            "n_methods": module["n_methods"],
+                            "n_inherited": module["n_inherited"],
+                            "code": self.relocate(module)})
+        return {"main": main_class,
+                "constants": [{"kind": kind, "value": value}
+                              for kind, value in self.constants],
+                "classes": classes}
+
+
+def encode_image(image: dict) -> bytes:
+    out = objfile.Encoder(IMAGE_MAGIC, IMAGE_VERSION)
+    out.string(image["main"])
+    out.constants(image["constants"])
+    out.int(len(image["classes"]))
+    for clazz in image["classes"]:
+        out.string(clazz["class_name"])
+        out.string(clazz["super"])
+        out.int(clazz["n_fields"])
+        out.int(clazz["n_methods"])
+        out.int(clazz["n_inherited"])
+        out.methods(clazz["code"])
+    return out.getvalue()
+
+
+def decode_image(data: bytes, name: str = "program image") -> dict:
+    d = objfile.Decoder(data, name, IMAGE_MAGIC, IMAGE_VERSION)
+    image = {"main": d.string(), "constants": d.constants(), "classes": []}
+    for _ in range(d.int()):
+        image["classes"].append({
+            "class_name": d.string(), "super": d.string(), "n_fields": d.int(),
+            "n_methods": d.int(), "n_inherited": d.int(), "code": d.methods()})
+    d.end()
+    return image
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(
+        description="Link a tiny virtual machine program into one image")
+    parser.add_argument("main_class", help="Class whose constructor is the program")
+    parser.add_argument("-L", "--lib", type=Path, default=None,
+                        help=f"Directory of object modules (default: TVMLIB, "
+                             f"{assemble.CONFIG.tvmlib})")
+    parser.add_argument("-o", "--output", type=Path, default=None,
+                        help=f"Image file (default: MAIN_CLASS{IMAGE_SUFFIX} "
+                             "in the object directory)")
+    tracing.add_trace_option(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    tracing.enable(args.trace)
+    lib = args.lib or assemble.CONFIG.tvmlib
+    output = args.output or lib.joinpath(args.main_class).with_suffix(IMAGE_SUFFIX)
+    try:
+        image = Linker(lib).link(args.main_class)
+    except (LinkError, objfile.ObjectFileError, KeyError, ValueError) as e:
+        log.error("Cannot link %s: %s", args.main_class, e)
+        sys.exit(1)
+    output.write_bytes(encode_image(image))
+    trace("%s: %d classes, %d constants", output, len(image["classes"]),
+          len(image["constants"]))
+
+
+if __name__ == "__main__":
+    main()
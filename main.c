@@ -2,11 +2,20 @@
 #include <string.h>
 #include <assert.h>
 #include <unistd.h>
+#include <time.h>
 #include "vm_state.h"
 #include "vm_loader.h"
+#include "vm_profile.h"
 #include "logger.h"
 
 #define PATHBUFSIZE 1000
+
+static double now(void) {
+    struct timespec t;
+    clock_gettime(CLOCK_MONOTONIC, &t);
+    return t.tv_sec + t.tv_nsec / 1e9;
+}
+
 int main(int argc, char *argv[]) {
     set_log_level(INFO);
     log_info("This is the tiny VM\n");
@@ -15,12 +24,36 @@ int main(int argc, char *argv[]) {
     char load_path[PATHBUFSIZE];
     int ok = 1;
     char *load_library = "./OBJ";
-    while ((opt = getopt(argc, argv, ":DL:")) != -1) {
+    char *image = 0;
+    int count_dispatches = 0;
+    char *profile = 0;
+    int report_times = 0;
+    double started = now();
+    double loaded;
+    while ((opt = getopt(argc, argv, ":bcDi:L:P:T")) != -1) {
         switch (opt) {
             case 'L':
                 load_library = optarg;
                 fprintf(stderr, "Look in '%s' for object modules\n", optarg);
                 break;
+            case 'i':
+                image = optarg;
+                break;
+            case 'b':
+                log_debug("Loading binary .tvo object modules\n");
+                vm_loader_binary = 1;
+                break;
+            case 'c':
+                count_dispatches = 1;
+                break;
+            case 'P':
+                // Profile the run, and write it here as JSON
+                profile = optarg;
+                break;
+            case 'T':
+                // Say how long loading and running took
+                report_times = 1;
+                break;
             case 'D':
                 fprintf(stderr, "Noisy debugging selected with -%c\n", opt);
                 set_log_level(DEBUG);
@@ -36,8 +69,22 @@ int main(int argc, char *argv[]) {
                 break;
         }
     }
+#ifndef VM_PROFILER
+    if (count_dispatches || profile) {
+        fprintf(stderr, "Built without VM_PROFILER, so no -c or -P\n");
+        ok = 0;
+    }
+#endif
     log_debug("Finished options, load library is %s\n", load_library);
-    if (ok && optind < argc) {
+    if (ok && image) {
+        // A linked program: one file holds every class
+        vm_loader_init(load_library);
+        main_class = vm_load_image(image);
+        ok = main_class != 0;
+        if (ok) {
+            vm_loader_set_main(main_class);
+        }
+    } else if (ok && optind < argc) {
         log_debug("There is at least one non-option argument\n");
         vm_loader_init(load_library);
         for (; ok && optind < argc; ++optind) {
@@ -47,10 +94,25 @@ int main(int argc, char *argv[]) {
         }
         vm_loader_set_main(main_class);
     }
+    loaded = now();
     if (ok) {
         log_info("Executing %s\n", main_class);
+        if (profile) {
+            vm_profile_start();
+        }
         vm_run();
+        double ran = now();
         log_info("Ran");
+        if (profile && vm_profile_dump(profile, load_library)) {
+            log_info("Profile written to %s\n", profile);
+        }
+        if (count_dispatches) {
+            fprintf(stderr, "dispatches %ld\n", vm_dispatches);
+        }
+        if (report_times) {
+            fprintf(stderr, "load_seconds %.6f\nrun_seconds %.6f\n",
+                    loaded - started, ran - loaded);
+        }
     } else {
         fprintf(stderr, "Errors, will not run\n");
     }
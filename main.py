@@ -1,63 +1,85 @@
 """Simple example: Read a sequence of sums,
 parse with Lark to form concrete syntax tree,
 transform to form abstract syntax tree.
+
+Unless the concrete syntax tree is wanted (--tree), the transformer
+is run inline by the LALR parser, so the AST is built during the
+parse and the concrete tree is never materialized.
 """
 
+import argparse
 import sys
-import lark
 import grammar_ast
+import grammar_optimize
 import grammar_reshape
+import grammar_types
+import quack_parser
+import tracing
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(
+        description="Parse a Quack program and build its abstract syntax tree")
+    parser.add_argument("source", type=argparse.FileType("r"),
+                        help="File you wish to parse")
+    parser.add_argument("target", nargs="?",
+                        help="Name of output .asm file (default: print to terminal)")
+    parser.add_argument("--tree", action="store_true",
+                        help="Build and print the parse tree (concrete syntax) "
+                             "before transforming it")
+    parser.add_argument("--no-optimize", action="store_true",
+                        help="Skip constant folding and simplification")
+    tracing.add_trace_option(parser)
+    return parser.parse_args()
 
 
 def main():
-    # Step 1:  Process the grammar to create a parser (and lexer)
-    if(len(sys.argv) != 2 and len(sys.argv) != 3):
-        print("Correct usage is:")
-        print("\t'main.py [file you wish to parse]' to print output to terminal")
-        print("\tor")
-        print("\t'main.py [file you wish to parse] [name of output .asm file]' to write output as .asm file")
-
-<<<<<<< Updated upstream
-=======
-        print("Intiating test case")
-        gram_file = open("grammar.lark", "r")
-        parser = lark.Lark(gram_file, parser="lalr")
-        src_file = open("example_grammar.txt", "r")
-        src_text = "".join(src_file.readlines())
+    args = cli()
+    tracing.enable(args.trace)
+    if args.target is None:
+        transformer = grammar_reshape.QuackTransformer(False, "lol")
+    else:
+        transformer = grammar_reshape.QuackTransformer(True, args.target)
+    src_text = args.source.read()
+
+    if args.tree:
+        # Step 1:  Process the grammar to create a parser (and lexer).
+        # Tables are cached between runs; see quack_parser
+        parser = quack_parser.build_parser()
+
+        # Step 2: Use the parser (and lexer) to create a parse tree
+        # (concrete syntax)
         concrete = parser.parse(src_text)
         print("Parse tree (concrete syntax):")
         print(concrete.pretty())
->>>>>>> Stashed changes
-        return
-
-    gram_file = open("grammar.lark", "r")
-    parser = lark.Lark(gram_file, parser="lalr")
-
-    # Step 2: Use the parser (and lexer) to create a parse tree
-    # (concrete syntax)
-    src_file = open(sys.argv[1], "r")
-    src_text = "".join(src_file.readlines())
-    concrete = parser.parse(src_text)
-    print("Parse tree (concrete syntax):")
-    print(concrete.pretty())
-
-    # Step 3: Transform the concrete syntax tree into
-    # an abstract tree, starting from the leaves and working
-    # up.
-    # Warning:  Lousy exceptions because of the way Lark applies these.
-
-    if(len(sys.argv) != 3):
-        transformer = grammar_reshape.SumsTransformer(False, "lol")
+
+        # Step 3: Transform the concrete syntax tree into
+        # an abstract tree, starting from the leaves and working
+        # up.
+        # Warning:  Lousy exceptions because of the way Lark applies these.
         ast = transformer.transform(concrete)
+    else:
+        # Steps 1-3 at once: the parser applies the transformer
+        # as it reduces each rule.
+        parser = quack_parser.build_parser(transformer=transformer)
+        ast = parser.parse(src_text)
+
+    # Step 4: Infer types, resolving method calls
+    inference = grammar_types.infer(ast)
+    if inference.errors:
+        sys.exit(f"{len(inference.errors)} type error(s)")
+
+    # Step 5: Fold constants before generating code
+    if not args.no_optimize:
+        ast = grammar_optimize.optimize(ast)
+
+    if args.target is None:
         print(ast)
         print(f"as {repr(ast)}")
+    #out_file = open(f"{args.target}.asm", "w")
+    #out_file.write(f".class {args.target}:Obj\n.method $constructor\n")
+    #out_file.write(f"{ast}")
 
-    else:
-        transformer = grammar_reshape.SumsTransformer(True, sys.argv[2])
-        ast = transformer.transform(concrete)
-        #out_file = open(f"{sys.argv[2]}.asm", "w")
-        #out_file.write(f".class {sys.argv[2]}:Obj\n.method $constructor\n")
-        #out_file.write(f"{ast}")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
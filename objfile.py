@@ -0,0 +1,227 @@
+"""Binary object modules for the tiny virtual machine.
+
+The .json object module is easy to read and to debug, but the VM
+must parse it as text, class by class, before it can run anything.
+A .tvo module holds the same data in a form the loader (vm_loader.c)
+can map into memory and read in place.  Everything is a 32-bit
+little-endian word; a string is a word holding its length in bytes,
+then its bytes (UTF-8), a null, and zeros up to a word boundary,
+so that the loader can use it where it lies.
+
+    "TVMO"  version
+    class_name  super
+    n_fields  n_methods  n_inherited
+    n_imports  import ...
+    n_method_names  method name ...
+    n_field_names  field name ...
+    n_constants  (kind  value) ...
+    n_code  (name  slot  n_words  word ...) ...
+
+The version changes whenever the layout does; the loader refuses
+a version it does not know.
+
+As a program, converts between the two forms, which way is told
+by the suffixes:
+
+    python3 objfile.py OBJ/Sample.json OBJ/Sample.tvo
+    python3 objfile.py OBJ/Sample.tvo Sample.json
+"""
+
+import argparse
+import array
+import json
+import struct
+import sys
+from pathlib import Path
+from typing import Iterable, List
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+
+MAGIC = b"TVMO"
+VERSION = 1
+SUFFIX = ".tvo"
+JSON_SUFFIX = ".json"
+
+WORD = struct.Struct("<i")
+
+
+class ObjectFileError(Exception):
+    """Not a binary object module, or not one we can read"""
+    pass
+
+
+class Encoder:
+    """Words and strings, as the binary formats have them"""
+    def __init__(self, magic: bytes, version: int):
+        self.parts: List[bytes] = [magic]
+        self.int(version)
+
+    def int(self, value: int):
+        self.parts.append(WORD.pack(value))
+
+    def string(self, s: str):
+        data = s.encode("utf-8")
+        pad = 4 - len(data) % 4    # At least one, for the null
+        self.parts.append(WORD.pack(len(data)) + data + bytes(pad))
+
+    def strings(self, names: List[str]):
+        self.int(len(names))
+        for name in names:
+            self.string(name)
+
+    def constants(self, constants: Iterable[dict]):
+        constants = list(constants)
+        self.int(len(constants))
+        for constant in constants:
+            self.string(constant["kind"])
+            self.string(constant["value"])
+
+    def methods(self, code: List[dict]):
+        self.int(len(code))
+        for method in code:
+            self.string(method["name"])
+            self.int(method["slot"])
+            words = array.array("i", method["code"])
+            if sys.byteorder == "big":
+                words.byteswap()
+            self.int(len(words))
+            self.parts.append(words.tobytes())
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.parts)
+
+
+def encode(module: dict) -> bytes:
+    """The binary module for object code as the .json module has it"""
+    out = Encoder(MAGIC, VERSION)
+    out.string(module["class_name"])
+    out.string(module["super"])
+    out.int(module["n_fields"])
+    out.int(module["n_methods"])
+    out.int(module["n_inherited"])
+    out.strings(module["imports"])
+    out.strings(module["methods"])
+    out.strings(module["fields"])
+    out.constants(module["constants"])
+    out.methods(module["code"])
+    return out.getvalue()
+
+
+class Decoder:
+    """Reads what an Encoder writes"""
+    def __init__(self, data: bytes, name: str, magic: bytes, version: int):
+        self.data = memoryview(data)
+        self.name = name
+        if data[:len(magic)] != magic:
+            raise ObjectFileError(f"{name}: not a {magic.decode()} file")
+        self.pos = len(magic)
+        found = self.int()
+        if found != version:
+            raise ObjectFileError(f"{name}: version {found}, expected {version}")
+
+    def _need(self, n_bytes: int):
+        if n_bytes < 0 or self.pos + n_bytes > len(self.data):
+            raise ObjectFileError(f"{self.name}: truncated at byte {self.pos}")
+
+    def int(self) -> int:
+        self._need(WORD.size)
+        value, = WORD.unpack_from(self.data, self.pos)
+        self.pos += WORD.size
+        return value
+
+    def string(self) -> str:
+        length = self.int()
+        self._need(length + 1)
+        s = bytes(self.data[self.pos:self.pos + length]).decode("utf-8")
+        self.pos += length + 4 - length % 4
+        return s
+
+    def strings(self) -> List[str]:
+        return [self.string() for _ in range(self.int())]
+
+    def constants(self) -> List[dict]:
+        return [{"kind": self.string(), "value": self.string()}
+                for _ in range(self.int())]
+
+    def _words(self) -> List[int]:
+        n = self.int()
+        self._need(n * WORD.size)
+        words = array.array("i")
+        words.frombytes(self.data[self.pos:self.pos + n * WORD.size])
+        if sys.byteorder == "big":
+            words.byteswap()
+        self.pos += n * WORD.size
+        return words.tolist()
+
+    def methods(self) -> List[dict]:
+        code = []
+        for _ in range(self.int()):
+            method_name = self.string()
+            slot = self.int()
+            code.append({"name": method_name, "slot": slot, "code": self._words()})
+        return code
+
+    def end(self):
+        if self.pos != len(self.data):
+            raise ObjectFileError(f"{self.name}: {len(self.data) - self.pos} "
+                                  "bytes after the end")
+
+
+def decode(data: bytes, name: str = "object module") -> dict:
+    """Object code as the .json module has it (keys in the same
+    order as assemble.py writes them)
+    """
+    d = Decoder(data, name, MAGIC, VERSION)
+    module = {"class_name": d.string(), "super": d.string()}
+    counts = (d.int(), d.int(), d.int())
+    module["imports"] = d.strings()
+    module["methods"] = d.strings()
+    module["fields"] = d.strings()
+    module["n_fields"], module["n_methods"], module["n_inherited"] = counts
+    module["constants"] = d.constants()
+    module["code"] = d.methods()
+    d.end()
+    return module
+
+
+def convert(source: Path, target: Path, compact: bool = False):
+    """Rewrite source (.json or .tvo) in the form target's suffix asks for"""
+    if source.suffix == SUFFIX:
+        module = decode(source.read_bytes(), str(source))
+    else:
+        module = json.loads(source.read_text())
+    if target.suffix == SUFFIX:
+        target.write_bytes(encode(module))
+    else:
+        # As assemble.py would write it (assemble.json_format)
+        options = {"separators": (",", ":")} if compact else {"indent": 4}
+        target.write_text(json.dumps(module, **options) + "\n")
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(
+        description="Convert tiny virtual machine object modules "
+                    f"between {JSON_SUFFIX} and binary {SUFFIX} form")
+    parser.add_argument("source", type=Path,
+                        help=f"Object module, {JSON_SUFFIX} or {SUFFIX}")
+    parser.add_argument("target", type=Path,
+                        help=f"Where to write it; a {SUFFIX} suffix for "
+                             "binary, anything else for JSON")
+    parser.add_argument("--compact", action="store_true",
+                        help="Write JSON without indentation")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    try:
+        convert(args.source, args.target, args.compact)
+    except (ObjectFileError, KeyError, ValueError) as e:
+        log.error("Cannot convert %s: %s", args.source, e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
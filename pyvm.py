@@ -0,0 +1,488 @@
+"""A reference interpreter for the tiny virtual machine, in Python.
+
+Runs the object modules assemble.py writes (.json, or .tvo) with
+the semantics of the C VM (vm_ops.c, builtins.c), so that Python
+tools and tests can run compiled code in process, without a
+subprocess or a build of tiny_vm.  As in the C VM:
+
+  - The frame stack holds everything.  A call leaves the receiver
+    at fp (this), the saved program counter at fp+1 and the saved
+    fp at fp+2; locals (alloc) follow, and arguments are below fp.
+    return n replaces the receiver and n arguments by the result.
+  - Classes are loaded by name from the object directory as code
+    refers to them, superclass first; a subclass's vtable starts
+    with its superclass's methods.
+  - Constants live in one pool for the program, looked up by their
+    text, so the literal 7 and the string "7" are the same constant
+    (whichever is loaded first), as they are in the C VM.
+  - Int arithmetic is 32-bit, and division truncates toward zero.
+  - int_plus and the other int_ operations are calls of the Int
+    methods they are named for, done without the call when the
+    receiver and argument are both Int.
+
+Code is decoded once, as it is loaded, into one list of
+(operation, operand) pairs for the whole program, like the C VM's
+code block: a constant operand is the object itself, a class
+operand the class, and a jump operand the index it goes to.  A
+superinstruction becomes its parts.  Built-in methods are in the
+same list, as builtins.c writes them.  Errors the C VM would
+assert on raise VMError.
+
+    python3 pyvm.py Main [-L OBJ] [-c]
+
+As for assemble.py, run from the directory with asm.conf and
+opdefs.txt.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, TextIO, Tuple
+
+import assemble
+import link
+import objfile
+import tracing
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+trace = tracing.tracer("pyvm")
+
+FRAME_CAPACITY = 1024   # As vm_state.h
+
+# Operations, as the interpreter loop tests them
+(HALT, CONST, CALL, CALL_NATIVE, ENTER, RETURN, NEW, POP, ALLOC, LOAD, STORE,
+ LOAD_FIELD, STORE_FIELD, ROLL, JUMP, JUMP_IF, JUMP_IFNOT, IS_INSTANCE, INT_OP) = range(19)
+OPERATIONS = {"halt": HALT, "const": CONST, "call": CALL, "call_native": CALL_NATIVE,
+              "enter": ENTER, "return": RETURN, "new": NEW, "pop": POP, "alloc": ALLOC,
+              "load": LOAD, "store": STORE, "load_field": LOAD_FIELD,
+              "store_field": STORE_FIELD, "roll": ROLL, "jump": JUMP, "jump_if": JUMP_IF,
+              "jump_ifnot": JUMP_IFNOT, "is_instance": IS_INSTANCE,
+              "int_equals": INT_OP, "int_less": INT_OP, "int_plus": INT_OP,
+              "int_minus": INT_OP, "int_multiply": INT_OP, "int_divide": INT_OP}
+JUMPS = {JUMP, JUMP_IF, JUMP_IFNOT}
+
+# Named constants in object code (vm_loader.h)
+CODE_NOTHING, CODE_FALSE, CODE_TRUE = -1, -2, -3
+
+
+class VMError(Exception):
+    """Code the VM can't run: a missing class, a bad operand, or
+    what the C VM would stop on an assertion for
+    """
+    pass
+
+
+class VMClass:
+    __slots__ = ("name", "super", "n_fields", "vtable")
+
+    def __init__(self, name: str, super_class: Optional["VMClass"], n_fields: int,
+                 vtable: List[int]):
+        self.name = name
+        self.super = super_class
+        self.n_fields = n_fields
+        self.vtable = vtable   # Method slot -> index in the code
+
+
+class Instance:
+    """An object: Int and String objects hold their value"""
+    __slots__ = ("clazz", "fields", "value")
+
+    def __init__(self, clazz: VMClass, value=None):
+        self.clazz = clazz
+        self.fields = [NOTHING] * clazz.n_fields if clazz.n_fields else None
+        self.value = value
+
+
+def _wrap(n: int) -> int:
+    """n as a 32-bit C int"""
+    return (n + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+
+# ----------------
+# Built-in classes and their native methods.  A native method
+# gets the VM and the frame pointer (this is at fp, the first
+# argument at fp - 1) and returns the object to push.
+#
+OBJ = VMClass("Obj", None, 0, [])
+STRING = VMClass("String", OBJ, 0, [])
+BOOLEAN = VMClass("Boolean", OBJ, 0, [])
+NOTHING_CLASS = VMClass("Nothing", OBJ, 0, [])
+INT = VMClass("Int", OBJ, 0, [])
+NOTHING = Instance(NOTHING_CLASS)
+FALSE = Instance(BOOLEAN, 0)
+TRUE = Instance(BOOLEAN, -1)
+BUILTINS = [OBJ, STRING, BOOLEAN, INT, NOTHING_CLASS]
+
+
+def _this(vm: "VM", fp: int, clazz: VMClass) -> Instance:
+    this = vm.stack[fp]
+    if not vm.is_instance(this, clazz):
+        raise VMError(f"Expected {clazz.name}, found {this.clazz.name}")
+    return this
+
+
+def _ints(vm: "VM", fp: int) -> Tuple[int, int]:
+    return _this(vm, fp, INT).value, _this(vm, fp - 1, INT).value
+
+
+def _divide(a: int, b: int) -> int:
+    """a / b as C divides ints, truncating toward zero"""
+    quotient = abs(a) // abs(b)
+    return _wrap(quotient if (a < 0) == (b < 0) else -quotient)
+
+
+def _int_divide(vm: "VM", fp: int) -> Instance:
+    a, b = _ints(vm, fp)
+    if b == 0:
+        raise VMError("Int division by zero")
+    return Instance(INT, _divide(a, b))
+
+
+def _string_constructor(vm: "VM", fp: int) -> Instance:
+    this = _this(vm, fp, STRING)
+    this.value = ""
+    return this
+
+
+def _int_constructor(vm: "VM", fp: int) -> Instance:
+    this = _this(vm, fp, INT)
+    this.value = 0
+    return this
+
+
+def _string_print(vm: "VM", fp: int) -> Instance:
+    vm.out.write(_this(vm, fp, STRING).value)
+    return NOTHING
+
+
+NATIVE: Dict[str, Callable[["VM", int], Instance]] = {
+    "Obj.string": lambda vm, fp: Instance(STRING, f"<Object at 0x{id(vm.stack[fp]):x}>"),
+    "Obj.equals": lambda vm, fp: TRUE if vm.stack[fp] is vm.stack[fp - 1] else FALSE,
+    "String.constructor": _string_constructor,
+    "String.print": _string_print,
+    "String.equals": lambda vm, fp: (
+        TRUE if _this(vm, fp, STRING).value == _this(vm, fp - 1, STRING).value else FALSE),
+    "Boolean.constructor": lambda vm, fp: FALSE,
+    "Boolean.string": lambda vm, fp: vm.constant(
+        "s", "true" if vm.stack[fp] is TRUE else "false" if vm.stack[fp] is FALSE
+        else "!!!BOGUS BOOLEAN"),
+    "Nothing.constructor": lambda vm, fp: NOTHING,
+    "Nothing.string": lambda vm, fp: vm.constant("s", "nothing"),
+    "Int.constructor": _int_constructor,
+    "Int.string": lambda vm, fp: Instance(STRING, str(_this(vm, fp, INT).value)),
+    "Int.equals": lambda vm, fp: TRUE if _ints(vm, fp)[0] == _ints(vm, fp)[1] else FALSE,
+    "Int.less": lambda vm, fp: TRUE if _ints(vm, fp)[0] < _ints(vm, fp)[1] else FALSE,
+    "Int.plus": lambda vm, fp: Instance(INT, _wrap(sum(_ints(vm, fp)))),
+    "Int.minus": lambda vm, fp: Instance(INT, _wrap(_ints(vm, fp)[0] - _ints(vm, fp)[1])),
+    "Int.multiply": lambda vm, fp: Instance(INT, _wrap(_ints(vm, fp)[0] * _ints(vm, fp)[1])),
+    "Int.divide": _int_divide,
+}
+
+
+def _native(name: str, arity: int) -> list:
+    return [(ENTER, None), (CALL_NATIVE, NATIVE[name]), (RETURN, arity)]
+
+
+def _binary(name: str) -> list:
+    """Natives that compare or combine this with the argument"""
+    return [(ENTER, None), (LOAD, 0), (LOAD, -1), (CALL_NATIVE, NATIVE[name]), (RETURN, 1)]
+
+
+# Method code of each built-in class, by vtable slot (builtins.c)
+OBJ_PRINT = [(ENTER, None), (LOAD, 0), (CALL, 1), (CALL, 2), (RETURN, 0)]
+OBJ_METHODS = [[(ENTER, None), (RETURN, 0)], _native("Obj.string", 0), OBJ_PRINT,
+               _binary("Obj.equals")]
+BUILTIN_METHODS: Dict[str, List[list]] = {
+    "Obj": OBJ_METHODS,
+    "String": [_native("String.constructor", 0), [(ENTER, None), (LOAD, 0), (RETURN, 0)],
+               _native("String.print", 0), _binary("String.equals")],
+    "Boolean": [_native("Boolean.constructor", 0), _native("Boolean.string", 0),
+                OBJ_PRINT, OBJ_METHODS[3]],
+    "Nothing": [_native("Nothing.constructor", 0), _native("Nothing.string", 0),
+                OBJ_PRINT, OBJ_METHODS[3]],
+    "Int": [_native("Int.constructor", 0), _native("Int.string", 0), OBJ_PRINT,
+            _native("Int.equals", 1), _native("Int.less", 1), _native("Int.plus", 1),
+            _native("Int.minus", 1), _native("Int.multiply", 1), _native("Int.divide", 1)],
+}
+
+
+def _builtin_code() -> List[tuple]:
+    """The code every VM starts with: room for the main sequence,
+    at 0 (see VM.run), then the built-in methods.  Fills in the
+    built-in classes' vtables, once; the code is at the same
+    indices in every VM.
+    """
+    code = [(HALT, None)] * 4
+    for clazz in BUILTINS:
+        shared: Dict[int, int] = {}   # Methods several slots have
+        for method in BUILTIN_METHODS[clazz.name]:
+            if id(method) not in shared:
+                shared[id(method)] = len(code)
+                code.extend(method)
+            clazz.vtable.append(shared[id(method)])
+    return code
+
+
+BUILTIN_CODE = _builtin_code()
+
+
+# The int_ operations (vm_ops.c): the slot of the Int method each
+# calls, and what it makes of the receiver's and argument's values
+# when both are Int (None: make the call after all)
+INT_OPERATIONS: Dict[str, Tuple[int, Callable[[int, int], Optional[Instance]]]] = {
+    "int_equals": (3, lambda a, b: TRUE if a == b else FALSE),
+    "int_less": (4, lambda a, b: TRUE if a < b else FALSE),
+    "int_plus": (5, lambda a, b: Instance(INT, _wrap(a + b))),
+    "int_minus": (6, lambda a, b: Instance(INT, _wrap(a - b))),
+    "int_multiply": (7, lambda a, b: Instance(INT, _wrap(a * b))),
+    "int_divide": (8, lambda a, b: Instance(INT, _divide(a, b)) if b else None),
+}
+
+
+class VM:
+    """Loads classes, and runs a main class's constructor"""
+    def __init__(self, lib: Path, out: TextIO = sys.stdout):
+        self.lib = lib
+        self.out = out
+        self.code: List[tuple] = list(BUILTIN_CODE)
+        self.classes: Dict[str, VMClass] = {clazz.name: clazz for clazz in BUILTINS}
+        self.pool: Dict[str, Instance] = {}   # As the C VM: by the constant's text
+        self.stack: List[Optional[Instance]] = [None] * FRAME_CAPACITY
+        self.instructions = 0   # Executed, by the last run
+        # By byte code: the operations each does (a superinstruction's parts)
+        self.parts = [[OPERATIONS[part.name] for part in instr.parts or [instr]]
+                      for instr in assemble.INSTRS.codes]
+        self.int_operands = {instr.code: INT_OPERATIONS[instr.name]
+                             for instr in assemble.INSTRS.codes if instr.name in INT_OPERATIONS}
+        self.constant("s", "No main program loaded!\n")
+
+    def constant(self, kind: str, literal: str) -> Instance:
+        """The constant object for a literal (int_literal_const,
+        str_literal_const)
+        """
+        if literal not in self.pool:
+            if kind == "i":
+                self.pool[literal] = Instance(INT, _wrap(int(literal)))
+            elif kind == "s":
+                self.pool[literal] = Instance(STRING, literal)
+            else:
+                raise VMError(f"Constant {literal!r} of unknown kind {kind!r}")
+        return self.pool[literal]
+
+    @staticmethod
+    def is_instance(thing: Instance, clazz: VMClass) -> bool:
+        thing_class = thing.clazz
+        while True:
+            if thing_class is clazz:
+                return True
+            if thing_class is OBJ:
+                return False
+            thing_class = thing_class.super
+
+    def load(self, name: str) -> VMClass:
+        """The class, loading it (and what it needs) if we haven't"""
+        if name in self.classes:
+            return self.classes[name]
+        try:
+            module = link.read_module(self.lib, name)
+        except (link.LinkError, objfile.ObjectFileError) as e:
+            raise VMError(str(e)) from None
+        if link.is_builtin(module):
+            raise VMError(f"Class {name} has no code in {self.lib}")
+        trace("Loading %s extends %s", name, module["super"])
+        # In the C loader's order: constants, the class, imports, code
+        constants = [self.constant(c["kind"], c["value"]) for c in module["constants"]]
+        super_class = self.load(module["super"])
+        vtable = super_class.vtable[:module["n_inherited"]]
+        vtable.extend([-1] * (module["n_methods"] - len(vtable)))
+        clazz = VMClass(name, super_class, module["n_fields"], vtable)
+        self.classes[name] = clazz
+        imports = [self.load(imported) for imported in module["imports"]]
+        for method in module["code"]:
+            clazz.vtable[method["slot"]] = len(self.code)
+            self.code.extend(self.decode(method["code"], constants, imports,
+                                         f"{name}.{method['name']}"))
+        return clazz
+
+    def decode(self, words: List[int], constants: List[Instance],
+               imports: List[VMClass], where: str) -> List[tuple]:
+        """Method code, as (operation, operand) pairs"""
+        base = len(self.code)
+        decoded = []
+        starts = {}        # Word address -> index of the instruction there
+        jumps = []         # (index in decoded, word address it goes to)
+        addr = 0
+        try:
+            while addr < len(words):
+                starts[addr] = base + len(decoded)
+                for op in self.parts[words[addr]]:
+                    operand = None
+                    if op in (ENTER, POP, HALT):
+                        decoded.append((op, None))
+                        continue
+                    if op == INT_OP:
+                        decoded.append((op, self.int_operands[words[addr]]))
+                        continue
+                    addr += 1
+                    operand = words[addr]
+                    if op == CONST:
+                        operand = (NOTHING, FALSE, TRUE)[-1 - operand] if operand < 0 \
+                            else constants[operand]
+                    elif op in (NEW, IS_INSTANCE):
+                        operand = imports[operand]
+                    elif op in JUMPS:
+                        jumps.append((len(decoded), addr + 1 + operand))
+                    decoded.append((op, operand))
+                addr += 1
+        except IndexError:
+            raise VMError(f"{where}: bad instruction or operand at word {addr}") from None
+        starts[addr] = base + len(decoded)
+        for i, target in jumps:
+            if target not in starts:
+                raise VMError(f"{where}: jump to word {target}, not an instruction")
+            decoded[i] = (decoded[i][0], starts[target])
+        return decoded
+
+    def run(self, main_class: str) -> int:
+        """Construct an instance of main_class, as tiny_vm does;
+        returns the number of instructions executed
+        """
+        clazz = self.load(main_class)
+        self.code[0:4] = [(NEW, clazz), (CALL, 0), (POP, None), (HALT, None)]
+        return self.execute(0)
+
+    def execute(self, pc: int) -> int:
+        """Run from pc to halt"""
+        code = self.code
+        stack = self.stack
+        sp = fp = 0
+        count = 0
+        op = arg = None
+        try:
+            while True:
+                op, arg = code[pc]
+                pc += 1
+                count += 1
+                if op == LOAD:
+                    sp += 1
+                    stack[sp] = stack[fp + arg]
+                elif op == CONST:
+                    sp += 1
+                    stack[sp] = arg
+                elif op == CALL:
+                    # Receiver at the top is this, at the new fp
+                    stack[sp + 1] = pc
+                    stack[sp + 2] = fp
+                    fp = sp
+                    sp += 2
+                    pc = stack[fp].clazz.vtable[arg]
+                    if pc < 0:
+                        raise VMError(f"{stack[fp].clazz.name} has no method in slot {arg}")
+                elif op == RETURN:
+                    value = stack[sp]
+                    pc = stack[fp + 1]
+                    sp = fp - arg
+                    fp = stack[fp + 2]
+                    stack[sp] = value
+                elif op == POP:
+                    sp -= 1
+                elif op == ENTER:
+                    pass
+                elif op == STORE:
+                    stack[fp + arg] = stack[sp]
+                    sp -= 1
+                elif op == JUMP_IF or op == JUMP_IFNOT:
+                    cond = stack[sp]
+                    sp -= 1
+                    if cond.clazz is not BOOLEAN:
+                        raise VMError(f"Expected Boolean, found {cond.clazz.name}")
+                    if (cond is TRUE) == (op == JUMP_IF):
+                        pc = arg
+                elif op == JUMP:
+                    pc = arg
+                elif op == ALLOC:
+                    for _ in range(arg):
+                        sp += 1
+                        stack[sp] = NOTHING
+                elif op == LOAD_FIELD:
+                    stack[sp] = stack[sp].fields[arg]
+                elif op == STORE_FIELD:
+                    target = stack[sp]
+                    if target.clazz.n_fields <= arg:
+                        raise VMError(f"{target.clazz.name} has no field {arg}")
+                    target.fields[arg] = stack[sp - 1]
+                    sp -= 2
+                elif op == CALL_NATIVE:
+                    result = arg(self, fp)
+                    sp += 1
+                    stack[sp] = result
+                elif op == NEW:
+                    sp += 1
+                    stack[sp] = Instance(arg)
+                elif op == ROLL:
+                    ob = stack[sp - arg]
+                    stack[sp - arg:sp] = stack[sp - arg + 1:sp + 1]
+                    stack[sp] = ob
+                elif op == IS_INSTANCE:
+                    stack[sp] = TRUE if self.is_instance(stack[sp], arg) else FALSE
+                elif op == INT_OP:
+                    this, other = stack[sp], stack[sp - 1]
+                    slot, combine = arg
+                    result = combine(this.value, other.value) \
+                        if this.clazz is INT and other.clazz is INT else None
+                    if result is not None:
+                        sp -= 1
+                        stack[sp] = result
+                    else:
+                        # As CALL
+                        stack[sp + 1] = pc
+                        stack[sp + 2] = fp
+                        fp = sp
+                        sp += 2
+                        pc = stack[fp].clazz.vtable[slot]
+                        if pc < 0:
+                            raise VMError(f"{stack[fp].clazz.name} has no method in slot {slot}")
+                elif op == HALT:
+                    return count
+        except IndexError:
+            if sp >= FRAME_CAPACITY - 2:
+                raise VMError("Frame stack overflow") from None
+            raise VMError(f"Bad operand {arg!r} at {pc - 1}") from None
+        finally:
+            self.instructions = count
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(
+        description="Run a tiny virtual machine program in Python")
+    parser.add_argument("main_class", help="Class whose constructor is the program")
+    parser.add_argument("-L", "--lib", type=Path, default=None,
+                        help=f"Directory of object modules (default: TVMLIB, "
+                             f"{assemble.CONFIG.tvmlib})")
+    parser.add_argument("-c", "--count", action="store_true",
+                        help="Report instructions executed on stderr "
+                             "(a superinstruction counts as its parts)")
+    tracing.add_trace_option(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    tracing.enable(args.trace)
+    vm = VM(args.lib or assemble.CONFIG.tvmlib)
+    try:
+        vm.run(args.main_class)
+    except VMError as e:
+        sys.stdout.flush()
+        log.error("%s: %s", args.main_class, e)
+        sys.exit(1)
+    finally:
+        sys.stdout.flush()
+        if args.count:
+            print(f"instructions {vm.instructions}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
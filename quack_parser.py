@@ -0,0 +1,156 @@
+"""Construct the LALR parser for Quack without paying for
+table construction on every run.
+
+Building the Lark LALR tables from grammar.lark costs more than
+parsing a typical Quack source file, and the compiler runs once
+per source file.  We avoid that cost in one of two ways:
+
+(a) A persistent cache.  Lark can serialize the analyzed grammar;
+    we keep that serialization in a file whose name is derived from
+    a hash of grammar.lark and the Lark version, so a change to
+    either one simply misses the cache.  Lark keeps one parser per
+    file, so parsers built differently (building a tree, or running
+    a transformer inline) each get a file of their own.
+(b) A pre-generated standalone parser module (quack_standalone.py),
+    produced by  'python3 quack_parser.py --standalone'.  If it is
+    present and was generated from the current grammar, it is used
+    in preference to the cache.
+"""
+
+import argparse
+import hashlib
+import importlib
+import os
+import sys
+from pathlib import Path
+from typing import Optional
+
+import lark
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+
+GRAMMAR = Path(__file__).with_name("grammar.lark")
+
+# Cache files go next to Python's own byte code cache unless
+# QUACK_PARSER_CACHE names some other directory (e.g., one shared
+# by the machines of a build farm).
+CACHE_DIR = Path(os.environ.get("QUACK_PARSER_CACHE",
+                                Path(__file__).with_name("__pycache__")))
+
+STANDALONE_MODULE = "quack_standalone"
+
+# Options that Lark leaves out of the hash it stores in a cache file
+# (it supplies them when loading); the rest change the stored hash.
+UNHASHED_OPTIONS = {"transformer", "postlex", "lexer_callbacks",
+                    "edit_terminals", "_plugins"}
+
+
+def grammar_key(grammar: Path = GRAMMAR) -> str:
+    """Hash of the grammar text and the Lark version.  Either
+    one changing invalidates cached and standalone parsers.
+    """
+    digest = hashlib.sha256()
+    digest.update(grammar.read_bytes())
+    digest.update(lark.__version__.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def cache_path(grammar: Path = GRAMMAR, cache_dir: Path = CACHE_DIR,
+               **options) -> Path:
+    """The cache file for a parser built with these Lark options.
+    Lark rebuilds, and overwrites the file, when the options it
+    hashes or the Python version differ from those stored there.
+    """
+    mode = "tree" if options.get("transformer") is None else "inline"
+    digest = hashlib.sha256(grammar_key(grammar).encode("utf-8"))
+    for name, value in sorted(options.items()):
+        if name not in UNHASHED_OPTIONS:
+            digest.update(f"{name}={value!r};".encode("utf-8"))
+    digest.update(str(sys.version_info[:2]).encode("utf-8"))
+    return cache_dir.joinpath(
+        f"{grammar.stem}-lalr-{mode}-{digest.hexdigest()[:16]}.cache")
+
+
+def load_standalone(grammar: Path = GRAMMAR, **options) -> Optional[object]:
+    """The pre-generated parser, or None if there is no
+    standalone module or it was generated from another grammar.
+    """
+    try:
+        module = importlib.import_module(STANDALONE_MODULE)
+    except ImportError:
+        return None
+    if getattr(module, "GRAMMAR_KEY", None) != grammar_key(grammar):
+        log.warning(f"{STANDALONE_MODULE} is stale; regenerate with "
+                    f"'python3 {Path(__file__).name} --standalone'")
+        return None
+    # Produce ordinary lark.Tree nodes so that lark.Transformer
+    # subclasses (grammar_reshape) can walk the result.
+    return module.Lark_StandAlone(tree_class=lark.Tree, **options)
+
+
+def build_parser(grammar: Path = GRAMMAR,
+                 cache_dir: Optional[Path] = CACHE_DIR,
+                 standalone: bool = True,
+                 **options) -> object:
+    """A Lark LALR parser for Quack.  Uses the standalone module
+    if allowed and available, otherwise the persistent cache
+    in cache_dir (None disables the cache).  Extra options are
+    passed through to Lark.
+    """
+    if standalone:
+        parser = load_standalone(grammar, **options)
+        if parser is not None:
+            return parser
+    if cache_dir is None:
+        return lark.Lark(grammar.read_text(), parser="lalr", **options)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        cache = str(cache_path(grammar, cache_dir, **options))
+    except OSError as e:
+        log.warning(f"Parser cache unavailable ({e}); building tables")
+        cache = False
+    return lark.Lark(grammar.read_text(), parser="lalr", cache=cache, **options)
+
+
+def write_standalone(grammar: Path = GRAMMAR,
+                     target: Optional[Path] = None) -> Path:
+    """Generate quack_standalone.py from the grammar.  The module
+    records the grammar key it was generated from.
+    """
+    from lark.tools.standalone import gen_standalone
+    if target is None:
+        target = Path(__file__).with_name(STANDALONE_MODULE + ".py")
+    parser = lark.Lark(grammar.read_text(), parser="lalr")
+    with open(target, "w") as out:
+        gen_standalone(parser, out=out)
+        print(f"\nGRAMMAR_KEY = {grammar_key(grammar)!r}", file=out)
+    return target
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(
+        description="Prepare the Quack parser ahead of time")
+    parser.add_argument("--grammar", type=Path, default=GRAMMAR)
+    parser.add_argument("--standalone", action="store_true",
+                        help=f"Generate {STANDALONE_MODULE}.py")
+    parser.add_argument("--clear", action="store_true",
+                        help="Remove cached parse tables")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    if args.clear:
+        for stale in CACHE_DIR.glob(f"{args.grammar.stem}-lalr-*.cache"):
+            stale.unlink()
+    if args.standalone:
+        print(f"Wrote {write_standalone(args.grammar)}")
+    else:
+        build_parser(args.grammar, standalone=False)
+        print(f"Cached {cache_path(args.grammar)}")
+
+
+if __name__ == "__main__":
+    main()
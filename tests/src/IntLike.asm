@@ -0,0 +1,19 @@
+# Has less and plus in the slots where Int has them, so that
+# int_less and int_plus on an IntLike call these
+.class IntLike:Obj
+.method $constructor
+    enter
+    load $
+    return 0
+
+.method less
+.args other
+    enter
+    const "IntLike less\n"
+    return 1
+
+.method plus
+.args other
+    enter
+    const "IntLike plus\n"
+    return 1
@@ -0,0 +1,76 @@
+# The int_ operations: Int:plus and the rest done without a call
+# when receiver and argument are both Int, and the call otherwise
+# (here, to String:equals and to IntLike's own less and plus)
+.class IntOps:Obj
+.method $constructor
+    enter
+    const 5
+    const 7
+    int_plus
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const 5
+    const 7
+    int_minus
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const 4
+    const -3
+    int_multiply
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const 2
+    const -7
+    int_divide
+    call Int:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const 3
+    const 2
+    int_less
+    call Obj:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const 4
+    const 4
+    int_equals
+    call Obj:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const "same"
+    const "same"
+    int_equals
+    call Obj:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const 1
+    new IntLike
+    call IntLike:$constructor
+    int_plus
+    call String:print
+    pop
+    const 1
+    new IntLike
+    call IntLike:$constructor
+    int_less
+    call String:print
+    pop
+    load $
+    return 0
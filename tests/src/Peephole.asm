@@ -0,0 +1,38 @@
+# Redundant sequences for the peephole optimizer in assemble.py.
+# Prints 012 and a newline, optimized or not (--no-peephole).
+.class Peephole:Obj
+.method $constructor
+.local n,t
+    enter
+    const 0
+    store n
+    const "unused"      # push_pop
+    pop
+    jump top            # jump_to_next
+top:
+    const 3
+    load n
+    call Int:less
+    jump_if body        # branch_over_jump
+    jump out
+body:
+    load n
+    call Int:print
+    pop
+    const 1
+    load n
+    call Int:plus
+    store t             # store_load: t is loaded nowhere else
+    load t
+    store n
+    jump hop            # jump_to_jump
+out:
+    const "\n"
+    call String:print
+    pop
+    load $
+    return 0
+    const nothing       # unreachable
+    return 0
+hop:
+    jump top
@@ -0,0 +1,40 @@
+# Ints made separately, equal in value, are equal even through
+# Obj:equals: it dispatches to Int:equals, so whether the VM
+# shares small Ints (new_int) can't be seen
+.class SharedInt:Obj
+.method $constructor
+    enter
+    const 3
+    const 4
+    int_plus
+    const 2
+    const 5
+    call Int:plus
+    call Obj:equals
+    call Obj:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const 5000
+    const 4999
+    const 1
+    int_plus
+    call Obj:equals
+    call Obj:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    const 8
+    const 3
+    const 4
+    int_plus
+    call Obj:equals
+    call Obj:print
+    pop
+    const "\n"
+    call String:print
+    pop
+    load $
+    return 0
@@ -0,0 +1,223 @@
+"""The assembler: symbol resolution, line forms and errors,
+streamed output, and Assembler as a library.
+
+    python3 -m pytest tests/test_assemble.py
+"""
+
+import io
+import json
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+
+# The repository's, whatever the working directory
+INSTRS = assemble.InstructionSet(str(ROOT / "opdefs.txt"))
+
+
+def new_assembler(lib: Path = ROOT / "OBJ") -> assemble.Assembler:
+    return assemble.Assembler(lib, INSTRS)
+
+
+def test_symbol_table_is_the_list():
+    table = assemble.SymbolTable(["a", "b"])
+    table.append("c")
+    table.append("a")
+    assert table == ["a", "b", "c", "a"]
+    assert table.index("a") == 0 and table.index("c") == 2
+    assert "b" in table and "z" not in table
+    assert json.dumps(table) == '["a", "b", "c", "a"]'
+    with pytest.raises(ValueError):
+        table.index("z")
+
+
+def translate(src: str, peephole: bool = True) -> dict:
+    code = new_assembler().translate(src.splitlines(keepends=True), peephole=peephole)
+    return json.loads(code.json())
+
+
+def test_slots_and_offsets():
+    obj = translate("""
+.class Two:Obj
+.field x
+.method m forward
+.method $constructor
+.args a,b
+.local u,v
+    enter
+    load b
+    load v
+    new Int
+    new String
+    new Int
+    call $:m
+    call String:print
+    return 2
+.method m
+    load $
+    load_field $:x
+    return 0
+""")
+    op = {name: instr.code for name, instr in INSTRS.ops.items()}
+    assert obj["methods"] == ["$constructor", "string", "print", "equals", "m"]
+    assert obj["fields"] == ["x"]
+    # Classes are numbered in order of first use, after this one and Obj
+    assert obj["imports"] == ["Two", "Obj", "Int", "String"]
+    constructor, m = (method["code"] for method in obj["code"])
+    assert constructor == [op["alloc"], 2, op["enter"],
+                           op["load"], -1,        # Last argument
+                           op["load"], 4,         # Second local
+                           op["new"], 2, op["new"], 3, op["new"], 2,
+                           op["call"], 4,         # Declared forward
+                           op["call"], 2, op["return"], 2]
+    assert m == [op["load"], 0, op["load_field"], 0, op["return"], 0]
+
+
+def test_line_forms():
+    """Labels alone, with an instruction, and without a space"""
+    obj = translate("""
+.class Loops:Obj
+.method $constructor
+.local n
+    enter   # Comment
+top:
+    const 0
+again: load n
+next:jump top
+    jump_if again
+    return 0
+""", peephole=False)
+    op = {name: instr.code for name, instr in INSTRS.ops.items()}
+    assert obj["code"][0]["code"] == [op["alloc"], 1, op["enter"],
+                                      op["const"], 0, op["load"], 3,
+                                      op["jump"], -6, op["jump_if"], -6,
+                                      op["return"], 0]
+
+
+@pytest.mark.parametrize("line,message", [
+    ("    lode n", "line 5: Unknown operation 'lode'"),
+    ("    load", "line 5: 'load' needs an operand"),
+    ("    pop 3", "line 5: 'pop' takes no operand"),
+    ("    load n m", "line 5: Bad operand 'n m'"),
+    ("    load m", "line 5: Local variable m not declared"),
+    ("    jump nowhere", "line 5: Unresolved label 'nowhere'"),
+    (".feild x", "line 5: NO MATCH on '.feild x'"),
+    ("    call Int:frob", "line 5: Method frob not defined in Int"),
+])
+def test_error_positions(line, message, caplog):
+    src = f".class Bad:Obj\n.method $constructor\n.local n\n    enter\n{line}\n    return 0\n"
+    code = new_assembler().translate(src.splitlines(keepends=True))
+    assert code.errors == 1
+    assert message in caplog.text
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_streaming_same_object(compact, monkeypatch):
+    """Streamed output is json.dumps of the same structure, code first"""
+    monkeypatch.setattr(assemble.ObjectWriter, "CHUNK", 2)   # Several chunks of constants
+    src = (ROOT / "tests" / "src" / "Pair.asm").read_text().splitlines(keepends=True)
+    whole = new_assembler().translate(src)
+    struct = {"code": whole.method_code, **whole.header()}
+    struct["constants"] = list(struct["constants"])
+    out = io.StringIO()
+    writer = assemble.ObjectWriter(out, compact)
+    streamed = new_assembler().translate(src, sink=writer.method)
+    writer.finish(streamed)
+    assert streamed.method_code == []
+    assert out.getvalue() == json.dumps(struct, **assemble.json_format(compact)) + "\n"
+    assert writer.size == len(out.getvalue())
+    assert json.loads(out.getvalue()) == json.loads(whole.json())
+
+
+def peephole(body: str, peephole: bool = True):
+    """Code of one method, and the peephole hits (without
+    superinstructions, which test_superinstructions.py covers)
+    """
+    src = f".class P:Obj\n.method $constructor\n.local n,t\n    enter\n{body}"
+    code = new_assembler().translate(src.splitlines(keepends=True), peephole=peephole,
+                                     fuse=False)
+    assert code.errors == 0
+    op = {name: instr.code for name, instr in INSTRS.ops.items()}
+    return code.method_code[0]["code"][3:], code.peephole_hits, op
+
+
+@pytest.mark.parametrize("pattern,body,after", [
+    ("push_pop", "const 7\npop\nload $\nreturn 0\n", ["load", 0, "return", 0]),
+    ("store_load", "const 7\nstore t\nload t\nreturn 0\n", ["const", 0, "return", 0]),
+    ("jump_to_next", "jump x\nx: load $\nreturn 0\n", ["load", 0, "return", 0]),
+    ("unreachable", "load $\nreturn 0\nconst nothing\nreturn 0\n", ["load", 0, "return", 0]),
+    ("branch_over_jump",
+     "load n\njump_if a\njump b\na: const 1\nreturn 0\nb: load $\nreturn 0\n",
+     ["load", 3, "jump_ifnot", 4, "const", 0, "return", 0, "load", 0, "return", 0]),
+    ("jump_to_jump",
+     "load n\njump_if a\nload $\nreturn 0\na: jump b\nb: jump c\nc: load n\nreturn 0\n",
+     ["load", 3, "jump_if", 4, "load", 0, "return", 0, "load", 3, "return", 0]),
+])
+def test_peephole_patterns(pattern, body, after):
+    code, hits, op = peephole(body)
+    assert [op[w] if isinstance(w, str) else w for w in after] == code
+    assert hits[pattern] >= 1
+    unoptimized, hits, _ = peephole(body, peephole=False)
+    assert not hits and len(unoptimized) > len(code)
+
+
+def test_peephole_keeps_what_matters():
+    """A stored local loaded elsewhere, and a pair with a jump
+    into its middle, stay
+    """
+    body = "const 1\nstore n\nload n\nmid: pop\nload n\njump_if mid\nload $\nreturn 0\n"
+    code, hits, _ = peephole(body)
+    assert hits["store_load"] == hits["push_pop"] == 0
+    assert code == peephole(body, peephole=False)[0]
+
+
+def test_peephole_unresolved_label(caplog):
+    src = ".class P:Obj\n.method $constructor\n    enter\n    const 1\n    pop\n    jump nowhere\n"
+    code = new_assembler().translate(src.splitlines(keepends=True))
+    assert code.errors == 1
+    assert "line 6: Unresolved label 'nowhere'" in caplog.text
+
+
+def test_assemblers_are_independent(tmp_path):
+    """Two assemblers, with different libraries, interleaved:
+    each resolves imports in its own
+    """
+    libs = []
+    for n_fields in (1, 2):
+        lib = tmp_path / f"OBJ{n_fields}"
+        lib.mkdir()
+        for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+            shutil.copy(builtin, lib)
+        fields = "".join(f".field f{i}\n" for i in range(n_fields))
+        lib.joinpath("Base.asm").write_text(
+            f".class Base:Obj\n{fields}.method $constructor\n    enter\n    load $\n    return 0\n")
+        libs.append(lib)
+    assemblers = [new_assembler(lib) for lib in libs]
+    for assembler, lib in zip(assemblers, libs):
+        assert assembler.assemble_file(lib / "Base.asm").errors == 0
+    src = ".class Sub:Base\n.field g\n.method $constructor\n    enter\n    load $\n" \
+          "    load $\n    store_field $:g\n    load $\n    return 0\n"
+    codes = [assembler.translate(src.splitlines()) for assembler in assemblers]
+    assert [code.field_list for code in codes] == [["f0", "g"], ["f0", "f1", "g"]]
+    assert codes[0].method_code[0]["code"] != codes[1].method_code[0]["code"]
+    # Rewriting Base drops the cached interface, so Sub sees the new one
+    libs[0].joinpath("Base.asm").write_text(libs[1].joinpath("Base.asm").read_text())
+    assemblers[0].assemble_file(libs[0] / "Base.asm")
+    assert assemblers[0].translate(src.splitlines()).field_list == ["f0", "f1", "g"]
+
+
+def test_assembler_instruction_set(tmp_path):
+    """An assembler with its own instruction set leaves translate's alone"""
+    opdefs = tmp_path / "opdefs.txt"
+    opdefs.write_text("".join(f"{instr.name},vm_op_{instr.name},{instr.ops}\n"
+                              for instr in INSTRS.ops.values()) + "nop,vm_op_nop,0\n")
+    assembler = assemble.Assembler(ROOT / "OBJ", assemble.InstructionSet(str(opdefs)))
+    src = ".class P:Obj\n.method $constructor\n    enter\n    nop\n    load $\n    return 0\n"
+    assert assembler.translate(src.splitlines()).errors == 0
+    assert assemble.translate(src.splitlines()).errors == 1
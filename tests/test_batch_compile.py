@@ -0,0 +1,46 @@
+"""batch_compile.py: one .asm file per class, and no class written
+by two sources of a batch.
+
+    python3 -m pytest tests/test_batch_compile.py
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import batch_compile
+
+
+@pytest.fixture
+def sources(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    src.joinpath("A.qk").write_text("class A() { def get(): Int { return 1; } }\n")
+    src.joinpath("main.qk").write_text('"one".print();\n')
+    src.joinpath("other.qk").write_text('"other".print();\n')
+    out = tmp_path / "asm"
+    out.mkdir()
+    return src, out
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_classes_only_writes_no_main(sources, jobs):
+    src, out = sources
+    results = batch_compile.compile_all([src / "A.qk", src / "main.qk"], out, jobs)
+    assert [r.error for r in results] == [None, None]
+    assert [p.name for p in results[0].written] == ["A.asm"]
+    assert [p.name for p in results[1].written] == ["$Main.asm"]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_duplicate_class_fails(sources, jobs):
+    src, out = sources
+    main, other = batch_compile.compile_all([src / "main.qk", src / "other.qk"], out, jobs)
+    assert main.error is None
+    assert other.error == f"Class $Main is defined by both {src / 'main.qk'} and {src / 'other.qk'}"
+    assert other.written == []
+    assert '"one"' in out.joinpath("$Main.asm").read_text()
@@ -0,0 +1,53 @@
+"""bench/suite.py: statistics, regressions against a baseline,
+and the phases of one program.
+
+    python3 -m pytest tests/test_bench_suite.py
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "bench"))
+
+import suite
+
+
+def stats(median: float) -> dict:
+    return {"median": median, "mean": median, "stdev": 0.0, "min": median}
+
+
+def test_summarize():
+    summary = suite.summarize([0.3, 0.1, 0.2])
+    assert summary["median"] == 0.2 and summary["min"] == 0.1
+    assert suite.summarize([0.5])["stdev"] == 0.0
+
+
+def test_regressions():
+    baseline = {"programs": {"loop": {"compile": stats(0.010), "run": stats(0.100)}}}
+    results = {"programs": {"loop": {"compile": stats(0.0105), "run": stats(0.130),
+                                     "load": stats(0.001)},
+                            "new": {"run": stats(1.0)}}}
+    assert suite.regressions(results, baseline, 0.25, 0.001) == [("loop", "run", 0.100, 0.130)]
+    # Within 1 ms of a small baseline is not a regression, even over the threshold
+    assert suite.regressions(results, baseline, 0.01, 0.001) == [("loop", "run", 0.100, 0.130)]
+    assert suite.regressions(results, baseline, 0.01, 0.0) == [
+        ("loop", "compile", 0.010, 0.0105), ("loop", "run", 0.100, 0.130)]
+
+
+def test_compile_and_assemble(tmp_path):
+    concat = next(program for program in suite.SUITE if program.name == "concat")
+    parser, inline = suite.batch_compile.make_parser(tree=False)
+    phases = suite.measure(concat, parser, inline, suite.VM, 1, tmp_path)
+    assert sorted(phases) == ["assemble", "compile"]
+    assert tmp_path.joinpath("concat", "OBJ", "$Main.json").exists()
+
+
+@pytest.mark.skipif(not suite.VM.exists(), reason="needs bin/tiny_vm built")
+def test_measure_run(tmp_path):
+    spin = next(program for program in suite.SUITE if program.name == "spin")
+    phases = suite.measure(spin, None, None, suite.VM, 2, tmp_path)
+    assert sorted(phases) == ["assemble", "load", "run"]
+    assert 0 < phases["run"]["min"] <= phases["run"]["median"]
@@ -0,0 +1,112 @@
+"""build.py rebuilds a class only when its code, the tools,
+or an interface it imports changed.
+
+    python3 -m pytest tests/test_build.py
+"""
+
+import shutil
+import sys
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import batch_assemble
+import build
+
+SRC = Path(__file__).resolve().parent / "src"
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    lib = tmp_path / "OBJ"
+    lib.mkdir()
+    for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+        shutil.copy(builtin, lib)
+    src = tmp_path / "src"
+    src.mkdir()
+    for name in ["Counter", "TestCounter", "Pair"]:
+        shutil.copy(SRC / f"{name}.asm", src)
+    monkeypatch.setattr(assemble.CONFIG, "tvmlib", lib)
+    return tmp_path
+
+
+def run(project: Path) -> dict:
+    """What was rebuilt, and why"""
+    b = build.Build(project / "OBJ", project / "asm", project / "OBJ" / build.CACHE_NAME)
+    b.run(build.collect_sources([str(project / "src")]))
+    assert b.errors == []
+    return {str(what): why for what, why in b.rebuilt}
+
+
+def test_rebuilds_nothing_unchanged(project):
+    assert set(run(project)) == {"Counter", "TestCounter", "Pair"}
+    assert run(project) == {}
+
+
+def test_body_change_stops_at_class(project):
+    run(project)
+    counter = project / "src" / "Counter.asm"
+    counter.write_text(counter.read_text().replace("const 1", "const 2"))
+    assert run(project) == {"Counter": "code changed (%s)" % counter}
+
+
+def test_interface_change_reaches_importers(project):
+    run(project)
+    counter = project / "src" / "Counter.asm"
+    counter.write_text(counter.read_text().replace(
+        ".method inc", ".method bump forward\n.method inc", 1))
+    assert run(project) == {"Counter": "code changed (%s)" % counter,
+                            "TestCounter": "interface of Counter changed"}
+    # TestCounter was assembled against the new Counter, not a cached one
+    assemble.INTERFACES.clear()
+    fresh = assemble.translate((project / "src" / "TestCounter.asm").read_text().splitlines())
+    assert project.joinpath("OBJ", "TestCounter.json").read_text() == fresh.json() + "\n"
+
+
+def test_missing_object_file(project):
+    run(project)
+    project.joinpath("OBJ", "Pair.json").unlink()
+    assert run(project) == {"Pair": "Pair.json missing"}
+
+
+def build_quack(project: Path, sources: Dict[str, str]) -> build.Build:
+    src = project / "qk"
+    src.mkdir(exist_ok=True)
+    for name, text in sources.items():
+        src.joinpath(name).write_text(text)
+    b = build.Build(project / "OBJ", project / "asm", project / "OBJ" / build.CACHE_NAME)
+    b.asm_dir.mkdir(exist_ok=True)
+    b.run(build.collect_sources([str(src)]))
+    return b
+
+
+def test_several_quack_sources(project):
+    b = build_quack(project, {"A.qk": "class A() { def get(): Int { return 1; } }\n",
+                              "B.qk": "class B() { def get(): Int { return 2; } }\n",
+                              "main.qk": '"hello".print();\n'})
+    assert b.errors == []
+    assert sorted(str(what) for what, _ in b.rebuilt if isinstance(what, str)) == [
+        "$Main", "A", "B"]
+    assert build_quack(project, {}).rebuilt == []
+
+
+def test_two_main_blocks(project):
+    b = build_quack(project, {"main.qk": '"one".print();\n',
+                              "other.qk": '"other".print();\n'})
+    main, other = project / "qk" / "main.qk", project / "qk" / "other.qk"
+    assert b.errors == [f"{other}: Class $Main is defined by both {main} and {other}"]
+    assert '"one"' in project.joinpath("asm", "$Main.asm").read_text()
+
+
+def test_importer_after_imported():
+    refs = {"A": ["B"], "B": ["Obj", "C"], "C": ["Obj", "A"], "D": ["Obj"]}
+    waves = batch_assemble.assembly_waves(refs)
+    level = {name: i for i, wave in enumerate(waves) for name in wave}
+    # A needs B needs C; C's call to A closes a cycle, so C cannot follow A
+    assert level["C"] < level["B"] < level["A"]
+    assert level["D"] == 0
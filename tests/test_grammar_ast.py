@@ -0,0 +1,192 @@
+"""The AST nodes themselves: the iterative walk must visit nodes
+as the recursive walk it replaced did, the node pool must share
+equal leaves only, and nodes must not carry a __dict__.
+
+    python3 -m pytest tests/test_grammar_ast.py
+"""
+
+import logging
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import grammar_ast
+import grammar_reshape
+import quack_parser
+from grammar_ast import ConstNode, MethodCallNode, VariableReferenceNode
+
+
+SAMPLE = """
+class Pt(x: Int, y: Int) {
+    this.x = x;
+    this.y = y;
+    def plus(other: Pt): Pt {
+        return Pt(this.x + other.x, this.y + other.y);
+    }
+    def small(): Boolean {
+        if this.x < 10 { return true; } elif this.y < 10 { return true; }
+        return false;
+    }
+}
+n = 0;
+p = Pt(1, 2);
+while n < 3 {
+    p = p.plus(Pt(n, 0 - 1));
+    n = n + 1;
+}
+p.small().print();
+"""
+
+
+@pytest.fixture(scope="module")
+def tree():
+    transformer = grammar_reshape.QuackTransformer(False, "Test")
+    parser = quack_parser.build_parser(transformer=transformer)
+    return parser.parse(SAMPLE)
+
+
+def recursive(node, order: list):
+    """The walk as it was before it kept its own stack"""
+    order.append(("pre", node))
+    for child in grammar_ast.flatten(node.children):
+        if isinstance(child, grammar_ast.ASTNode):
+            recursive(child, order)
+    order.append(("post", node))
+
+
+def walked(node) -> list:
+    order = []
+    node.walk(order,
+              lambda n, visited: visited.append(("pre", n)),
+              lambda n, visited: visited.append(("post", n)))
+    return order
+
+
+def test_walk_matches_recursive_order(tree):
+    expected = []
+    recursive(tree, expected)
+    order = walked(tree)
+    assert len(order) == len(expected) > 100
+    assert all(step == ref and node is ref_node
+               for (step, node), (ref, ref_node) in zip(order, expected))
+
+
+def test_walk_of_leaf():
+    leaf = ConstNode(7)
+    assert walked(leaf) == [("pre", leaf), ("post", leaf)]
+
+
+def call_tree():
+    """(a + b) + c, with the left operand as the failing subtree"""
+    inner = MethodCallNode("PLUS", VariableReferenceNode("a"),
+                           [VariableReferenceNode("b")])
+    return MethodCallNode("PLUS", inner, [VariableReferenceNode("c")])
+
+
+def failing_on(name: str, order: list):
+    def visit(node, visit_state):
+        order.append(str(node) if isinstance(node, VariableReferenceNode)
+                     else node.name)
+        if getattr(node, "name", None) == name and node.children:
+            raise ValueError(name)
+    return visit
+
+
+def test_failed_pre_visit_skips_subtree(caplog):
+    root = call_tree()
+    root.receiver.name = "FAIL"
+    pre, post = [], []
+    with caplog.at_level(logging.ERROR, logger=grammar_ast.__name__):
+        root.walk(None, failing_on("FAIL", pre),
+                  lambda n, _: post.append(n))
+    # a and b are never reached; the sibling and the root still are
+    assert pre == ["PLUS", "FAIL", "c"]
+    assert post == [root.actuals[0], root]
+    assert "Failed walking to MethodCallNode" in caplog.text
+
+
+def test_failed_post_visit_is_logged(caplog):
+    root = call_tree()
+    root.receiver.name = "FAIL"
+    post = []
+    with caplog.at_level(logging.ERROR, logger=grammar_ast.__name__):
+        root.walk(None, grammar_ast.ignore, failing_on("FAIL", post))
+    assert post == ["a", "b", "FAIL", "c", "PLUS"]
+    assert caplog.text.count("Failed walking to") == 1
+
+
+@pytest.mark.parametrize("in_pre", [True, False])
+def test_failure_at_root_raises(in_pre):
+    root = call_tree()
+    root.name = "FAIL"
+    visit = failing_on("FAIL", [])
+    with pytest.raises(ValueError):
+        if in_pre:
+            root.walk(None, visit, grammar_ast.ignore)
+        else:
+            root.walk(None, grammar_ast.ignore, visit)
+
+
+def test_child_nodes_reset_on_assignment():
+    a, b, c = ConstNode(1), ConstNode(2), ConstNode(3)
+    call = MethodCallNode("PLUS", a, [b])
+    assert call.child_nodes() == [a, b]
+    call.children = [a, [c, None], "not a node"]
+    assert call.child_nodes() == [a, c]
+    assert walked(call)[1:4] == [("pre", a), ("post", a), ("pre", c)]
+
+
+def test_pool_shares_equal_names():
+    pool = grammar_ast.NodePool()
+    first = pool.name("".join(["cou", "nter"]))
+    assert pool.name("".join(["co", "unter"])) is first
+    assert pool.name("counted") is not first
+
+
+@pytest.mark.parametrize("key, other", [
+    ((1,), (2,)),
+    ((1,), ("1",)),
+    ((1,), (True,)),
+    (("x",), ("y",)),
+    ((None,), (0,)),
+])
+def test_pool_shares_equal_leaves(key, other):
+    pool = grammar_ast.NodePool()
+    leaf = pool.leaf(ConstNode, *key)
+    assert pool.leaf(ConstNode, *key) is leaf
+    assert pool.leaf(ConstNode, *other) is not leaf
+    assert pool.leaf(ConstNode, *other) is pool.leaf(ConstNode, *other)
+    assert pool.hits == 3
+
+
+def test_pool_keys_on_class():
+    pool = grammar_ast.NodePool()
+    assert (pool.leaf(VariableReferenceNode, "x")
+            is not pool.leaf(ConstNode, "x"))
+
+
+def test_pooled_parse_shares_leaves():
+    pool = grammar_ast.NodePool()
+    transformer = grammar_reshape.QuackTransformer(False, "Test", pool)
+    parser = quack_parser.build_parser(transformer=transformer)
+    tree = parser.parse(SAMPLE)
+    tens = []
+    tree.walk(tens, lambda n, found: found.append(n)
+              if isinstance(n, ConstNode) and n.value == 10 else None,
+              grammar_ast.ignore)
+    assert len(tens) == 2 and tens[0] is tens[1]
+
+
+def test_nodes_have_no_dict(tree):
+    nodes = []
+    tree.walk(nodes, lambda n, found: found.append(n), grammar_ast.ignore)
+    classes = {type(node) for node in nodes}
+    assert len(classes) > 10
+    for node in nodes:
+        assert not hasattr(node, "__dict__"), type(node).__name__
+    with pytest.raises(AttributeError):
+        ConstNode(1).misspelled = 2
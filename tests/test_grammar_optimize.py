@@ -0,0 +1,213 @@
+"""Constant folding must not change what a program computes.
+
+We evaluate each expression as the VM would, before and after
+grammar_optimize, and check that the values agree and that
+the optimized tree has fewer method calls.
+
+    python3 -m pytest tests/test_grammar_optimize.py
+"""
+
+import io
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import batch_assemble
+import batch_compile
+import grammar_ast
+import grammar_optimize
+import grammar_reshape
+import pyvm
+import quack_parser
+
+
+@pytest.fixture(scope="module")
+def parser():
+    transformer = grammar_reshape.QuackTransformer(False, "Test")
+    return quack_parser.build_parser(transformer=transformer)
+
+
+def main_statements(parser, src: str) -> list:
+    """The expressions of the expression statements of a main block"""
+    block = parser.parse(src).classes[-1].constructor.block
+    return [getattr(stmt, "e", stmt) for stmt in block.stmts]
+
+
+class VMError(Exception):
+    """The VM would fail here, e.g., dividing by zero"""
+
+
+def evaluate(node, env: dict):
+    """Value of an expression, computed as the VM would"""
+    if isinstance(node, grammar_ast.ConstNode):
+        return node.value
+    if isinstance(node, grammar_ast.VariableReferenceNode):
+        return env[node.name]
+    assert isinstance(node, grammar_ast.MethodCallNode), node
+    receiver = evaluate(node.receiver, env)
+    if node.name == "BOOLEAN_NOT":
+        return not receiver
+    arg = evaluate(node.actuals[0], env)
+    if node.name == "DIVIDE":
+        if arg == 0:
+            raise VMError("divide by zero")
+        return grammar_optimize.c_divide(receiver, arg)
+    ops = {**grammar_optimize.INT_ARITHMETIC, **grammar_optimize.COMPARISONS,
+           **grammar_optimize.BOOLEAN_OPS}
+    return ops[node.name](receiver, arg)
+
+
+def outcome(node, env: dict):
+    try:
+        return evaluate(node, env)
+    except VMError as e:
+        return str(e)
+
+
+def count_calls(node) -> int:
+    calls = []
+    node.walk(calls, lambda n, acc: acc.append(n)
+              if isinstance(n, grammar_ast.MethodCallNode) else None,
+              grammar_ast.ignore)
+    return len(calls)
+
+
+EXPRESSIONS = [
+    "1 + 2 * 3;",
+    "-7;",
+    "-2 * 3 + 1;",
+    "10 - 4 - 3;",
+    "7 / 2;",
+    "0 - 7 / 2;",
+    "(0 - 7) / 2;",
+    "(1 + 2) * (3 + 4) - 5 * 6;",
+    "2147483647 - 1 + 1;",
+    "10 / 0;",
+    "1 < 2;",
+    "2 <= 2;",
+    "3 > 4;",
+    "4 >= 5;",
+    "3 == 1 + 2;",
+    "not 1 < 2;",
+    "(1 < 2) and (3 == 3);",
+    "(1 < 2) or (2 < 1);",
+    "(1 < 2) == (2 < 1);",
+    "a + 0;",
+    "a * 1;",
+    "a * 2 * 1;",
+]
+
+
+@pytest.mark.parametrize("src", EXPRESSIONS)
+def test_same_value(parser, src):
+    plain = main_statements(parser, src)[0]
+    before = count_calls(plain)
+    expected = outcome(plain, {"a": 5})
+    optimized = grammar_optimize.optimize(main_statements(parser, src)[0])
+    assert outcome(optimized, {"a": 5}) == expected
+    assert count_calls(optimized) <= before
+
+
+@pytest.mark.parametrize("src,value", [
+    ("1 + 2 * 3;", 7),
+    ("-2 * 3 + 1;", -7),
+    ("0 - 7 / 2;", -3),
+    ("not 1 < 2;", False),
+    ("(1 < 2) and (3 == 3);", True),
+    ("2 <= 2;", True),
+    ("3 <= 2;", False),
+    ("3 > 2;", True),
+    ("2 > 2;", False),
+    ("2 >= 2;", True),
+    ("1 >= 2;", False),
+])
+def test_folds_to_literal(parser, src, value):
+    folded = grammar_optimize.optimize(main_statements(parser, src)[0])
+    assert isinstance(folded, grammar_ast.ConstNode)
+    assert folded.value == value and type(folded.value) is type(value)
+
+
+@pytest.mark.parametrize("src", ["10 / 0;", "2147483647 + 1;", '"a" + "b";'])
+def test_leaves_runtime_behavior(parser, src):
+    """Division by zero, overflow, and strings are left to the VM"""
+    kept = grammar_optimize.optimize(main_statements(parser, src)[0])
+    assert isinstance(kept, grammar_ast.MethodCallNode)
+
+
+def test_identities_need_int(parser):
+    """a might have its own 'plus'; only a known Int is simplified"""
+    src = "a + 0;"
+    kept = grammar_optimize.optimize(main_statements(parser, src)[0])
+    assert isinstance(kept, grammar_ast.MethodCallNode)
+    int_vars = lambda node: ("Int" if isinstance(node, grammar_ast.VariableReferenceNode)
+                             else grammar_optimize.literal_type(node))
+    simplified = grammar_optimize.optimize(main_statements(parser, src)[0],
+                                           type_of=int_vars)
+    assert isinstance(simplified, grammar_ast.VariableReferenceNode)
+
+
+def test_inside_unreshaped_tree(parser):
+    """Expressions within statements not yet reshaped are still folded"""
+    typecase = main_statements(parser, "typecase 2 * 3 { }")[0]
+    optimizer = grammar_optimize.Optimizer()
+    block = grammar_ast.BlockNode([typecase])
+    optimizer.optimize(block)
+    assert optimizer.folded == 1
+
+
+def test_code_for_literals():
+    buffer = []
+    for value in [7, -3, True, False]:
+        grammar_ast.ConstNode(value).r_eval(buffer)
+    assert buffer == ["\tconst 7", "\tconst -3", "\tconst true", "\tconst false"]
+
+
+# Each value once from literals, which fold (or, overflowing, are
+# left to the VM), and once from variables, which don't: C
+# division, and 32-bit wrapping
+ON_THE_VM = """
+n = 0 - 7;  p = 7;  d = 0 - 2;  m = 65536;  q = 46341;  big = 2147483647;
+((0 - 7) / 2).print(); " ".print(); (n / 2).print(); "|".print();
+((0 + 7) / (0 - 2)).print(); " ".print(); (p / d).print(); "|".print();
+(65536 * 65536).print(); " ".print(); (m * m).print(); "|".print();
+(46341 * 46341).print(); " ".print(); (q * q).print(); "|".print();
+(2147483647 + 1).print(); " ".print(); (big + 1).print(); "|".print();
+"""
+
+
+def run_on_vm(tmp_path: Path, monkeypatch, optimize: bool) -> tuple:
+    """Assembly code and output of ON_THE_VM, compiled with or
+    without folding, on pyvm
+    """
+    work = tmp_path / ("optimized" if optimize else "plain")
+    lib = work / "OBJ"
+    lib.mkdir(parents=True)
+    for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+        shutil.copy(builtin, lib)
+    monkeypatch.setattr(assemble.CONFIG, "tvmlib", lib)
+    assemble.INTERFACES.clear()
+    source = work / "Fold.qk"
+    source.write_text(ON_THE_VM)
+    parser, inline = batch_compile.make_parser(tree=False)
+    compiled = batch_compile.compile_file(parser, source, work, inline, optimize)
+    assert compiled.error is None
+    results = batch_assemble.assemble_all(compiled.written, lib)
+    assert not any(r.error for r in results), [r.error for r in results]
+    out = io.StringIO()
+    pyvm.VM(lib, out).run("$Main")
+    return compiled.written[-1].read_text(), out.getvalue()
+
+
+def test_same_output_on_vm(tmp_path, monkeypatch):
+    """As main.py and main.py --no-optimize compile it"""
+    expect = "-3 -3|-3 -3|0 0|-2147479015 -2147479015|-2147483648 -2147483648|"
+    plain, plain_out = run_on_vm(tmp_path, monkeypatch, False)
+    folded, folded_out = run_on_vm(tmp_path, monkeypatch, True)
+    assert plain_out == folded_out == expect
+    assert "const -3" in folded and "const -3" not in plain
@@ -0,0 +1,187 @@
+"""Type inference resolves calls to the right class and slot,
+and reports type errors.
+
+    python3 -m pytest tests/test_grammar_types.py
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import grammar_ast
+import grammar_reshape
+import grammar_types
+import quack_parser
+
+
+@pytest.fixture(scope="module")
+def parser():
+    transformer = grammar_reshape.QuackTransformer(False, "Test")
+    return quack_parser.build_parser(transformer=transformer)
+
+
+def infer(parser, src: str):
+    program = parser.parse(src)
+    return program, grammar_types.infer(program)
+
+
+def calls(node) -> dict:
+    """Method calls in node, by their text"""
+    found = {}
+    node.walk(found, lambda n, acc: acc.__setitem__(str(n), n)
+              if isinstance(n, grammar_ast.MethodCallNode) else None,
+              grammar_ast.ignore)
+    return found
+
+
+POINTS = """
+class Pt(x: Int, y: Int) {
+    this.x = x;
+    this.y = y;
+    def getx() : Int { return this.x; }
+    def string() : String { return "pt"; }
+    def plus(other: Pt) : Pt { return Pt(this.x + other.getx(), this.y); }
+}
+class Pt3(x: Int, y: Int, z: Int) extends Pt {
+    this.x = x;  this.y = y;  this.z = z;
+    def getz() : Int { return this.z; }
+}
+"""
+
+
+def test_operators_resolve_to_builtins(parser):
+    program, inference = infer(parser, "x = 1 + 2; y = \"a\".print(); z = x > 3;")
+    assert inference.errors == []
+    found = calls(program)
+    plus = found["1.PLUS(2)"]
+    assert (plus.static_class, plus.method, plus.slot, plus.static_type) == ("Int", "plus", 5, "Int")
+    less = found["3.LT(x)"]   # x > 3 is 3 < x
+    assert (less.method, less.static_type) == ("less", "Boolean")
+    assert found['"a".print()'].static_class == "String"
+
+
+def test_user_class_slots(parser):
+    program, inference = infer(parser, POINTS + "p = Pt3(1, 2, 3); p.getz(); s = p.string(); q = p.plus(p);")
+    assert inference.errors == []
+    hierarchy = inference.hierarchy
+    # Overriding keeps the inherited slot; new methods follow
+    assert hierarchy["Pt"].slots["string"] == hierarchy["Obj"].slots["string"]
+    assert hierarchy["Pt3"].methods == hierarchy["Pt"].methods + ["getz"]
+    assert list(hierarchy["Pt3"].fields) == ["x", "y", "z"]
+    pt, pt3, main = program.classes
+    assert pt.fields == ["x", "y"] and pt3.fields == ["z"]
+    found = calls(main)
+    assert found["p.getz()"].slot == hierarchy["Pt3"].slots["getz"]
+    assert found["p.plus(p)"].static_type == "Pt"
+    # Calls within a class refer to it as $
+    assert calls(pt)["other.getx()"].asm_class == "$"
+
+
+def test_flow_sensitive(parser):
+    program, inference = infer(parser, POINTS + """
+        p = Pt(1, 2);
+        p.getx();
+        p = Pt3(1, 2, 3);
+        p.getz();
+        if p.getz() == 3 { q = Pt(1, 2); } else { q = Pt3(1, 2, 3); }
+        q.getx();
+    """)
+    assert inference.errors == []
+    found = calls(program.classes[-1])
+    assert found["p.getx()"].static_class == "Pt"
+    assert found["p.getz()"].static_class == "Pt3"
+    assert found["q.getx()"].static_class == "Pt"    # The join of the branches
+
+
+def test_loop_joins_types(parser):
+    program, inference = infer(parser, POINTS + """
+        p = Pt3(1, 2, 3);
+        while p.getx() < 10 { p.getz(); p = Pt(11, 0); }
+    """)
+    assert [error for error in inference.errors if "no method getz" in error]
+
+
+def nested_loops(depth: int, widen: bool) -> str:
+    """Loops depth deep; the innermost has an error, and may widen x"""
+    lines = ["x = 1;"]
+    for level in range(depth):
+        lines.append(f"i{level} = 0; while i{level} < 3 {{ i{level} = i{level} + 1;")
+    lines.append("x.print(); 1.frob();" + (' x = "s";' if widen else ""))
+    lines.append("}" * depth)
+    return "\n".join(lines)
+
+
+@pytest.mark.parametrize("widen", [False, True])
+def test_nested_loops_scale(parser, monkeypatch, widen):
+    trips = []
+    expect_boolean = grammar_types.TypeInference.expect_boolean
+    monkeypatch.setattr(grammar_types.TypeInference, "expect_boolean",
+                        lambda self, *args: trips.append(1) or expect_boolean(self, *args))
+    for depth in [4, 8, 40]:
+        trips.clear()
+        program, inference = infer(parser, nested_loops(depth, widen))
+        assert inference.errors == ["$Main.$constructor: Int has no method frob"]
+        # Typed as on the last trip around the loops
+        assert calls(program)["x.print()"].static_class == ("Obj" if widen else "Int")
+        # One trip per loop; once x widens, one more
+        assert len(trips) == (2 * depth if widen else depth)
+
+
+def test_inner_loop_widens_outer(parser):
+    """A type an inner loop widens reaches the top of the outer loop"""
+    program, inference = infer(parser, """
+        x = 1;
+        while true {
+            y = x;
+            y.print();
+            while false { x = "s"; }
+            while false { x.print(); }
+        }
+    """)
+    assert inference.errors == []
+    found = calls(program)
+    assert found["y.print()"].static_class == "Obj"
+    assert found["x.print()"].static_class == "Obj"
+
+
+@pytest.mark.parametrize("src,message", [
+    ("x = 1; y = x.plus(\"a\");", "is String, not Int"),
+    ("x = 1; x.frob();", "Int has no method frob"),
+    ("y.print();", "before it is assigned"),
+    ("if 3 { }", "not Boolean"),
+    ("x: String = 3;", "Assigning Int to x: String"),
+    (POINTS + "class Q(a: Int) extends Pt { this.a = a; }", "Inherited field x"),
+    (POINTS + "class Q() extends Pt { this.x = 1; this.y = 2; def getx(): String { return \"x\"; } }",
+     "Returns String"),
+    ("class A() extends B { } class B() extends A { }", "inherits from itself"),
+])
+def test_errors(parser, src, message):
+    _, inference = infer(parser, src)
+    assert any(message in error for error in inference.errors), inference.errors
+    with pytest.raises(grammar_types.QuackTypeError):
+        inference.check()
+
+
+@pytest.mark.parametrize("src,message", [
+    ("class A() extends B { } class B() extends A { } class C() extends A { }",
+     "inherits from itself"),
+    ("class C() extends A { } class A() extends B { } class B() extends A { }",
+     "inherits from itself"),
+    ("class D() extends Nowhere { } class E() extends D { }", "extends unknown class"),
+])
+def test_subclass_of_failed_class(parser, src, message):
+    """The failed class is reported once, not again for each subclass"""
+    _, inference = infer(parser, src)
+    assert len(inference.errors) == 1 and message in inference.errors[0], inference.errors
+
+
+def test_code_uses_resolved_class(parser):
+    program, inference = infer(parser, POINTS + "p = Pt(1, 2); b = p.getx() < 3; \"s\".print();")
+    buffer = []
+    program.classes[-1].gen_code(buffer)
+    assert "\tcall Pt:getx" in buffer
+    assert "\tint_less" in buffer
+    assert "\tcall String:print" in buffer
@@ -0,0 +1,100 @@
+"""link.py: one image for the whole program, with the constants
+and class numbers of every module renumbered to match.
+
+    python3 -m pytest tests/test_link.py
+"""
+
+import json
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import batch_assemble
+import link
+import objfile
+
+SRC = Path(__file__).resolve().parent / "src"
+
+
+@pytest.fixture
+def lib(tmp_path, monkeypatch):
+    lib = tmp_path / "OBJ"
+    lib.mkdir()
+    for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+        shutil.copy(builtin, lib)
+    monkeypatch.setattr(assemble.CONFIG, "tvmlib", lib)
+    assemble.INTERFACES.clear()
+    sources = [SRC / f"{name}.asm" for name in ["Counter", "TestCounter", "Pair"]]
+    assert not any(r.error for r in batch_assemble.assemble_all(sources, lib))
+    return lib
+
+
+def operands(code: list, operand_ops: dict):
+    """(opcode, operand) of each operand, with the opcode of the
+    operation it is for (a part, in a superinstruction)
+    """
+    i = 0
+    while i < len(code):
+        opcode = code[i]
+        for op in operand_ops[opcode]:
+            i += 1
+            yield op, code[i]
+        i += 1
+
+
+def test_image(lib):
+    linker = link.Linker(lib)
+    image = linker.link("TestCounter")
+    names = [c["class_name"] for c in image["classes"]]
+    assert image["main"] == "TestCounter"
+    assert {"TestCounter", "Counter", "Obj", "Int", "String"} <= set(names)
+    assert "Pair" not in names
+    for i, clazz in enumerate(image["classes"]):
+        if clazz["super"]:
+            assert names.index(clazz["super"]) < i
+    keys = [(c["kind"], c["value"]) for c in image["constants"]]
+    assert len(keys) == len(set(keys))
+
+
+def test_relocation(lib):
+    """Each operand names the same constant or class as before"""
+    linker = link.Linker(lib)
+    image = linker.link("TestCounter")
+    names = [c["class_name"] for c in image["classes"]]
+    for clazz in image["classes"]:
+        if not clazz["super"]:
+            continue
+        module = json.loads(lib.joinpath(clazz["class_name"]).with_suffix(".json").read_text())
+        for method, linked in zip(module["code"], clazz["code"]):
+            pairs = zip(operands(method["code"], linker.operand_ops),
+                        operands(linked["code"], linker.operand_ops))
+            for (opcode, before), (_, after) in pairs:
+                if opcode == linker.const_op and before >= 0:
+                    assert image["constants"][after] == module["constants"][before]
+                elif opcode in linker.class_ops:
+                    assert names[after] == module["imports"][before]
+                else:
+                    assert after == before
+
+
+def test_round_trip_and_binary_modules(lib):
+    image = link.Linker(lib).link("TestCounter")
+    assert link.decode_image(link.encode_image(image)) == image
+    # Linking from .tvo modules gives the same image
+    for name in ["Counter", "TestCounter"]:
+        module = lib.joinpath(name).with_suffix(".json")
+        objfile.convert(module, module.with_suffix(objfile.SUFFIX))
+        module.unlink()
+    assert link.Linker(lib).link("TestCounter") == image
+
+
+def test_missing_class(lib):
+    lib.joinpath("Counter.json").unlink()
+    with pytest.raises(link.LinkError, match="No object module for class Counter"):
+        link.Linker(lib).link("TestCounter")
@@ -0,0 +1,67 @@
+"""Binary object modules: the same data as the .json modules.
+
+    python3 -m pytest tests/test_objfile.py
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import objfile
+
+SRC = ROOT / "tests" / "src"
+
+
+def assembled(source: Path) -> assemble.ObjectCode:
+    assembler = assemble.Assembler(ROOT / "OBJ", assemble.InstructionSet(str(ROOT / "opdefs.txt")))
+    return assembler.translate(source.read_text().splitlines(keepends=True))
+
+
+@pytest.mark.parametrize("name", ["Pair", "Roleur", "MultiMethodJumps"])
+def test_round_trip(name):
+    code = assembled(SRC / f"{name}.asm")
+    data = code.binary()
+    assert len(data) % 4 == 0
+    assert objfile.decode(data) == json.loads(code.json())
+    # Key order too, so that converting back gives what assemble.py writes
+    assert json.dumps(objfile.decode(data), indent=4) == code.json()
+
+
+def test_strings_are_padded_words():
+    module = {"class_name": "Abc", "super": "Obj", "n_fields": 0, "n_methods": 1,
+              "n_inherited": 1, "imports": ["Abc", "Obj"], "methods": ["$constructor"],
+              "fields": [], "constants": [{"kind": "s", "value": "héllo"}],
+              "code": [{"name": "$constructor", "slot": 0, "code": [1, -3, 2]}]}
+    data = objfile.encode(module)
+    assert data[:8] == b"TVMO" + objfile.WORD.pack(objfile.VERSION)
+    assert data[8:16] == objfile.WORD.pack(3) + b"Abc\0"
+    assert data[-12:] == objfile.WORD.pack(1) + objfile.WORD.pack(-3) + objfile.WORD.pack(2)
+    assert objfile.decode(data) == module
+
+
+def test_convert(tmp_path):
+    code = assembled(SRC / "Pair.asm")
+    source = tmp_path / "Pair.json"
+    source.write_text(code.json() + "\n")
+    objfile.convert(source, tmp_path / "Pair.tvo")
+    assert tmp_path.joinpath("Pair.tvo").read_bytes() == code.binary()
+    objfile.convert(tmp_path / "Pair.tvo", tmp_path / "Back.json")
+    assert tmp_path.joinpath("Back.json").read_text() == source.read_text()
+
+
+@pytest.mark.parametrize("damage,message", [
+    (lambda data: b"JSON" + data[4:], "not a TVMO file"),
+    (lambda data: data[:4] + objfile.WORD.pack(99) + data[8:], "version 99"),
+    (lambda data: data[:-8], "truncated"),
+    (lambda data: data + bytes(4), "after the end"),
+])
+def test_bad_modules(damage, message):
+    data = assembled(SRC / "Pair.asm").binary()
+    with pytest.raises(objfile.ObjectFileError, match=message):
+        objfile.decode(damage(data))
@@ -0,0 +1,76 @@
+"""tools/profile_report.py names the methods in a tiny_vm profile.
+
+    python3 -m pytest tests/test_profile_report.py
+"""
+
+import json
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "tools"))
+
+import assemble
+import batch_assemble
+import profile_report
+
+SRC = Path(__file__).resolve().parent / "src"
+VM = ROOT / "bin" / "tiny_vm"
+
+
+@pytest.fixture
+def lib(tmp_path, monkeypatch):
+    lib = tmp_path / "OBJ"
+    lib.mkdir()
+    for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+        shutil.copy(builtin, lib)
+    monkeypatch.setattr(assemble.CONFIG, "tvmlib", lib)
+    assemble.INTERFACES.clear()
+    sources = [SRC / f"{name}.asm" for name in ["Counter", "TestCounter"]]
+    assert not any(r.error for r in batch_assemble.assemble_all(sources, lib))
+    return lib
+
+
+def test_names(lib):
+    methods = profile_report.Methods([lib])
+    assert methods.name("TestCounter", 0) == "TestCounter.$constructor"
+    assert methods.name("TestCounter", 1) == "TestCounter.string (from Obj)"
+    assert methods.name("Int", 5) == "Int.plus"
+    assert methods.name("Boolean", 1) == "Boolean.string"
+    assert methods.name("Unknown", 2) == "Unknown.<slot 2>"
+
+
+def test_report(lib):
+    profile = {"lib": str(lib), "seconds": 0.01, "dispatches": 30,
+               "ops": {"call": 10, "return": 10, "load": 10},
+               "methods": [{"class": "Int", "slot": 5, "calls": 8, "seconds": 0.001,
+                            "self_seconds": 0.001},
+                           {"class": "TestCounter", "slot": 0, "calls": 1, "seconds": 0.01,
+                            "self_seconds": 0.009}],
+               "allocations": {"Int": 8}}
+    lines = profile_report.report(profile, profile_report.Methods([lib])).splitlines()
+    methods = [line for line in lines if line.endswith(("Int.plus", "$constructor"))]
+    assert methods[0].endswith("TestCounter.$constructor") and "90.0%" in methods[0]
+    assert methods[1].endswith("Int.plus")
+    by_calls = profile_report.report(profile, profile_report.Methods([lib]), sort="calls")
+    assert by_calls.index("Int.plus") < by_calls.index("TestCounter.$constructor")
+
+
+@pytest.mark.skipif(not VM.exists(), reason="needs bin/tiny_vm built")
+def test_vm_profile(lib, tmp_path):
+    out = tmp_path / "profile.json"
+    proc = subprocess.run([str(VM), "-c", "-L", str(lib), "-P", str(out), "TestCounter"],
+                          capture_output=True, text=True)
+    profile = json.loads(out.read_text())
+    dispatches = int(proc.stderr.split("dispatches ")[1].split()[0])
+    assert sum(profile["ops"].values()) == profile["dispatches"] == dispatches
+    calls = {(m["class"], m["slot"]): m["calls"] for m in profile["methods"]}
+    assert calls[("TestCounter", 0)] == 1
+    assert profile["allocations"]["Counter"] == 1
+    for m in profile["methods"]:
+        assert 0 <= m["self_seconds"] <= m["seconds"] <= profile["seconds"]
@@ -0,0 +1,136 @@
+"""pyvm.py: the Python interpreter runs assembled programs as the
+C VM does.
+
+    python3 -m pytest tests/test_pyvm.py
+"""
+
+import csv
+import io
+import re
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import assemble
+import batch_assemble
+import objfile
+import pyvm
+
+TESTS = Path(__file__).resolve().parent
+SRC = TESTS / "src"
+
+
+def expected() -> list:
+    with open(SRC / "TESTS.csv") as cases:
+        return [case["Class"] for case in csv.DictReader(cases)
+                if case["Action"] == "run"
+                and TESTS.joinpath("expect", f"{case['Class']}_stdout.txt").exists()]
+
+
+def empty_lib(tmp_path: Path, monkeypatch) -> Path:
+    lib = tmp_path / "OBJ"
+    lib.mkdir()
+    for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+        shutil.copy(builtin, lib)
+    monkeypatch.setattr(assemble.CONFIG, "tvmlib", lib)
+    assemble.INTERFACES.clear()
+    return lib
+
+
+@pytest.fixture(scope="module")
+def lib(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        lib = empty_lib(tmp_path_factory.mktemp("pyvm"), monkeypatch)
+        results = batch_assemble.assemble_all(sorted(SRC.glob("*.asm")), lib)
+        assert not any(r.error for r in results), [r.error for r in results]
+        yield lib
+
+
+def run(lib: Path, main_class: str) -> str:
+    out = io.StringIO()
+    pyvm.VM(lib, out).run(main_class)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("program", expected())
+def test_programs(lib, program):
+    expect = TESTS.joinpath("expect", f"{program}_stdout.txt").read_text()
+    assert run(lib, program) == expect
+
+
+def test_binary_modules(lib, tmp_path):
+    for module in lib.glob("*.json"):
+        if ROOT.joinpath("OBJ", module.name).exists():
+            shutil.copy(module, tmp_path)
+        else:
+            objfile.convert(module, tmp_path / module.with_suffix(objfile.SUFFIX).name)
+    assert run(tmp_path, "Pair") == run(lib, "Pair")
+
+
+def program(tmp_path, monkeypatch, body: str) -> str:
+    """Output of a constructor with body, which prints its result"""
+    lib = empty_lib(tmp_path, monkeypatch)
+    src = tmp_path / "P.asm"
+    src.write_text(f".class P:Obj\n.method $constructor\n    enter\n{body}"
+                   "    call Obj:print\n    pop\n    load $\n    return 0\n")
+    results = batch_assemble.assemble_all([src], lib)
+    assert not any(r.error for r in results), [r.error for r in results]
+    return run(lib, "P")
+
+
+@pytest.mark.parametrize("body, output", [
+    ("const 3\nconst -7\ncall Int:divide\n", "-2"),
+    ("const -3\nconst 7\ncall Int:divide\n", "-2"),
+    ("const 2147483647\nconst 1\ncall Int:plus\n", "-2147483648"),
+    ("const 3\nconst 2\ncall Int:less\n", "true"),
+    ("const 2\nconst 2\ncall Int:equals\n", "true"),
+    ('const "a"\nconst "a"\ncall String:equals\n', "true"),
+    ("const 1\nconst 2\nconst 3\nroll 2\npop\npop\n", "2"),
+    ("const 1\nconst 2\nconst 3\nroll 2\npop\n", "3"),
+    ("const 1\nis_instance Obj\n", "true"),
+    ("const 1\nis_instance String\n", "false"),
+    ("const nothing\ncall Obj:string\n", "nothing"),
+    ("const 2147483647\nconst 1\nint_plus\n", "-2147483648"),
+    ("const 3\nconst -7\nint_divide\n", "-2"),
+    ("const 3\nconst 2\nint_less\n", "true"),
+    ('const "a"\nconst "a"\nint_equals\n', "true"),
+])
+def test_semantics(tmp_path, monkeypatch, body, output):
+    assert program(tmp_path, monkeypatch, body) == output
+
+
+def test_errors(tmp_path, monkeypatch):
+    with pytest.raises(pyvm.VMError, match="division by zero"):
+        program(tmp_path, monkeypatch, "const 0\nconst 1\ncall Int:divide\n")
+    with pytest.raises(pyvm.VMError, match="No object module"):
+        pyvm.VM(tmp_path / "OBJ").run("Missing")
+
+
+def test_int_divide_by_zero(tmp_path, monkeypatch):
+    # Made as the call to Int:divide, which fails
+    with pytest.raises(pyvm.VMError, match="division by zero"):
+        program(tmp_path, monkeypatch, "const 0\nconst 1\nint_divide\n")
+
+
+def test_count(lib):
+    vm = pyvm.VM(lib, io.StringIO())
+    assert vm.run("Looper") == vm.instructions > 0
+
+
+def test_vms_share_builtins(lib):
+    expect = TESTS.joinpath("expect", "Pair_stdout.txt").read_text()
+    for _ in range(3):
+        assert run(lib, "Pair") == expect
+    # Each VM starts with the same built-in code; the vtables are filled once
+    assert len(pyvm.INT.vtable) == len(pyvm.BUILTIN_METHODS["Int"])
+    assert pyvm.VM(lib).code == pyvm.BUILTIN_CODE
+
+
+def test_object_string(tmp_path, monkeypatch):
+    assert re.fullmatch(r"<Object at 0x[0-9a-f]+>",
+                        program(tmp_path, monkeypatch, "load $\ncall Obj:string\n"))
@@ -0,0 +1,80 @@
+"""The persistent parser cache: each way of building the parser
+keeps its own cache file, and later builds load from it.
+
+    python3 -m pytest tests/test_quack_parser.py
+"""
+
+import sys
+from pathlib import Path
+
+import lark
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import batch_compile
+import grammar_ast
+import grammar_reshape
+import quack_parser
+
+
+@pytest.fixture
+def loads(monkeypatch) -> list:
+    """Records each parser Lark loads from a cache file"""
+    loaded = []
+    load = lark.Lark._load
+
+    def spy(self, f, **options):
+        loaded.append(options.get("transformer"))
+        return load(self, f, **options)
+    monkeypatch.setattr(lark.Lark, "_load", spy)
+    return loaded
+
+
+def build(cache_dir: Path, inline: bool) -> object:
+    if not inline:
+        return quack_parser.build_parser(cache_dir=cache_dir, standalone=False)
+    transformer = grammar_reshape.QuackTransformer(False, "Test")
+    return quack_parser.build_parser(cache_dir=cache_dir, standalone=False,
+                                     transformer=transformer)
+
+
+def test_modes_have_their_own_files(tmp_path):
+    tree = quack_parser.cache_path(cache_dir=tmp_path)
+    inline = quack_parser.cache_path(cache_dir=tmp_path, transformer=object())
+    positions = quack_parser.cache_path(cache_dir=tmp_path,
+                                        propagate_positions=True)
+    assert len({tree, inline, positions}) == 3
+    assert quack_parser.cache_path(cache_dir=tmp_path) == tree
+    assert "-tree-" in tree.name and "-inline-" in inline.name
+
+
+def test_second_build_loads_from_cache(tmp_path, loads):
+    build(tmp_path, inline=False)
+    build(tmp_path, inline=True)
+    assert loads == []
+    files = {path: path.read_bytes() for path in tmp_path.iterdir()}
+    assert len(files) == 2
+    # Alternating modes must not overwrite each other's file
+    for _ in range(2):
+        tree = build(tmp_path, inline=False)
+        inline = build(tmp_path, inline=True)
+    assert len(loads) == 4 and loads[0] is None and loads[1] is not None
+    assert {path: path.read_bytes() for path in tmp_path.iterdir()} == files
+    assert isinstance(tree.parse("x = 1;"), lark.Tree)
+    assert isinstance(inline.parse("x = 1;"), grammar_ast.ProgramNode)
+
+
+@pytest.mark.skipif(quack_parser.load_standalone() is not None,
+                    reason="make_parser uses the standalone parser")
+@pytest.mark.parametrize("tree", [True, False])
+def test_make_parser_loads_from_cache(tree, loads):
+    """The compiler's own parsers use the default cache directory"""
+    batch_compile.make_parser(tree=tree)
+    del loads[:]
+    batch_compile.make_parser(tree=not tree)
+    batch_compile.make_parser(tree=tree)
+    assert len(loads) == 2 and (loads[1] is None) == tree
+    assert quack_parser.cache_path(
+        transformer=None if tree else object()).exists()
@@ -0,0 +1,100 @@
+"""Superinstructions: pairs of instructions the assembler emits as
+one, and the tool that chooses them.
+
+    python3 -m pytest tests/test_superinstructions.py
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "tools"))
+
+import assemble
+import mine_superinstructions as mine
+
+BODY = """\
+    const 1
+    call String:print
+    pop
+x:  load n
+    jump_if x
+    load $
+    return 0
+"""
+
+
+def opdefs_with(tmp_path: Path, fused: str) -> Path:
+    """opdefs.txt with superinstructions fused instead of those it has"""
+    path = tmp_path / "opdefs.txt"
+    path.write_text(ROOT.joinpath("opdefs.txt").read_text())
+    mine.declare(path, [])
+    path.write_text(path.read_text() + fused)
+    return path
+
+
+@pytest.fixture
+def instrs(tmp_path):
+    fused = ("const+call,vm_op_const__call,2\n"
+             "pop+load,vm_op_pop__load,1\n")
+    return assemble.InstructionSet(str(opdefs_with(tmp_path, fused)))
+
+
+def method_code(instrs: assemble.InstructionSet, body: str, fuse: bool = True) -> list:
+    src = f".class P:Obj\n.method $constructor\n.local n\n    enter\n{body}"
+    assembler = assemble.Assembler(ROOT / "OBJ", instrs)
+    code = assembler.translate(src.splitlines(keepends=True), fuse=fuse)
+    assert code.errors == 0
+    return code.method_code[0]["code"]
+
+
+def test_instruction_set(instrs):
+    const_call = instrs.fused[(instrs["const"].code, instrs["call"].code)]
+    assert const_call.name == "const+call" and const_call.ops == "2"
+    assert [part.name for part in const_call.parts] == ["const", "call"]
+    assert instrs.codes[const_call.code] is const_call
+    assert "const+call" not in instrs.ops
+
+
+def test_fusion(instrs):
+    op = {instr.name: instr.code for instr in instrs.codes}
+    plain = method_code(instrs, BODY, fuse=False)
+    fused = method_code(instrs, BODY)
+    prologue = plain[:3]   # alloc 1, enter
+    slot = plain[6]
+    # pop, x: load n  stays apart, since the jump goes to the load
+    assert fused == prologue + [op["const+call"], 0, slot, op["pop"], op["load"], 3,
+                                op["jump_if"], -4, op["load"], 0, op["return"], 0]
+    # Without the jump target, the pair fuses
+    fused = method_code(instrs, "const 1\ncall String:print\npop\nload n\nreturn 0\n")
+    assert fused[3:] == [op["const+call"], 0, slot, op["pop+load"], 3, op["return"], 0]
+
+
+def test_mining(instrs):
+    module = {"class_name": "P", "code": [{"name": "$constructor", "slot": 0,
+                                           "code": method_code(instrs, BODY, fuse=False)}]}
+    pairs = mine.count_pairs([module])
+    assert pairs[("const", "call")] == 1
+    assert pairs[("load", "jump_if")] == 1
+    assert ("call", "pop") not in pairs      # call changes the program counter
+    assert ("pop", "load") not in pairs      # A jump goes to the load
+    # Superinstructions are taken apart
+    module["code"][0]["code"] = method_code(instrs, BODY)
+    assert mine.count_pairs([module]) == pairs
+
+
+def test_declare(tmp_path):
+    path = opdefs_with(tmp_path, "")
+    mine.declare(path, [(("load", "call"), 30), (("const", "load"), 16)])
+    instrs = assemble.InstructionSet(str(path))
+    assert [instr.name for instr in instrs.fused.values()] == ["load+call", "const+load"]
+    assert instrs.codes[-1].ops == "2"
+    # Declaring again replaces them
+    mine.declare(path, [(("pop", "const"), 28)])
+    instrs = assemble.InstructionSet(str(path))
+    assert [instr.name for instr in instrs.fused.values()] == ["pop+const"]
+    assert path.read_text().count(mine.HEADER) == 1
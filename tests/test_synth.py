@@ -0,0 +1,46 @@
+"""bench/synth.py: generated programs of any shape compile and
+assemble without errors.
+
+    python3 -m pytest tests/test_synth.py
+"""
+
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "bench"))
+
+import assemble
+import grammar_reshape
+import grammar_types
+import quack_parser
+import synth
+
+SHAPES = [synth.Shape(n_classes=3, depth=3, n_methods=2, n_locals=2, expr_depth=4, n_strings=1),
+          synth.Shape(n_classes=4, depth=2, n_methods=1, n_locals=0, expr_depth=0, n_strings=0)]
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_quack_shaped(shape):
+    source = synth.quack_shaped(shape)
+    assert source.count("extends Obj") == -(-shape.n_classes // shape.depth)
+    ast = quack_parser.build_parser().parse(source)
+    ast = grammar_reshape.QuackTransformer(True, "Synth").transform(ast)
+    assert not grammar_types.infer(ast).errors
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_tvm_shaped(shape, tmp_path):
+    for builtin in ROOT.joinpath("OBJ").glob("*.json"):
+        shutil.copy(builtin, tmp_path)
+    assembler = assemble.Assembler(tmp_path)
+    classes = synth.tvm_shaped(shape)
+    assert list(classes) == [f"C{c}" for c in range(shape.n_classes)]
+    for name, source in classes.items():
+        code = assembler.translate(source.splitlines(keepends=True), f"{name}.asm")
+        assert not code.errors
+        tmp_path.joinpath(f"{name}.json").write_text(code.json())
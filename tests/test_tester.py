@@ -0,0 +1,78 @@
+"""tester.py: cases with what they need assembled first, shards,
+JUnit results, and runs in isolated workspaces.
+
+    python3 -m pytest tests/test_tester.py
+"""
+
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE))
+
+import tester
+
+SPIN = """\
+.class Spin:Obj
+.method $constructor
+    enter
+again:
+    const true
+    jump_if again
+    load $
+    return 0
+"""
+
+
+def test_needs():
+    cases = {case.class_name: case for case in tester.read_cases()}
+    assert cases["TestCounter"].needs == ["Counter"]
+    assert cases["Counter"].needs == []
+    assert cases["RecursiveLoadSuperDuper"].needs == ["RecursiveLoadSuper"]
+
+
+def test_shard():
+    cases = tester.read_cases()
+    shards = [tester.shard(cases, f"{k}/3") for k in (1, 2, 3)]
+    assert sorted(c.class_name for s in shards for c in s) == \
+        sorted(c.class_name for c in cases)
+    with pytest.raises(ValueError):
+        tester.shard(cases, "4/3")
+
+
+def test_junit():
+    ok, failed, skipped = (tester.Case(name, "run") for name in ["A", "B", "C"])
+    ok.ok, ok.seconds = True, 0.25
+    failed.failure = "Output did not match expectation"
+    skipped.skipped = "No expected output"
+    suite = tester.junit([ok, failed, skipped], 1.0).getroot()
+    assert (suite.get("tests"), suite.get("failures"), suite.get("skipped")) == ("3", "1", "1")
+    cases = suite.findall("testcase")
+    assert cases[0].get("time") == "0.250" and not list(cases[0])
+    assert cases[1].find("failure").get("message") == failed.failure
+    assert cases[2].find("skipped") is not None
+
+
+@pytest.mark.skipif(not tester.VM.exists(), reason="needs bin/tiny_vm built")
+def test_run(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    for name in ["Counter", "TestCounter"]:
+        shutil.copy(tester.SRC / f"{name}.asm", src)
+    src.joinpath("Spin.asm").write_text(SPIN)
+    src.joinpath("NoExpect.asm").write_text(
+        tester.SRC.joinpath("TestCounter.asm").read_text().replace("TestCounter", "NoExpect"))
+    src.joinpath("TESTS.csv").write_text(
+        "Class,Action\nTestCounter,run\nSpin,run\nNoExpect,run\n")
+    monkeypatch.setattr(tester, "SRC", src)
+    monkeypatch.setattr(tester, "OUT", tmp_path / "out")
+    cases = tester.run_all(tester.read_cases(src / "TESTS.csv"), jobs=1, seconds=2.0)
+    assert [case.class_name for case in cases] == ["TestCounter", "Spin", "NoExpect"]
+    assert cases[0].ok
+    assert cases[1].failure.startswith("Timed out")
+    assert cases[2].skipped and not cases[2].failure
+    assert tmp_path.joinpath("out", "TestCounter_stdout.txt").read_text() == \
+        tester.EXPECT.joinpath("TestCounter_stdout.txt").read_text()
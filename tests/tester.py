@@ -1,16 +1,38 @@
-"""Simple test script for Ori (tiny vm) asm files.
+"""Regression tests for Ori (tiny vm) asm files.
 (Extend later to work with Quack compilation)
 
-FIXME: There must be better ways to handle file dependencies
+Each case in src/TESTS.csv assembles a class (action "assemble")
+or assembles and runs it, comparing what it prints with
+expect/Class_stdout.txt (action "run"; with no expect file we
+run it but can't judge it, so the case is skipped).  Cases run in
+parallel, in worker processes.  Each worker assembles into its own
+workspace (OBJ with the built-in classes), so workers never see
+each other's object code; before a case, a worker assembles the
+classes in src/ that the case's class refers to, if it hasn't
+already.  A worker assembles in process, with one assemble.Assembler
+for all its cases (one instruction set, and the interfaces it has
+read); the VM runs as a subprocess, with a timeout.  Observed
+output goes to out/, as before.
+
+    python3 tester.py [-j N] [--shard 2/4] [--timeout 30] [--junit results.xml] [Class ...]
+
+--shard K/N runs every Nth case, starting with the Kth, so that N
+machines can split the suite.
 """
-import subprocess
+import argparse
+import concurrent.futures
+import csv
+import os
 import pathlib
 import shutil
-import filecmp
-import csv
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional
 
 import logging
-import sys
 
 logging.basicConfig()
 log = logging.getLogger(__name__)
@@ -18,95 +40,245 @@ log.setLevel(logging.INFO)
 
 # The following might differ from system to system,
 # and should be configurable
-PY = "python3"
-ROOT = ".."
-ASM = f"{ROOT}/assemble.py"
-VM = f"{ROOT}/bin/tiny_vm"
+HERE = pathlib.Path(__file__).resolve().parent
+ROOT = HERE.parent
+VM = ROOT / "bin" / "tiny_vm"
 BUILTINS = ["Bool.json", "Int.json", "Nothing.json", "Obj.json", "String.json"]
-ASMREQS = ["asm.conf", "opdefs.txt"]
+SRC = HERE / "src"
+EXPECT = HERE / "expect"
+OUT = HERE / "out"
+
+sys.path.insert(0, str(ROOT))
+import assemble as asm
+import batch_assemble
 
-def install_prereqs():
-    """Copy pre-requisite files.
-    It would be cleaner to do this in Cmake, probably.
+
+class Case:
+    """One line of TESTS.csv, and how it went"""
+    def __init__(self, class_name: str, action: str):
+        self.class_name = class_name
+        self.action = action
+        self.needs: List[str] = []   # Classes to assemble first
+        self.ok = False
+        self.skipped: Optional[str] = None
+        self.failure: Optional[str] = None
+        self.ran = False             # In the VM
+        self.stdout = ""
+        self.stderr = ""
+        self.seconds = 0.0
+
+
+def read_cases(path: pathlib.Path = SRC / "TESTS.csv") -> List[Case]:
+    """The cases, each with the classes it needs, in the order
+    they must be assembled (see batch_assemble.assembly_waves)
     """
+    with open(path) as cases:
+        found = [Case(case["Class"], case["Action"]) for case in csv.DictReader(cases)]
+    refs = {}
+    for source in sorted(path.parent.glob(f"*{batch_assemble.ASM_SUFFIX}")):
+        refs[source.stem] = asm.references(source.read_text().splitlines())
+    order = [name for wave in batch_assemble.assembly_waves(refs) for name in wave]
+    for case in found:
+        needed = set()
+        pending = [case.class_name]
+        while pending:
+            for ref in refs.get(pending.pop(), []):
+                if ref in refs and ref not in needed and ref != case.class_name:
+                    needed.add(ref)
+                    pending.append(ref)
+        case.needs = [name for name in order if name in needed]
+    return found
+
+
+def shard(cases: List[Case], spec: str) -> List[Case]:
+    """Cases for shard K of N, spec "K/N" (K from 1)"""
+    k, n = (int(part) for part in spec.split("/"))
+    if not 1 <= k <= n:
+        raise ValueError(f"Shard {spec}: need 1 <= K <= N")
+    return cases[k - 1::n]
+
+
+# ----------------
+# In each worker process
+#
+workspace: Optional[pathlib.Path] = None
+assembler: Optional[asm.Assembler] = None
+assembled: Dict[str, Optional[str]] = {}   # Class -> None, or why it failed
+timeout: float = 30.0
+
+
+def install_prereqs(where: pathlib.Path):
+    """Copy pre-requisite files into a workspace."""
+    where.joinpath("OBJ").mkdir(parents=True, exist_ok=True)
     for objfile in BUILTINS:
-        origin = pathlib.Path("../OBJ/" + objfile)
-        copied = pathlib.Path("./OBJ/" + objfile)
-        log.debug(f"Copying {origin} to {copied}")
-        shutil.copyfile(origin, copied)
-    for asmreq in ASMREQS:
-        origin = pathlib.Path("../" + asmreq)
-        copied = pathlib.Path("./" + asmreq)
-        log.debug(f"Copying {origin} to {copied}")
-        shutil.copyfile(origin, copied)
-
-def assemble(class_name: str) -> bool:
-    """Translate src/Class.asm to OBJ/Class.json.
-    Separated because some classes (e.g., Counter) cannot
+        shutil.copyfile(ROOT / "OBJ" / objfile, where / "OBJ" / objfile)
+
+
+def init_worker(root: str, seconds: float):
+    global workspace, assembler, timeout
+    workspace = pathlib.Path(tempfile.mkdtemp(dir=root, prefix="worker-"))
+    install_prereqs(workspace)
+    assembler = asm.Assembler(workspace / "OBJ")
+    assembled.clear()
+    timeout = seconds
+
+
+def assemble(class_name: str) -> Optional[str]:
+    """Translate src/Class.asm to OBJ/Class.json in the workspace,
+    unless we already have; None if it went well, else what went
+    wrong.  Separated because some classes (e.g., Counter) cannot
     be run as main programs.  (Main program class constructors
     cannot have arguments.)
     """
-    src = pathlib.Path("./src/" + class_name + ".asm")
-    obj = pathlib.Path("./OBJ/" + class_name + ".json")
+    if class_name in assembled:
+        return assembled[class_name]
+    src = SRC / f"{class_name}.asm"
     try:
-        proc = subprocess.run([PY, ASM, src, obj], text=True)
-        proc.check_returncode() # May throw CalledProcessError
-    except subprocess.CalledProcessError:
-        log.warning(f"Assembler crashed on {src}")
-        return False
-    return True
-
-
-def test_class(class_name: str) -> bool:
-    """Assemble, run, and check a single test case
-    for a class C, in src/C.asm, with expected output
-    in expect/C_stdout.txt.  Returns True iff test case
-    has expected outcome.
+        code = assembler.assemble_file(src, workspace / "OBJ" / f"{class_name}.json")
+        error = f"{code.errors} errors assembling {src}" if code.errors else None
+    except Exception as e:
+        error = f"Assembler failed on {src}: {e.__class__.__name__}: {e}"
+    assembled[class_name] = error
+    return error
+
+
+def run_case(case: Case) -> Case:
+    """Assemble (and run, and check) a single test case for a
+    class C, in src/C.asm, with expected output in expect/C_stdout.txt
     """
-    ok = True
-    observed_stdout = pathlib.Path("out/" + class_name + "_stdout.txt")
-    observed_stderr = pathlib.Path("out/" + class_name + "_stderr.txt")
-    expect_stdout = pathlib.Path("expect/" + class_name + "_stdout.txt")
-    if not assemble(class_name):
-        return False
+    start = time.perf_counter()
+    for name in case.needs + [case.class_name]:
+        error = assemble(name)
+        if error:
+            case.failure = error if name == case.class_name else \
+                f"Needs {name}, which did not assemble: {error}"
+            break
+    else:
+        if case.action == "assemble":
+            case.ok = True
+        elif case.action == "run":
+            check(case)
+        else:
+            case.failure = f"Unrecognized action '{case.action}'"
+    case.seconds = time.perf_counter() - start
+    return case
+
+
+def check(case: Case):
+    """Run an assembled class and compare its output"""
+    case.ran = True
     try:
-        std_out = open(observed_stdout, "w")
-        std_err = open(observed_stderr, "w")
-        proc = subprocess.run([VM, class_name], text=True,
-                              stdout=std_out, stderr=std_err)
-        proc.check_returncode() # May throw CalledProcessError
-        if filecmp.cmp(observed_stdout, expect_stdout):
-            log.info(f"OK: {class_name} produced expected output")
+        proc = subprocess.run([str(VM), "-L", "OBJ", case.class_name], cwd=workspace,
+                              capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired as e:
+        case.stdout = e.stdout.decode() if isinstance(e.stdout, bytes) else e.stdout or ""
+        case.failure = f"Timed out after {timeout} s"
+        return
+    case.stdout, case.stderr = proc.stdout, proc.stderr
+    expect_stdout = EXPECT / f"{case.class_name}_stdout.txt"
+    if proc.returncode != 0:
+        case.failure = f"Crashed (exit status {proc.returncode})"
+    elif not expect_stdout.exists():
+        case.skipped = f"No expected output in {expect_stdout.relative_to(HERE)}"
+    elif proc.stdout != expect_stdout.read_text():
+        case.failure = "Output did not match expectation"
+    else:
+        case.ok = True
+
+
+# ----------------
+# In the main process
+#
+def run_all(cases: List[Case], jobs: int, seconds: float) -> List[Case]:
+    """Run cases on jobs workers, logging each as it finishes;
+    the results are in the order of cases
+    """
+    OUT.mkdir(exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="tester-") as root:
+        if jobs <= 1:
+            init_worker(root, seconds)
+            finished = [record(run_case(case)) for case in cases]
         else:
-            log.info(f"{class_name} output did not match expectation")
-            ok = False
-    except subprocess.CalledProcessError:
-        log.warning(f"Crashed: {proc.args}")
-        ok = False
-    return ok
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=jobs, initializer=init_worker,
+                    initargs=(root, seconds)) as pool:
+                futures = [pool.submit(run_case, case) for case in cases]
+                for future in concurrent.futures.as_completed(futures):
+                    record(future.result())
+                finished = [future.result() for future in futures]
+    return finished
+
+
+def record(case: Case) -> Case:
+    if case.ran:
+        OUT.joinpath(f"{case.class_name}_stdout.txt").write_text(case.stdout)
+        OUT.joinpath(f"{case.class_name}_stderr.txt").write_text(case.stderr)
+    if case.ok and case.action == "run":
+        log.info(f"OK: {case.class_name} produced expected output ({case.seconds:.2f} s)")
+    elif case.ok:
+        log.info(f"OK: {case.class_name} assembled ({case.seconds:.2f} s)")
+    elif case.skipped:
+        log.info(f"Skipped: {case.class_name}: {case.skipped}")
+    else:
+        log.warning(f"{case.class_name}: {case.failure}")
+        print(f"*** Failed test case: {case.action} {case.class_name}", file=sys.stderr)
+    return case
+
+
+def junit(cases: List[Case], wall: float) -> ET.ElementTree:
+    """JUnit-style results, as CI servers read them"""
+    suite = ET.Element("testsuite", name="tiny_vm", tests=str(len(cases)),
+                       failures=str(sum(1 for c in cases if c.failure)),
+                       skipped=str(sum(1 for c in cases if c.skipped)),
+                       errors="0", time=f"{wall:.3f}")
+    for case in cases:
+        element = ET.SubElement(suite, "testcase", classname=f"tests.{case.action}",
+                                name=case.class_name, time=f"{case.seconds:.3f}")
+        if case.failure:
+            failure = ET.SubElement(element, "failure", message=case.failure.splitlines()[0])
+            failure.text = case.failure
+        elif case.skipped:
+            ET.SubElement(element, "skipped", message=case.skipped)
+        if case.stdout:
+            ET.SubElement(element, "system-out").text = case.stdout
+        if case.stderr and not case.ok:
+            ET.SubElement(element, "system-err").text = case.stderr
+    return ET.ElementTree(suite)
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(description="Run the tiny VM regression tests")
+    parser.add_argument("classes", nargs="*",
+                        help="Run only the cases for these classes")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Worker processes (1: run in this process)")
+    parser.add_argument("--shard", default="1/1",
+                        help="Run shard K of N (K/N)")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="Seconds to allow each run of the VM")
+    parser.add_argument("--junit", type=pathlib.Path, default=None,
+                        help="Write JUnit XML results here")
+    return parser.parse_args()
 
 
 def main():
-    """Stub"""
-    install_prereqs()
-    with open("src/TESTS.csv") as cases:
-        case_reader = csv.DictReader(cases)
-        for case in case_reader:
-            class_name = case["Class"]
-            action = case["Action"]
-            if action == "assemble":
-                # Assemble but do not execute
-                log.info(f"Class '{class_name} -- assemble only")
-                ok = assemble(class_name)
-            elif action == "run":
-                log.info(f"Class '{class_name} -- assemble and run")
-                ok = test_class(class_name)
-            else:
-                log.error(f"Unrecognized action '{action}' for class {class_name}")
-            if not ok:
-                print(f"*** Failed test case: {action} {class_name}", file=sys.stderr)
+    args = cli()
+    cases = read_cases()
+    if args.classes:
+        cases = [case for case in cases if case.class_name in args.classes]
+    cases = shard(cases, args.shard)
+    start = time.perf_counter()
+    finished = run_all(cases, args.jobs, args.timeout)
+    wall = time.perf_counter() - start
+    if args.junit:
+        junit(finished, wall).write(args.junit, encoding="unicode", xml_declaration=True)
     # FIXME: Add a check for omitted source files
-    print("Testing complete")
+    failed = sum(1 for case in finished if case.failure)
+    skipped = sum(1 for case in finished if case.skipped)
+    print(f"Testing complete: {len(finished)} cases, {failed} failed, "
+          f"{skipped} skipped, {wall:.2f} s")
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
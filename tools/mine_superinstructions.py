@@ -0,0 +1,152 @@
+"""Choose superinstructions for the tiny virtual machine.
+
+Each instruction the VM runs costs a dispatch (vm_step: fetch,
+call, checks), so pairs of instructions that come up again and
+again, like load then load_field, are cheaper as one
+superinstruction (see build_bytecode_table.py).  We count how often
+each pair of adjacent instructions occurs in assembled object
+modules, leaving out pairs that can't be fused (the first changes
+the program counter, or a jump goes to the second), and declare
+the most frequent at the end of opdefs.txt, replacing any chosen
+before.  Then rebuild the VM (which regenerates vm_code_table.c)
+and reassemble: the assembler emits the superinstructions.
+
+    python3 tools/mine_superinstructions.py OBJ tests/OBJ [--top 6] [--write]
+
+Object modules are .json or .tvo, or directories of them.  Run
+from the directory with asm.conf and opdefs.txt, as for assemble.py.
+"""
+
+import argparse
+import collections
+import json
+import sys
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import assemble
+import build_bytecode_table
+import objfile
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+HEADER = """\
+# Superinstructions (a+b is a then b, in one dispatch), chosen by
+# tools/mine_superinstructions.py from the pairs most frequent in
+# assembled code.  Rerun it to choose again; it replaces everything
+# from here to the end.
+"""
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Count pairs of instructions in object code and "
+                    "choose superinstructions")
+    parser.add_argument("modules", nargs="+", type=Path,
+                        help=f"Object modules ({objfile.JSON_SUFFIX} or {objfile.SUFFIX}), "
+                             "or directories of them")
+    parser.add_argument("--top", type=int, default=6,
+                        help="How many superinstructions to declare")
+    parser.add_argument("--write", action="store_true",
+                        help=f"Declare them in {assemble.OPDEFS} (otherwise "
+                             "just report the counts)")
+    return parser.parse_args()
+
+
+def read_modules(paths: List[Path]) -> Iterator[dict]:
+    """Object modules with code (not built-in classes)"""
+    for path in paths:
+        if path.is_dir():
+            files = sorted(p for p in path.iterdir()
+                           if p.suffix in (objfile.JSON_SUFFIX, objfile.SUFFIX))
+        else:
+            files = [path]
+        for f in files:
+            if f.suffix == objfile.SUFFIX:
+                module = objfile.decode(f.read_bytes(), str(f))
+            else:
+                module = json.loads(f.read_text())
+            if "code" in module:
+                yield module
+
+
+def instructions(words: List[int]) -> Tuple[List[int], set]:
+    """Opcodes of the instructions in method code (superinstructions
+    taken apart), and the instruction numbers that jumps go to
+    """
+    codes = assemble.INSTRS.codes
+    jumps = {assemble.INSTRS[name].code for name in ["jump", "jump_if", "jump_ifnot"]}
+    opcodes = []
+    at = {}        # Word address -> instruction number
+    jumps_to = []  # Word addresses
+    addr = 0
+    while addr < len(words):
+        at[addr] = len(opcodes)
+        instr = codes[words[addr]]
+        for part in instr.parts or [instr]:
+            opcodes.append(part.code)
+            if int(part.ops):
+                addr += 1
+                if part.code in jumps:
+                    # Relative to the word after the operand
+                    jumps_to.append(addr + 1 + words[addr])
+        addr += 1
+    at[addr] = len(opcodes)
+    return opcodes, {at[addr] for addr in jumps_to if addr in at}
+
+
+def count_pairs(modules: Iterator[dict]) -> collections.Counter:
+    """How often each pair of instruction names that could be fused
+    occurs
+    """
+    names = [instr.name for instr in assemble.INSTRS.codes]
+    pairs = collections.Counter()
+    for module in modules:
+        for method in module["code"]:
+            opcodes, targets = instructions(method["code"])
+            for i in range(len(opcodes) - 1):
+                first, second = names[opcodes[i]], names[opcodes[i + 1]]
+                if first in build_bytecode_table.TRANSFERS or i + 1 in targets:
+                    continue
+                pairs[(first, second)] += 1
+    return pairs
+
+
+def declare(opdefs: Path, chosen: List[Tuple[Tuple[str, str], int]]):
+    """Replace the superinstructions at the end of opdefs"""
+    lines = opdefs.read_text().splitlines(keepends=True)
+    header = HEADER.splitlines(keepends=True)[0]
+    if header in lines:
+        lines = lines[:lines.index(header)]
+    while lines and not lines[-1].strip():
+        lines.pop()
+    lines.append("\n")
+    lines.append(HEADER)
+    for (first, second), count in chosen:
+        lines.append(f"{first}+{second},vm_op_{first}__{second},"
+                     f"{int(assemble.INSTRS[first].ops) + int(assemble.INSTRS[second].ops)}"
+                     f"  # {count} in the code mined\n")
+    opdefs.write_text("".join(lines))
+
+
+def main():
+    args = cli()
+    pairs = count_pairs(read_modules(args.modules))
+    total = sum(pairs.values())
+    for (first, second), count in pairs.most_common():
+        print(f"{count:8} {count / total:6.1%}  {first}+{second}")
+    if args.write:
+        chosen = pairs.most_common(args.top)
+        declare(Path(assemble.OPDEFS), chosen)
+        log.info("Declared %d superinstructions in %s; rebuild the VM and reassemble",
+                 len(chosen), assemble.OPDEFS)
+
+
+if __name__ == "__main__":
+    main()
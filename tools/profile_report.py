@@ -0,0 +1,138 @@
+"""Report on a profile of a tiny_vm run (tiny_vm -P profile.json).
+
+The VM counts calls and time by (class of the receiver, vtable
+slot), since it keeps no method names; we name each method from
+the `methods` list in the class's object module, and say which
+class the code came from when it is inherited.  Then we print the
+hottest methods (by time in the method itself, unless --sort says
+otherwise), the operations dispatched, and the objects allocated
+by class.
+
+    python3 tools/profile_report.py profile.json [-L OBJ ...] [--top 20]
+
+Object modules are looked for in the directory the VM loaded from
+(recorded in the profile), then in each -L directory, then in OBJ.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import link
+import objfile
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# The VM's names for built-in classes whose object module has
+# another (OBJ/Bool.json is class Bool; builtins.c says Boolean)
+MODULE_NAMES = {"Boolean": "Bool"}
+
+SORT_KEYS = {"self": "self_seconds", "total": "seconds", "calls": "calls"}
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Hot methods, operations, and allocations from a tiny_vm profile")
+    parser.add_argument("profile", type=Path, help="JSON written by tiny_vm -P")
+    parser.add_argument("-L", "--lib", type=Path, action="append", default=[],
+                        help="Another directory of object modules")
+    parser.add_argument("--top", type=int, default=20,
+                        help="How many methods to list (0 for all)")
+    parser.add_argument("--sort", choices=sorted(SORT_KEYS), default="self",
+                        help="Order of the method table")
+    return parser.parse_args()
+
+
+class Methods:
+    """Method names and origins, from object modules"""
+
+    def __init__(self, libs: List[Path]):
+        self.libs = libs
+        self.modules: Dict[str, Optional[dict]] = {}
+
+    def module(self, class_name: str) -> Optional[dict]:
+        if class_name not in self.modules:
+            self.modules[class_name] = None
+            name = MODULE_NAMES.get(class_name, class_name)
+            for lib in self.libs:
+                try:
+                    self.modules[class_name] = link.read_module(lib, name)
+                    break
+                except (link.LinkError, objfile.ObjectFileError, ValueError):
+                    continue
+        return self.modules[class_name]
+
+    def defined_in(self, class_name: str, slot: int) -> str:
+        """The class whose code the slot holds, as far as we can
+        tell (built-in classes don't say which methods they inherit)
+        """
+        module = self.module(class_name)
+        while module and not link.is_builtin(module):
+            if slot in {method["slot"] for method in module["code"]}:
+                break
+            class_name = module["super"]
+            module = self.module(class_name)
+        return class_name
+
+    def name(self, class_name: str, slot: int) -> str:
+        """Class.method, with the class it inherits the code from"""
+        module = self.module(class_name)
+        if module is None or slot >= len(module["methods"]):
+            return f"{class_name}.<slot {slot}>"
+        name = f"{class_name}.{module['methods'][slot]}"
+        origin = self.defined_in(class_name, slot)
+        return name if origin == class_name else f"{name} (from {origin})"
+
+
+def method_table(profile: dict, methods: Methods, sort: str, top: int) -> List[str]:
+    total = profile["seconds"] or 1.0
+    rows = sorted(profile["methods"], key=lambda m: m[SORT_KEYS[sort]], reverse=True)
+    if top:
+        rows = rows[:top]
+    lines = [f"{'calls':>9} {'total ms':>9} {'self ms':>9} {'self':>6} {'us/call':>8}  method"]
+    for m in rows:
+        lines.append(f"{m['calls']:9} {m['seconds'] * 1000:9.3f} "
+                     f"{m['self_seconds'] * 1000:9.3f} {m['self_seconds'] / total:6.1%} "
+                     f"{m['seconds'] / max(m['calls'], 1) * 1e6:8.2f}  "
+                     f"{methods.name(m['class'], m['slot'])}")
+    return lines
+
+
+def count_table(counts: Dict[str, int], heading: str) -> List[str]:
+    total = sum(counts.values()) or 1
+    lines = [f"{'count':>9} {'share':>6}  {heading}"]
+    for name, count in sorted(counts.items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"{count:9} {count / total:6.1%}  {name}")
+    return lines
+
+
+def report(profile: dict, methods: Methods, sort: str = "self", top: int = 20) -> str:
+    lines = [f"{profile['dispatches']} dispatches in {profile['seconds'] * 1000:.3f} ms", ""]
+    lines.extend(method_table(profile, methods, sort, top))
+    if profile.get("untimed_calls"):
+        lines.append(f"({profile['untimed_calls']} calls to further methods not timed)")
+    lines.append("")
+    lines.extend(count_table(profile["ops"], "operation"))
+    lines.append("")
+    lines.extend(count_table(profile["allocations"], "objects allocated"))
+    return "\n".join(lines)
+
+
+def main():
+    args = cli()
+    profile = json.loads(args.profile.read_text())
+    libs = [Path(profile["lib"])] + args.lib + [ROOT / "OBJ"]
+    print(report(profile, Methods(libs), args.sort, args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Debug tracing that costs (almost) nothing when it is off.
+
+Each subsystem of the compiler and assembler has its own tracer,
+named like its module (but spelled out, since a module run as a
+script is named __main__):
+
+    trace = tracing.tracer("assemble")
+    ...
+    trace("Jump from loc %s to %s", loc, label)
+
+A disabled tracer returns after one attribute test, without
+formatting its message; in the hottest loops, test trace.on
+before building the arguments at all.  Tracing is switched on
+per subsystem, from the command line of main.py or assemble.py:
+
+    python3 assemble.py --trace assemble source.asm
+
+Messages go through the logging module at DEBUG level, to the
+logger of the same name.  Errors and warnings are not traces;
+keep reporting them with log.error and log.warning.
+"""
+
+import argparse
+import logging
+from typing import Dict, Iterable
+
+ALL = "all"
+
+
+class Tracer:
+    """Debug messages of one subsystem"""
+    __slots__ = ("name", "log", "on")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.log = logging.getLogger(name)
+        self.on = False
+
+    def __call__(self, msg: str, *args):
+        """Emit msg % args, if tracing this subsystem"""
+        if self.on:
+            self.log.debug(msg, *args)
+
+
+_TRACERS: Dict[str, Tracer] = {}
+
+
+def tracer(name: str) -> Tracer:
+    """The tracer for subsystem name, created on first use"""
+    if name not in _TRACERS:
+        _TRACERS[name] = Tracer(name)
+    return _TRACERS[name]
+
+
+def subsystems() -> list[str]:
+    return sorted(_TRACERS)
+
+
+def enable(names: Iterable[str], on: bool = True):
+    """Turn tracing on (or off) for the named subsystems.
+    'all' names every subsystem created so far.
+    """
+    names = list(names)
+    if ALL in names:
+        names = subsystems()
+    for name in names:
+        if name not in _TRACERS:
+            raise ValueError(f"No subsystem '{name}' to trace; "
+                             f"choose from {', '.join(subsystems())}")
+        trace = _TRACERS[name]
+        trace.on = on
+        if on:
+            trace.log.setLevel(logging.DEBUG)
+
+
+def add_trace_option(parser: argparse.ArgumentParser):
+    """--trace SUBSYSTEM (repeatable) for a command line;
+    pass the parsed list to enable.  Import the traced modules
+    first, so that their subsystems can be offered as choices.
+    """
+    parser.add_argument("--trace", action="append", default=[],
+                        choices=subsystems() + [ALL], metavar="SUBSYSTEM",
+                        help="Print debugging traces of a subsystem "
+                             f"({', '.join(subsystems() + [ALL])}); repeatable")
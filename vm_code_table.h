@@ -11,12 +11,30 @@
 #include "vm_state.h"
 #include "vm_ops.h"
 
+/* A superinstruction (name "a+b" in opdefs.txt) does the work
+ * of its parts, in order, in one dispatch; its operands are
+ * theirs, in the same order.  Other operations have no parts.
+ */
+#define VM_MAX_PARTS 2
+#define VM_MAX_OPERANDS VM_MAX_PARTS
+
 typedef struct {
     char *name;
     vm_Instr instr;
     int n_operands;
+    int n_parts;
+    int parts[VM_MAX_PARTS];   // Byte codes
 } op_tbl_entry;
 
 extern op_tbl_entry vm_op_bytecodes[];
 
+#ifdef VM_THREADED
+/* The direct-threaded interpreter, generated with the table:
+ * runs until halt.  Once it has started, vm_handlers holds the
+ * address of each operation's handler, by byte code.
+ */
+extern void vm_run_threaded(void);
+extern void **vm_handlers;
+#endif
+
 #endif //TINY_VM_VM_CODE_TABLE_H
@@ -68,6 +68,7 @@ typedef union u_Word {
     class_ref clazz;        // A class to be instantiated
     vm_addr code_addr;      // Saved program counter
     vm_addr frame_addr;    // Saved stack or frame pointer;
+    void *handler;          // An instruction, when threaded (vm_run_threaded)
 } vm_Word;
 
 
@@ -10,6 +10,11 @@
 #include <stdlib.h>
 #include <string.h>
 #include <assert.h>
+#include <stdint.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 
 // Set load library path before loading each class by name.
@@ -17,9 +22,14 @@
 // loads from the class name alone
 static char *PATH_PREFIX = "UNINITIALIZED LOAD PATH";
 
+// Load binary (.tvo) object modules rather than .json
+int vm_loader_binary = 0;
+
 // Address to load to (pushed forward by each load)
 // Note this is changed in vm_loader_init
 int vm_code_index = 0;  // This actually index, not address
+// Room at the start for the main code sequence
+#define MAIN_SEQUENCE_WORDS 16
 // And we need the address for methods, so ...
 vm_addr vm_current_address() {
     return &vm_code_block[vm_code_index];
@@ -61,7 +71,7 @@ void vm_loader_init(char *load_path_prefix) {
     set_loaded(the_class_Nothing);
     // We'll leave a little room for a "main" code sequence
     // at the beginning
-    vm_code_index = 16;
+    vm_code_index = MAIN_SEQUENCE_WORDS;
     // And place a dummy sequence there for now ...
     int no_main = str_literal_const("No main program loaded!\n");
     vm_code_block[0] = (vm_Word) {.instr = vm_op_const};
@@ -148,6 +158,21 @@ int read_file_fd(FILE *fd, char *file_buffer) {
 
 vm_Word *translate_method_code(cJSON *ops, int const_map[], class_ref class_map[]);
 
+/* Add a literal of the object module's constant pool to the
+ * program's, returning its index there.
+ */
+static int load_constant(char *kind, char *literal) {
+    int internal = 0;
+    if (kind[0] == 'i') {
+        internal = int_literal_const(literal);
+    } else if (kind[0] == 's') {
+        internal = str_literal_const(strdup(literal));
+    } else {
+        perror("Constant of unknown type");
+    }
+    return internal;
+}
+
 /*
  * Constants in a class file (.json) are referenced as small
  * (non-negative) integer indexes
@@ -172,14 +197,7 @@ static int remap_constants(int map[], cJSON *tree, int capacity) {
         cJSON *value_el = cJSON_GetObjectItemCaseSensitive(el, "value");
         char *kind = kind_el->valuestring;
         char *literal = value_el->valuestring;
-        int internal;
-        if (kind[0] == 'i') {
-            internal = int_literal_const(literal);
-        } else if (kind[0] == 's') {
-            internal = str_literal_const(strdup(literal));
-        } else {
-            perror("Constant of unknown type");
-        }
+        int internal = load_constant(kind, literal);
         map[literal_count] = internal;
         log_debug("Literal %s internal %d remapped to %d",
                   literal, literal_count, internal);
@@ -216,35 +234,12 @@ static int map_classes(class_ref class_map[], cJSON *tree, int capacity) {
 }
 
 
-static int load_json(char buf[]) {
-    cJSON *tree = NULL; // Tree as a whole
-    cJSON *val = NULL;  // Named value in tree
-    cJSON *el = NULL;   // Element of value
-    tree = cJSON_Parse(buf);  // Must free at end
-    if (tree == NULL) {
-        perror("load_json in vm_loader.c: Failed to parse buffer. ");
-        assert(tree);  // Will definitely abort
-    }
-
-    /* module constant index -> global constant index */
-    int constant_renumber_map[30];
-    int n_consts = remap_constants(constant_renumber_map, tree, 30);
-
-    // Mapping imported classes was here; moving AFTER we
-    // create and index this class so that it can reference itself
-
-    // Create and initialize a class object
-    // push_log_level(DEBUG);
-    char *class_name = cJSON_GetStringValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "class_name"));
-    char *super_name = cJSON_GetStringValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "super"));
+/* Create and initialize a class object, with its vtable
+ * holding the inherited methods, and add it to the loaded classes.
+ */
+static class_ref create_class(char *class_name, char *super_name,
+                              int n_fields, int n_methods, int n_inherited) {
     log_info("Class %s extends %s", class_name, super_name);
-    // Counts of methods and fields; I'm letting the assembler do the work here.
-    int n_fields = (int) cJSON_GetNumberValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "n_fields"));
-    int n_methods = (int) cJSON_GetNumberValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "n_methods"));
     log_info("Class %s has %d methods and %d fields",
              class_name, n_methods, n_fields);
     size_t class_obj_size =
@@ -268,8 +263,6 @@ static int load_json(char buf[]) {
     log_debug("Size of object header alone is %d bytes\n",
              sizeof(struct obj_header_struct));
     // Copy inherited method pointers into vtable
-    int n_inherited = (int) cJSON_GetNumberValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "n_inherited"));
     for (int i = 0; i < n_inherited; ++i) {
         the_class->vtable[i] = the_super->vtable[i];
     }
@@ -278,6 +271,41 @@ static int load_json(char buf[]) {
     set_loaded(the_class);
     // We want the class in the "loaded classes" table before loading
     // methods, because the methods might have references to the current class.
+    return the_class;
+}
+
+static int load_json(char buf[]) {
+    cJSON *tree = NULL; // Tree as a whole
+    cJSON *val = NULL;  // Named value in tree
+    cJSON *el = NULL;   // Element of value
+    tree = cJSON_Parse(buf);  // Must free at end
+    if (tree == NULL) {
+        perror("load_json in vm_loader.c: Failed to parse buffer. ");
+        assert(tree);  // Will definitely abort
+    }
+
+    /* module constant index -> global constant index */
+    int constant_renumber_map[30];
+    int n_consts = remap_constants(constant_renumber_map, tree, 30);
+
+    // Mapping imported classes was here; moving AFTER we
+    // create and index this class so that it can reference itself
+
+    // Create and initialize a class object
+    // push_log_level(DEBUG);
+    char *class_name = cJSON_GetStringValue(
+            cJSON_GetObjectItemCaseSensitive(tree, "class_name"));
+    char *super_name = cJSON_GetStringValue(
+            cJSON_GetObjectItemCaseSensitive(tree, "super"));
+    // Counts of methods and fields; I'm letting the assembler do the work here.
+    int n_fields = (int) cJSON_GetNumberValue(
+            cJSON_GetObjectItemCaseSensitive(tree, "n_fields"));
+    int n_methods = (int) cJSON_GetNumberValue(
+            cJSON_GetObjectItemCaseSensitive(tree, "n_methods"));
+    int n_inherited = (int) cJSON_GetNumberValue(
+            cJSON_GetObjectItemCaseSensitive(tree, "n_inherited"));
+    class_ref the_class = create_class(class_name, super_name,
+                                       n_fields, n_methods, n_inherited);
 
     /* module class index -> class reference,
     * with potential side effect of loading more class files.
@@ -303,77 +331,420 @@ static int load_json(char buf[]) {
     return 1;
 }
 
+/* Translate an operand of operation instr.  Constants must be
+ * renumbered since local constant number is not global constant
+ * number, and class numbers become references to loaded classes.
+ */
+static vm_Word translate_operand(vm_Instr instr, int operand,
+                                 int const_map[], class_ref class_map[]) {
+    log_debug("[%d] Operand: %d",
+              vm_current_address() - vm_code_block,
+              operand);
+    if (instr == vm_op_const) {
+        int const_index;
+        if (operand == CODE_FALSE) {
+            const_index = lookup_const_index("$false");
+        } else if (operand == CODE_TRUE) {
+            const_index = lookup_const_index("$true");
+        } else if (operand == CODE_NOTHING) {
+            const_index = lookup_const_index("$nothing");
+        } else {
+            assert(operand >= 0);
+            const_index = const_map[operand];
+        }
+        assert(const_index);
+        check_health_object(get_const_value(const_index));
+        return (vm_Word) {.intval=  const_index};
+    } else if(instr == vm_op_new || instr == vm_op_is_instance) {
+        class_ref clazz = class_map[operand];
+        log_debug("Translating allocation of new '%s'",
+                  clazz->header.class_name);
+        return (vm_Word) {.clazz = clazz};
+    }
+    return (vm_Word) {.intval = operand};
+}
+
+/* Translate one instruction: its opcode, and its operands if it
+ * has any.  The operands of a superinstruction are those of its
+ * parts, each translated as its part's.
+ */
+static void translate_instruction(int opcode, int operands[],
+                                  int const_map[], class_ref class_map[]) {
+    op_tbl_entry *op = &vm_op_bytecodes[opcode];
+    log_debug("[%d] Op: %d (%s)",
+           vm_current_address() - vm_code_block,
+           opcode, op->name);
+    vm_code_block[vm_code_index++] = (vm_Word) {.instr = op->instr};
+    if (! op->n_parts) {
+        if (op->n_operands) {
+            vm_code_block[vm_code_index++] =
+                    translate_operand(op->instr, operands[0], const_map, class_map);
+        }
+        return;
+    }
+    int next = 0;
+    for (int i = 0; i < op->n_parts; ++i) {
+        op_tbl_entry *part = &vm_op_bytecodes[op->parts[i]];
+        if (part->n_operands) {
+            vm_code_block[vm_code_index++] =
+                    translate_operand(part->instr, operands[next++], const_map, class_map);
+        }
+    }
+}
+
 vm_Word *translate_method_code(cJSON *ops, int const_map[], class_ref class_map[]) {
-    // Translating code.  Constants must be renumbered since local
-    // constant number is not global constant number.
     assert (cJSON_IsArray(ops));
     cJSON *el = ops->child;
     vm_Word *method_start_address = vm_current_address();
     while (el) {
         assert(cJSON_IsNumber(el));
         int opcode = el->valueint;
-        log_debug("[%d] Op: %d (%s)",
-               vm_current_address() - vm_code_block,
-               opcode, vm_op_bytecodes[opcode].name);
-        vm_code_block[vm_code_index++] = (vm_Word)
-                {.instr = vm_op_bytecodes[opcode].instr};
-
-        if (vm_op_bytecodes[opcode].n_operands) {
-            // Max is 1 operand!
+        int operands[VM_MAX_OPERANDS];
+        for (int i = 0; i < vm_op_bytecodes[opcode].n_operands; ++i) {
             el = el->next;
-            int operand = el->valueint;
-            log_debug("[%d] Operand: %d",
-                      vm_current_address() - vm_code_block,
-                      operand);
-            if (vm_op_bytecodes[opcode].instr == vm_op_const) {
-                int const_index;
-                if (operand == CODE_FALSE) {
-                    const_index = lookup_const_index("$false");
-                } else if (operand == CODE_TRUE) {
-                    const_index = lookup_const_index("$true");
-                } else if (operand == CODE_NOTHING) {
-                    const_index = lookup_const_index("$nothing");
-                } else {
-                    assert(operand >= 0);
-                    const_index = const_map[operand];
-                }
-                assert(const_index);
-                check_health_object(get_const_value(const_index));
-                vm_code_block[vm_code_index++] = (vm_Word)
-                        {.intval=  const_index};
-            } else if(vm_op_bytecodes[opcode].instr == vm_op_new
-                      || vm_op_bytecodes[opcode].instr == vm_op_is_instance) {
-                class_ref clazz = class_map[operand];
-                log_debug("Translating allocation of new '%s'",
-                          clazz->header.class_name);
-                vm_code_block[vm_code_index++] = (vm_Word)
-                        {.clazz = clazz};
-            } else {
-                vm_code_block[vm_code_index++] = (vm_Word)
-                        {.intval = operand};
-            }
+            assert(el);
+            operands[i] = el->valueint;
         }
+        translate_instruction(opcode, operands, const_map, class_map);
         el = el->next;
     }
     return method_start_address;
 }
 
 
+/* Byte code of instruction function instr, or -1 */
+static int opcode_of(vm_Instr instr) {
+    for (int i = 0; vm_op_bytecodes[i].name; ++i) {
+        if (vm_op_bytecodes[i].instr == instr) {
+            return i;
+        }
+    }
+    return -1;
+}
+
+/* Thread n_words of code, or up to the first word that is not
+ * an instruction (the end of the main sequence)
+ */
+static void thread_code(vm_Word *code, int n_words, void *handlers[]) {
+    int i = 0;
+    while (i < n_words) {
+        int opcode = opcode_of(code[i].instr);
+        if (opcode < 0) {
+            break;
+        }
+        code[i].handler = handlers[opcode];
+        i += 1 + vm_op_bytecodes[opcode].n_operands;
+    }
+}
+
+void vm_loader_thread(void *handlers[]) {
+    thread_code(vm_code_block, MAIN_SEQUENCE_WORDS, handlers);
+    thread_code(vm_code_block + MAIN_SEQUENCE_WORDS,
+                vm_code_index - MAIN_SEQUENCE_WORDS, handlers);
+    for (struct builtin_code *b = vm_builtin_code; b->code; ++b) {
+        thread_code(b->code, b->n_words, handlers);
+    }
+}
+
 
-/* Load an "object" file (json format) from
- * a class name.
+/* Binary object modules (.tvo, see objfile.py) hold what the
+ * .json module does, as 32-bit little-endian words.  A string is
+ * its length, its bytes, a null, and padding to a whole word.
+ * We map the file and read it in place, without copying or
+ * parsing: strings are used where they lie, and method code is
+ * translated straight from the mapping.  Linked program images
+ * (see link.py) are read the same way.
+ */
+#define TVO_MAGIC "TVMO"
+#define TVO_VERSION 1
+#define TVI_MAGIC "TVMI"
+#define TVI_VERSION 1
+
+struct tvo_reader {
+    char *path;
+    const int32_t *start;
+    const int32_t *pos;    // Next word to read
+    const int32_t *end;
+};
+
+static void tvo_check(struct tvo_reader *r, int ok, char *what) {
+    if (! ok) {
+        log_error("%s: bad object module (%s at word %d)",
+                  r->path, what, (int) (r->pos - r->start));
+        assert(ok);
+    }
+}
+
+static int tvo_int(struct tvo_reader *r) {
+    tvo_check(r, r->pos < r->end, "truncated");
+    return *r->pos++;
+}
+
+static char *tvo_string(struct tvo_reader *r) {
+    int len = tvo_int(r);
+    int words = len / 4 + 1;   // Bytes, null, and padding
+    tvo_check(r, len >= 0 && words <= r->end - r->pos, "truncated string");
+    char *s = (char *) r->pos;
+    tvo_check(r, s[len] == 0, "unterminated string");
+    r->pos += words;
+    return s;
+}
+
+/* A count of code words and the words; returns the first */
+static const int32_t *tvo_words(struct tvo_reader *r, int *n_words) {
+    *n_words = tvo_int(r);
+    tvo_check(r, *n_words >= 0 && *n_words <= r->end - r->pos, "truncated code");
+    const int32_t *words = r->pos;
+    r->pos += *n_words;
+    return words;
+}
+
+/* Magic number and version; 0 if it's not what we expect */
+static int tvo_magic(struct tvo_reader *r, char *magic, int version) {
+    tvo_check(r, r->end - r->pos >= 2
+                 && memcmp(r->pos, magic, 4) == 0, "magic number");
+    r->pos++;
+    int found = tvo_int(r);
+    if (found != version) {
+        log_error("%s: %s version %d, but this VM reads version %d",
+                  r->path, magic, found, version);
+        return 0;
+    }
+    return 1;
+}
+
+/* Map a file for reading; 0 if we can't */
+static int tvo_open(char *path, struct tvo_reader *r) {
+    int fd = open(path, O_RDONLY);
+    if (fd < 0) {
+        perror("Failed to open file");
+        return 0;
+    }
+    struct stat st;
+    if (fstat(fd, &st) < 0 || st.st_size == 0 || st.st_size % 4 != 0) {
+        log_error("%s: not a binary object module", path);
+        close(fd);
+        return 0;
+    }
+    void *mapped = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if (mapped == MAP_FAILED) {
+        perror("Failed to map file");
+        return 0;
+    }
+    *r = (struct tvo_reader) {
+            .path = path,
+            .start = (const int32_t *) mapped,
+            .pos = (const int32_t *) mapped,
+            .end = (const int32_t *) mapped + st.st_size / 4
+    };
+    return 1;
+}
+
+/* Strings we keep (class names, string constants) are copied
+ * by the loader, so nothing points into the mapping after this.
+ */
+static void tvo_close(struct tvo_reader *r) {
+    munmap((void *) r->start, (r->end - r->start) * sizeof(int32_t));
+}
+
+/* Translate the methods of a class: a count, then for each
+ * the name, vtable slot, and code words.
+ */
+static void translate_tvo_methods(struct tvo_reader *r, class_ref the_class,
+                                  int n_methods,
+                                  int const_map[], class_ref class_map[]) {
+    for (int n = tvo_int(r); n > 0; --n) {
+        char *method_name = tvo_string(r);
+        int method_slot = tvo_int(r);
+        tvo_check(r, method_slot >= 0 && method_slot < n_methods, "method slot");
+        log_debug("Method %s in slot %d", method_name, method_slot);
+        int n_words;
+        const int32_t *words = tvo_words(r, &n_words);
+        the_class->vtable[method_slot] = vm_current_address();
+        for (int i = 0; i < n_words; ++i) {
+            int opcode = words[i];
+            int operands[VM_MAX_OPERANDS];
+            for (int k = 0; k < vm_op_bytecodes[opcode].n_operands; ++k) {
+                tvo_check(r, ++i < n_words, "missing operand");
+                operands[k] = words[i];
+            }
+            translate_instruction(opcode, operands, const_map, class_map);
+        }
+    }
+}
+
+/* A constant pool: a count, then kind and value of each.
+ * Returns the map from module (or image) constant index to
+ * program constant index, which the caller frees.
+ */
+static int *load_tvo_constants(struct tvo_reader *r) {
+    int n_consts = tvo_int(r);
+    tvo_check(r, n_consts >= 0, "constant count");
+    int *const_map = malloc((n_consts + 1) * sizeof(int));
+    for (int i = 0; i < n_consts; ++i) {
+        char *kind = tvo_string(r);
+        char *literal = tvo_string(r);
+        const_map[i] = load_constant(kind, literal);
+        log_debug("Literal %s internal %d remapped to %d",
+                  literal, i, const_map[i]);
+    }
+    return const_map;
+}
+
+/* The binary counterpart of load_json, in the same order:
+ * constants, the class itself, imports (which may load other
+ * classes), then method code.
+ */
+static int load_tvo(struct tvo_reader *r) {
+    if (! tvo_magic(r, TVO_MAGIC, TVO_VERSION)) {
+        return 0;
+    }
+    char *class_name = tvo_string(r);
+    char *super_name = tvo_string(r);
+    int n_fields = tvo_int(r);
+    int n_methods = tvo_int(r);
+    int n_inherited = tvo_int(r);
+    // Imports, method names, and field names, in that order;
+    // only the imports matter here, and only after the class exists.
+    const int32_t *imports = r->pos;
+    for (int list = 0; list < 3; ++list) {
+        for (int n = tvo_int(r); n > 0; --n) {
+            tvo_string(r);
+        }
+    }
+    int *const_map = load_tvo_constants(r);
+    const int32_t *code = r->pos;
+
+    class_ref the_class = create_class(class_name, super_name,
+                                       n_fields, n_methods, n_inherited);
+    r->pos = imports;
+    int n_classes = tvo_int(r);
+    tvo_check(r, n_classes >= 0, "import count");
+    class_ref *class_map = malloc((n_classes + 1) * sizeof(class_ref));
+    for (int i = 0; i < n_classes; ++i) {
+        class_map[i] = ensure_loaded(tvo_string(r));
+    }
+
+    r->pos = code;
+    translate_tvo_methods(r, the_class, n_methods, const_map, class_map);
+    free(const_map);
+    free(class_map);
+    return 1;
+}
+
+static int load_tvo_path(char *path) {
+    struct tvo_reader r;
+    if (! tvo_open(path, &r)) {
+        return 0;
+    }
+    int ok = load_tvo(&r);
+    tvo_close(&r);
+    return ok;
+}
+
+/* A linked program image holds every class the program needs,
+ * with one constant pool and one class table for all of them, so
+ * there is no searching the load path and no per-class remapping.
+ * Classes come superclass first.  Built-in classes are named in
+ * the class table (with an empty superclass name) but not defined.
+ * We create all the classes, then translate their code, since
+ * code may refer to any class of the image.
+ */
+struct image_class {
+    const int32_t *methods;   // Where its methods are in the image
+    int n_methods;
+    int n_inherited;
+};
+
+static char *load_image(struct tvo_reader *r) {
+    if (! tvo_magic(r, TVI_MAGIC, TVI_VERSION)) {
+        return 0;
+    }
+    char *main_class = strdup(tvo_string(r));
+    int *const_map = load_tvo_constants(r);
+    int n_classes = tvo_int(r);
+    tvo_check(r, n_classes >= 0, "class count");
+    class_ref *class_map = malloc((n_classes + 1) * sizeof(class_ref));
+    struct image_class *classes = malloc((n_classes + 1) * sizeof(struct image_class));
+    for (int i = 0; i < n_classes; ++i) {
+        char *class_name = tvo_string(r);
+        char *super_name = tvo_string(r);
+        int n_fields = tvo_int(r);
+        classes[i].n_methods = tvo_int(r);
+        classes[i].n_inherited = tvo_int(r);
+        classes[i].methods = r->pos;
+        if (super_name[0] == 0) {
+            class_map[i] = find_loaded(class_name);
+            tvo_check(r, class_map[i] != 0, "unknown built-in class");
+            classes[i].methods = 0;
+        } else {
+            tvo_check(r, find_loaded(class_name) == 0, "class loaded twice");
+            tvo_check(r, find_loaded(super_name) != 0, "superclass after subclass");
+            // The superclass's vtable is not filled in yet; we copy
+            // the inherited methods when we translate.
+            class_map[i] = create_class(class_name, super_name, n_fields,
+                                        classes[i].n_methods, 0);
+        }
+        // Skip the methods for now
+        for (int n = tvo_int(r); n > 0; --n) {
+            int n_words;
+            tvo_string(r);
+            tvo_int(r);
+            tvo_words(r, &n_words);
+        }
+    }
+    tvo_check(r, r->pos == r->end, "data after the last class");
+    for (int i = 0; i < n_classes; ++i) {
+        if (! classes[i].methods) {
+            continue;   // Built in
+        }
+        class_ref the_class = class_map[i];
+        for (int m = 0; m < classes[i].n_inherited; ++m) {
+            the_class->vtable[m] = the_class->header.super->vtable[m];
+        }
+        r->pos = classes[i].methods;
+        translate_tvo_methods(r, the_class, classes[i].n_methods,
+                              const_map, class_map);
+    }
+    free(const_map);
+    free(class_map);
+    free(classes);
+    return main_class;
+}
+
+char *vm_load_image(char *path) {
+    struct tvo_reader r;
+    log_info("Loading program image %s", path);
+    if (! tvo_open(path, &r)) {
+        return 0;
+    }
+    char *main_class = load_image(&r);
+    tvo_close(&r);
+    return main_class;
+}
+
+
+
+/* Load an "object" file (json format, or binary if
+ * vm_loader_binary is set) from a class name.
  */
 #define PATHBUFSIZE 4096
 extern int vm_load_class(char *classname) {
     char load_path[PATHBUFSIZE];
     // Use printf for multi-concat
-    snprintf(load_path, PATHBUFSIZE, "%s/%s.json", PATH_PREFIX, classname);
+    snprintf(load_path, PATHBUFSIZE, "%s/%s%s", PATH_PREFIX, classname,
+             vm_loader_binary ? ".tvo" : ".json");
     log_info("Loading %s", load_path);
     return vm_load_from_path(load_path);
 }
 
 
 int vm_load_from_path(char *path) {
+    size_t len = strlen(path);
+    if (len > 4 && strcmp(path + len - 4, ".tvo") == 0) {
+        return load_tvo_path(path);
+    }
     char file_buffer[FILE_BUFFER_CAPACITY];
     FILE *fd = fopen(path, "r");
     if (! fd) {
@@ -10,6 +10,11 @@
  */
 extern int vm_code_index;
 
+/* Load binary (.tvo) object modules by class name,
+ * rather than .json.  Set before loading.
+ */
+extern int vm_loader_binary;
+
 /* Initialize loader (loads built-in classes)
  */
 extern void vm_loader_init(char *load_path_prefix);
@@ -29,11 +34,18 @@ extern class_ref find_loaded(char *name);
  */
 extern int vm_load_class(char *classname);
 
-/* Load an "object" file, which should be in JSON format.
+/* Load an "object" file, in JSON format or, if the path
+ * ends with .tvo, binary.
  * Return 1 = success, 0 = failure.
  */
 extern int vm_load_from_path(char *path);
 
+/* Load a linked program image (see link.py), which holds every
+ * class of the program.  Returns the name of the main class,
+ * or 0 on failure.
+ */
+extern char *vm_load_image(char *path);
+
 /* Constants in method bytecode will be small non-negative
  * integers corresponding to the "constants" list in the
  * object code json, or chosen from this fixed set of
@@ -46,4 +58,10 @@ extern int vm_load_from_path(char *path);
 #define CODE_FALSE (-2)
 #define CODE_TRUE (-3)
 
+/* For the threaded VM (vm_run_threaded): replace the function
+ * of each instruction, in all the code there is, by the address
+ * of its handler, given by byte code.  Once, after loading.
+ */
+extern void vm_loader_thread(void *handlers[]);
+
 #endif //TINY_VM_VM_LOADER_H
@@ -5,6 +5,7 @@
 #include "vm_ops.h"
 #include "vm_state.h"
 #include "builtins.h"  // For literals lit_true, lit_false, nothing
+#include "vm_profile.h"
 #include "logger.h"
 #include <stdlib.h>
 #include <stdio.h>
@@ -68,8 +69,7 @@ extern void vm_op_jump_ifnot() {
  * next word in the instruction stream should
  * be the index of the native_method in the vtable.
  */
-extern void vm_op_methodcall(void) {
-    int method_index = vm_fetch_next().intval;
+static void call_method(int method_index) {
     // New "this" will be receiver object
     vm_addr new_fp = vm_sp;
     // Save program counter for return
@@ -85,9 +85,16 @@ extern void vm_op_methodcall(void) {
     check_health_class(clazz);
     vm_addr method_addr = clazz->vtable[method_index];
     vm_pc = method_addr;
+    if (vm_profiling) {
+        vm_profile_call(clazz, method_index);
+    }
     return;
 }
 
+extern void vm_op_methodcall(void) {
+    call_method(vm_fetch_next().intval);
+}
+
 /* Trampoline to a native method.
  * Wrap this inside an interpreted method
  * to handle the frame layout properly.
@@ -134,6 +141,9 @@ extern void vm_op_return() {
     vm_pc = vm_frame_pop_word().code_addr;
     vm_sp -= arity;
     *vm_sp = return_value;
+    if (vm_profiling) {
+        vm_profile_return();
+    }
     return;
 }
 
@@ -160,6 +170,9 @@ extern obj_ref vm_new_obj(class_ref clazz) {
     for (int i=0; i < clazz->header.n_fields; ++i) {
         new_thing->fields[i] = nothing;
     }
+    if (vm_profiling) {
+        vm_profile_alloc(clazz);
+    }
     return new_thing;
 }
 
@@ -307,3 +320,93 @@ extern void vm_op_store_field() {
     target_obj->fields[field_slot] = value;
     // pop_log_level();
 }
+
+
+/* ========  Int arithmetic and comparison =========== */
+
+/* Each of these is "call Int:m" for one method m of Int, whose
+ * slot in the vtable is fixed (builtins.c).  When the receiver
+ * (at the top of the stack) and the argument below it are both
+ * Int, the operation is done here, without a call; otherwise we
+ * make the call, so that other classes get their own method.
+ *
+ * int_plus: [other this] -> [this + other]
+ */
+enum int_method_slots {
+    INT_EQUALS = 3, INT_LESS, INT_PLUS, INT_MINUS, INT_MULTIPLY, INT_DIVIDE
+};
+
+/* Are the receiver and argument of a binary method both Int? */
+static inline int int_operands(obj_Int *this_int, obj_Int *other_int) {
+    obj_ref this = vm_sp->obj;
+    obj_ref other = (vm_sp - 1)->obj;
+    check_health_object(this);
+    check_health_object(other);
+    if (this->header.clazz != the_class_Int || other->header.clazz != the_class_Int) {
+        return 0;
+    }
+    *this_int = (obj_Int) this;
+    *other_int = (obj_Int) other;
+    return 1;
+}
+
+/* Replace the receiver and argument by the result, as return 1 would */
+static inline void int_result(obj_ref result) {
+    --vm_sp;
+    vm_sp->obj = result;
+}
+
+extern void vm_op_int_equals(void) {
+    obj_Int this, other;
+    if (int_operands(&this, &other)) {
+        int_result(this->value == other->value ? lit_true : lit_false);
+    } else {
+        call_method(INT_EQUALS);
+    }
+}
+
+extern void vm_op_int_less(void) {
+    obj_Int this, other;
+    if (int_operands(&this, &other)) {
+        int_result(this->value < other->value ? lit_true : lit_false);
+    } else {
+        call_method(INT_LESS);
+    }
+}
+
+extern void vm_op_int_plus(void) {
+    obj_Int this, other;
+    if (int_operands(&this, &other)) {
+        int_result(new_int(this->value + other->value));
+    } else {
+        call_method(INT_PLUS);
+    }
+}
+
+extern void vm_op_int_minus(void) {
+    obj_Int this, other;
+    if (int_operands(&this, &other)) {
+        int_result(new_int(this->value - other->value));
+    } else {
+        call_method(INT_MINUS);
+    }
+}
+
+extern void vm_op_int_multiply(void) {
+    obj_Int this, other;
+    if (int_operands(&this, &other)) {
+        int_result(new_int(this->value * other->value));
+    } else {
+        call_method(INT_MULTIPLY);
+    }
+}
+
+/* Division by zero is left to Int:divide */
+extern void vm_op_int_divide(void) {
+    obj_Int this, other;
+    if (int_operands(&this, &other) && other->value != 0) {
+        int_result(new_int(this->value / other->value));
+    } else {
+        call_method(INT_DIVIDE);
+    }
+}
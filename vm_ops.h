@@ -102,6 +102,18 @@ extern void vm_op_roll();  // Roll suffix of stack
 extern void vm_op_store();  // Store into local variable at fp+n
 extern void vm_op_load();   // Load from local variable at fp+n
 
+/* Int arithmetic and comparison: call Int:equals, Int:less, ...,
+ * done without the call when receiver and argument are both Int.
+ *
+ * int_plus: [other this] -> [this + other]
+ */
+extern void vm_op_int_equals(void);
+extern void vm_op_int_less(void);
+extern void vm_op_int_plus(void);
+extern void vm_op_int_minus(void);
+extern void vm_op_int_multiply(void);
+extern void vm_op_int_divide(void);
+
 /* Fields of objects */
 extern void vm_op_load_field();  // Load from field of object
 // store_field n: [value target] -> [], target.fields[n] = value
@@ -0,0 +1,204 @@
+/*  Profiling a run of the VM: what is counted, and
+ *  the JSON we write at the end.  See vm_profile.h.
+ */
+
+#include "vm_profile.h"
+#include "vm_state.h"
+#include "vm_code_table.h"
+#include "logger.h"
+#include <cjson/cJSON.h>
+#include <assert.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+int vm_profiling = 0;
+long vm_profile_ops[VM_PROFILE_MAX_OPS];
+
+static double now(void) {
+    struct timespec t;
+    clock_gettime(CLOCK_MONOTONIC, &t);
+    return t.tv_sec + t.tv_nsec / 1e9;
+}
+
+static double started;
+static double elapsed;
+
+/* ---------- Operations ---------- */
+
+/* Byte code of each operation's function, found by hashing the
+ * function's address (the op table is too long to search on
+ * every step).
+ */
+#define OP_HASH_SLOTS 128   // Power of two, well over the number of ops
+static vm_Instr op_hash_instr[OP_HASH_SLOTS];
+static int op_hash_code[OP_HASH_SLOTS];
+static int n_ops = 0;
+
+static int op_hash(vm_Instr instr) {
+    return (int) (((unsigned long) instr >> 4) & (OP_HASH_SLOTS - 1));
+}
+
+static void op_hash_init(void) {
+    for (n_ops = 0; vm_op_bytecodes[n_ops].name; ++n_ops) {
+        assert(n_ops < VM_PROFILE_MAX_OPS);
+        int h = op_hash(vm_op_bytecodes[n_ops].instr);
+        while (op_hash_instr[h]) {
+            h = (h + 1) & (OP_HASH_SLOTS - 1);
+        }
+        op_hash_instr[h] = vm_op_bytecodes[n_ops].instr;
+        op_hash_code[h] = n_ops;
+    }
+}
+
+void vm_profile_op(vm_Instr instr) {
+    int h = op_hash(instr);
+    while (op_hash_instr[h] != instr) {
+        assert(op_hash_instr[h]);   // Not an operation?
+        h = (h + 1) & (OP_HASH_SLOTS - 1);
+    }
+    vm_profile_ops[op_hash_code[h]]++;
+}
+
+/* ---------- Methods ---------- */
+
+struct method_profile {
+    class_ref clazz;
+    int slot;
+    long calls;
+    double seconds;       // In the method and what it calls
+    double self_seconds;  // In the method alone
+};
+
+static struct method_profile methods[VM_PROFILE_MAX_METHODS];
+static int n_methods = 0;
+
+/* Calls in progress, innermost last.  Each frame takes at
+ * least three words of the frame stack, so this can't overflow
+ * before the frame stack does.
+ */
+struct call_profile {
+    struct method_profile *method;
+    double started;
+    double in_callees;
+};
+static struct call_profile calls[FRAME_CAPACITY / 3];
+static int n_calls = 0;
+static int untimed_calls = 0;  // Made after methods[] was full
+
+static struct method_profile *method_profile(class_ref clazz, int slot) {
+    for (int i = 0; i < n_methods; ++i) {
+        if (methods[i].clazz == clazz && methods[i].slot == slot) {
+            return &methods[i];
+        }
+    }
+    if (n_methods == VM_PROFILE_MAX_METHODS) {
+        return 0;
+    }
+    methods[n_methods] = (struct method_profile) {.clazz = clazz, .slot = slot};
+    return &methods[n_methods++];
+}
+
+void vm_profile_call(class_ref clazz, int slot) {
+    assert(n_calls < FRAME_CAPACITY / 3);
+    struct method_profile *method = method_profile(clazz, slot);
+    if (method) {
+        method->calls++;
+    } else {
+        // Timed only as part of its caller
+        untimed_calls++;
+    }
+    calls[n_calls++] = (struct call_profile) {.method = method, .started = now()};
+}
+
+void vm_profile_return(void) {
+    if (n_calls == 0) {
+        return;
+    }
+    struct call_profile *call = &calls[--n_calls];
+    double seconds = now() - call->started;
+    if (call->method) {
+        call->method->seconds += seconds;
+        call->method->self_seconds += seconds - call->in_callees;
+    }
+    if (n_calls > 0) {
+        calls[n_calls - 1].in_callees += seconds;
+    }
+}
+
+/* ---------- Allocation ---------- */
+
+struct alloc_profile {
+    class_ref clazz;
+    long objects;
+};
+
+static struct alloc_profile allocs[VM_PROFILE_MAX_CLASSES];
+static int n_allocs = 0;
+
+void vm_profile_alloc(class_ref clazz) {
+    for (int i = 0; i < n_allocs; ++i) {
+        if (allocs[i].clazz == clazz) {
+            allocs[i].objects++;
+            return;
+        }
+    }
+    if (n_allocs < VM_PROFILE_MAX_CLASSES) {
+        allocs[n_allocs++] = (struct alloc_profile) {.clazz = clazz, .objects = 1};
+    }
+}
+
+/* ---------- Reporting ---------- */
+
+void vm_profile_start(void) {
+    op_hash_init();
+    vm_profiling = 1;
+    started = now();
+}
+
+static cJSON *profile_json(const char *load_library) {
+    cJSON *profile = cJSON_CreateObject();
+    cJSON_AddStringToObject(profile, "lib", load_library);
+    cJSON_AddNumberToObject(profile, "seconds", elapsed);
+    cJSON_AddNumberToObject(profile, "dispatches", (double) vm_dispatches);
+    cJSON *ops = cJSON_AddObjectToObject(profile, "ops");
+    for (int i = 0; i < n_ops; ++i) {
+        if (vm_profile_ops[i]) {
+            cJSON_AddNumberToObject(ops, vm_op_bytecodes[i].name, (double) vm_profile_ops[i]);
+        }
+    }
+    cJSON *method_list = cJSON_AddArrayToObject(profile, "methods");
+    for (int i = 0; i < n_methods; ++i) {
+        cJSON *method = cJSON_CreateObject();
+        cJSON_AddStringToObject(method, "class", methods[i].clazz->header.class_name);
+        cJSON_AddNumberToObject(method, "slot", methods[i].slot);
+        cJSON_AddNumberToObject(method, "calls", (double) methods[i].calls);
+        cJSON_AddNumberToObject(method, "seconds", methods[i].seconds);
+        cJSON_AddNumberToObject(method, "self_seconds", methods[i].self_seconds);
+        cJSON_AddItemToArray(method_list, method);
+    }
+    cJSON_AddNumberToObject(profile, "untimed_calls", untimed_calls);
+    cJSON *alloc_counts = cJSON_AddObjectToObject(profile, "allocations");
+    for (int i = 0; i < n_allocs; ++i) {
+        cJSON_AddNumberToObject(alloc_counts, allocs[i].clazz->header.class_name,
+                                (double) allocs[i].objects);
+    }
+    return profile;
+}
+
+int vm_profile_dump(const char *path, const char *load_library) {
+    elapsed = now() - started;
+    vm_profiling = 0;
+    FILE *f = fopen(path, "w");
+    if (! f) {
+        log_error("Can't write profile to %s\n", path);
+        return 0;
+    }
+    cJSON *profile = profile_json(load_library);
+    char *text = cJSON_Print(profile);
+    fprintf(f, "%s\n", text);
+    fclose(f);
+    free(text);
+    cJSON_Delete(profile);
+    return 1;
+}
@@ -0,0 +1,46 @@
+//
+// Profiling a run of the VM (tiny_vm -P profile.json):
+// operations dispatched, calls and time by method, and objects
+// allocated by class.  Nothing is counted unless vm_profiling
+// is set, so a run without -P pays one test per hook.  A build
+// without VM_PROFILER (cmake -DVM_PROFILER=OFF) leaves out the
+// hooks on each dispatch, and the dispatch count, altogether.
+//
+// Methods are (class of the receiver, vtable slot); the loader
+// keeps no method names, so tools/profile_report.py finds them
+// in the object modules.
+//
+
+#ifndef TINY_VM_VM_PROFILE_H
+#define TINY_VM_VM_PROFILE_H
+
+#include "vm_core.h"
+
+#define VM_PROFILE_MAX_OPS      64   // Byte codes
+#define VM_PROFILE_MAX_METHODS  512  // (class, slot) pairs called
+#define VM_PROFILE_MAX_CLASSES  128  // Classes allocated
+
+extern int vm_profiling;
+
+/* Dispatches by byte code */
+extern long vm_profile_ops[VM_PROFILE_MAX_OPS];
+
+/* Start counting (and the clock) */
+extern void vm_profile_start(void);
+
+/* An operation dispatched through the op table; the threaded
+ * interpreter counts vm_profile_ops[byte code] itself.
+ */
+extern void vm_profile_op(vm_Instr instr);
+
+/* A method call, once the new frame is made, and its return */
+extern void vm_profile_call(class_ref clazz, int slot);
+extern void vm_profile_return(void);
+
+/* An object made by vm_new_obj */
+extern void vm_profile_alloc(class_ref clazz);
+
+/* Stop the clock and write the profile as JSON; 0 if we couldn't */
+extern int vm_profile_dump(const char *path, const char *load_library);
+
+#endif //TINY_VM_VM_PROFILE_H
@@ -5,6 +5,7 @@
 
 #include "vm_state.h"
 #include "vm_code_table.h"
+#include "vm_profile.h"
 #include "logger.h"
 #include "builtins.h"  // For debugging only
 #include <assert.h>
@@ -17,6 +18,7 @@ vm_Word vm_code_block[CODE_CAPACITY];
 vm_addr vm_pc =   &vm_code_block[0];
 int vm_run_state = VM_RUNNING;
 enum LOG_LEVEL vm_logging = INFO;
+long vm_dispatches = 0;
 
 char *guess_description(vm_Word w);
 
@@ -217,6 +219,11 @@ char *guess_description(vm_Word w) {
             char *name = vm_op_bytecodes[i].name;
             return name;
         }
+#ifdef VM_THREADED
+        if (vm_handlers && vm_handlers[i] == w.handler) {
+            return vm_op_bytecodes[i].name;
+        }
+#endif
     }
     /*  A small integer constant? */
     if (w.intval >= -1000 && w.intval <= 1000) {
@@ -285,6 +292,12 @@ void vm_step() {
     vm_Instr instr = vm_fetch_next().instr;
     char *name = guess_description((vm_Word) instr);
     log_debug("Step:  %s",name );
+#ifdef VM_PROFILER
+    vm_dispatches++;
+    if (vm_profiling) {
+        vm_profile_op(instr);
+    }
+#endif
     (*instr)();
     health_check_builtins();
     stack_dump(8);
@@ -292,6 +305,10 @@ void vm_step() {
 
 
 void vm_run() {
+#ifdef VM_THREADED
+    vm_run_threaded();
+    return;
+#endif
     vm_run_state = VM_RUNNING;
     // push_log_level(DEBUG);
     while (vm_run_state == VM_RUNNING) {
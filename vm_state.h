@@ -118,4 +118,9 @@ extern obj_ref get_const_value(int index);
 /* Execution control */
 void vm_run();
 
+/* Instructions dispatched since the VM started (a superinstruction
+ * is one dispatch)
+ */
+extern long vm_dispatches;
+
 #endif //TINY_VM_VM_STATE_H